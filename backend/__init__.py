@@ -1,5 +1,8 @@
 import os
 
+from backend import cache
 from backend.omdb_client_wrapper import OMDBClientWrapper
 
-movie_api_client = OMDBClientWrapper(os.getenv("OMDB_APIKEY"))
+movie_api_client = OMDBClientWrapper(os.getenv("OMDB_APIKEY"), cache_path=os.getenv("OMDB_CACHE_PATH"))
+
+cache_backend = cache.from_url(os.getenv("CACHE_URL"))
@@ -12,9 +12,29 @@ class GetRequestInvalid(error.Error):
     pass
 
 
+class GetManyRequestInvalid(error.Error):
+    pass
+
+
+class ListRequestInvalid(error.Error):
+    pass
+
+
+GET_MANY_LIMIT = 100
+LIST_LIMIT = 100
+SEARCH_LIMIT = 50
+
+
 class ListRequest(messages.Message):
     limit = messages.IntegerField(1, default=10)
     offset = messages.IntegerField(2, default=0)
+    cursor = messages.StringField(3)
+    genre = messages.StringField(4)
+    language = messages.StringField(5)
+    year = messages.IntegerField(6)
+    decade = messages.IntegerField(7)
+    min_rating = messages.FloatField(8)
+    sort = messages.StringField(9, default="title")
 
 
 class ListResult(messages.Message):
@@ -25,6 +45,16 @@ class ListResult(messages.Message):
 
 class ListResponse(messages.Message):
     movies = messages.MessageField(ListResult, 1, repeated=True)
+    next_cursor = messages.StringField(2)
+
+
+class SearchRequest(messages.Message):
+    query = messages.StringField(1, required=True)
+    limit = messages.IntegerField(2, default=10)
+
+
+class SearchResponse(messages.Message):
+    movies = messages.MessageField(ListResult, 1, repeated=True)
 
 
 class RatingResult(messages.Message):
@@ -67,6 +97,21 @@ class GetResponse(messages.Message):
     created = messages.StringField(27)
 
 
+class GetManyRequest(messages.Message):
+    ids = messages.StringField(1, repeated=True)
+
+
+class GetManyError(messages.Message):
+    id = messages.StringField(1)
+    error_name = messages.StringField(2)
+    message = messages.StringField(3)
+
+
+class GetManyResponse(messages.Message):
+    movies = messages.MessageField(GetResponse, 1, repeated=True)
+    errors = messages.MessageField(GetManyError, 2, repeated=True)
+
+
 class AddRequest(messages.Message):
     title = messages.StringField(1, required=True)
 
@@ -79,19 +124,84 @@ class DeleteRequest(messages.Message):
     id = messages.StringField(1, required=True)
 
 
+def get_response(result):
+    return GetResponse(
+        id=result.id,
+        actors=result.actors,
+        awards=result.awards,
+        box_office=result.box_office,
+        country=result.country,
+        dvd=result.dvd,
+        director=result.director,
+        genre=result.genre,
+        language=result.language,
+        metascore=result.metascore,
+        plot=result.plot,
+        poster=result.poster,
+        production=result.production,
+        rated=result.rated,
+        ratings=[
+            RatingResult(source=rating.source, value=rating.value)
+            for rating in result.ratings
+        ],
+        released=result.released,
+        response=result.response,
+        runtime=result.runtime,
+        title=result.title,
+        type=result.type,
+        website=result.website,
+        writer=result.writer,
+        year=result.year,
+        imdb_id=result.imdb_id,
+        imdb_rating=result.imdb_rating,
+        imdb_votes=result.imdb_votes,
+        created=result.created.isoformat(),
+    )
+
+
 @api.endpoint(path="movie", title="Movie API")
 class Movie(remote.Service):
     @swagger("List movies")
     @remote.method(ListRequest, ListResponse)
     def list(self, request):
-        result = movie.Movie.list(limit=request.limit, offset=request.offset)
+        if request.limit < 1:
+            raise ListRequestInvalid("ListRequest limit must be at least 1")
+
+        filters = dict(
+            genre=request.genre,
+            language=request.language,
+            year=request.year,
+            decade=request.decade,
+            min_rating=request.min_rating,
+        )
+        # the projection is only indexed together with the title order
+        plain = (request.sort or "title") == "title" and not any(value is not None for value in filters.values())
+
+        result, next_cursor = movie.Movie.list_page(
+            cursor=request.cursor,
+            offset=request.offset,
+            limit=min(request.limit, LIST_LIMIT),
+            projection=movie.Movie.LIST_PROJECTION if plain else None,
+            sort=request.sort,
+            **filters
+        )
 
         return ListResponse(
             movies=[
                 ListResult(id=m.id, title=m.title, imdb_id=m.imdb_id)
                 for m in result
                 if m is not None
-            ]
+            ],
+            next_cursor=next_cursor,
+        )
+
+    @swagger("Search movies by title")
+    @remote.method(SearchRequest, SearchResponse)
+    def search(self, request):
+        result = movie.Movie.search(request.query, limit=min(request.limit, SEARCH_LIMIT))
+
+        return SearchResponse(
+            movies=[ListResult(id=id, title=title, imdb_id=imdb_id) for id, title, imdb_id in result]
         )
 
     @swagger("Get movie")
@@ -106,38 +216,27 @@ class Movie(remote.Service):
         elif request.title:
             result = movie.Movie.get_by_title(title=request.title)
 
-        return GetResponse(
-            id=result.id,
-            actors=result.actors,
-            awards=result.awards,
-            box_office=result.box_office,
-            country=result.country,
-            dvd=result.dvd,
-            director=result.director,
-            genre=result.genre,
-            language=result.language,
-            metascore=result.metascore,
-            plot=result.plot,
-            poster=result.poster,
-            production=result.production,
-            rated=result.rated,
-            ratings=[
-                RatingResult(source=rating.source, value=rating.value)
-                for rating in result.ratings
-            ],
-            released=result.released,
-            response=result.response,
-            runtime=result.runtime,
-            title=result.title,
-            type=result.type,
-            website=result.website,
-            writer=result.writer,
-            year=result.year,
-            imdb_id=result.imdb_id,
-            imdb_rating=result.imdb_rating,
-            imdb_votes=result.imdb_votes,
-            created=result.created.isoformat(),
-        )
+        return get_response(result)
+
+    @swagger("Get many movies")
+    @remote.method(GetManyRequest, GetManyResponse)
+    def get_many(self, request):
+        if not request.ids:
+            raise GetManyRequestInvalid("GetManyRequest requires at least one id")
+        if len(request.ids) > GET_MANY_LIMIT:
+            raise GetManyRequestInvalid("GetManyRequest accepts at most %s ids" % GET_MANY_LIMIT)
+
+        response = GetManyResponse()
+        for id, result in zip(request.ids, movie.Movie.get_multi(request.ids)):
+            if isinstance(result, error.Error):
+                response.errors.append(GetManyError(
+                    id=id,
+                    error_name=result.error_name,
+                    message=str(result),
+                ))
+            else:
+                response.movies.append(get_response(result))
+        return response
 
     @swagger("Add movie")
     @remote.method(AddRequest, AddResponse)
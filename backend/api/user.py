@@ -2,11 +2,18 @@ import time
 
 from backend.wsgi import remote, messages, message_types
 
-from backend import api, user
+from backend import api, error, user
 from backend.oauth2 import oauth2, Oauth2
 from backend.swagger import swagger
 
 
+class SearchRequestInvalid(error.Error):
+    pass
+
+
+SEARCH_LIMIT = 100
+
+
 class CreateRequest(messages.Message):
     email = messages.StringField(1, required=True)
     password = messages.StringField(2, required=True)
@@ -53,6 +60,8 @@ class MeResponse(messages.Message):
 class SearchRequest(messages.Message):
     search = messages.StringField(1, required=True)
     offset = messages.IntegerField(2, default=0)
+    limit = messages.IntegerField(3, default=25)
+    cursor = messages.StringField(4)
 
 
 class SearchResult(messages.Message):
@@ -62,6 +71,7 @@ class SearchResult(messages.Message):
 
 class SearchResponse(messages.Message):
     users = messages.MessageField(SearchResult, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
 
 class UpdatePasswordRequest(messages.Message):
@@ -156,16 +166,25 @@ class User(remote.Service):
     @oauth2.required()
     @remote.method(SearchRequest, SearchResponse)
     def search(self, request):
+        if request.limit < 1:
+            raise SearchRequestInvalid("SearchRequest limit must be at least 1")
+
         users = []
+        next_cursor = None
         if "@" in request.search:
             users = [user.User.get_by_email(request.search)]
         else:
-            users = user.User.search(request.search, offset=request.offset)
+            users, next_cursor = user.User.search_page(
+                request.search,
+                cursor=request.cursor,
+                offset=request.offset,
+                limit=min(request.limit, SEARCH_LIMIT),
+            )
 
         return SearchResponse(users=[SearchResult(
             id=u.id,
             name=u.name
-        ) for u in users if u is not None])
+        ) for u in users if u is not None], next_cursor=next_cursor)
 
     @swagger("Update password")
     @oauth2.required()
@@ -0,0 +1,343 @@
+"""
+Cache backends sharing one interface, get/set/delete/incr/clear, so lookups
+can be cached either per process or in a cache shared by all gunicorn
+workers:
+
+    local://                    LRUCache, process local
+    mmap:///path/to/file        MmapCache, shared by processes mapping the file
+    memcache://localhost:11211  MemcacheCache, any memcached protocol server,
+                                requires pymemcache
+
+Backends set shared when other processes see their entries.
+
+Values are cached under a Namespace, which versions its keys so a whole
+namespace can be invalidated at once.
+"""
+import collections
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import pickle
+import random
+import struct
+import threading
+import time
+import zlib
+
+from urllib import parse as urlparse
+
+
+class LRUCache:
+    """
+    Process local cache bounded both in size and age. When full the least
+    recently used entry is evicted, entries older than ttl seconds are
+    treated as misses. Hits and misses are counted for instrumentation.
+    """
+    shared = False
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def incr(self, key, initial=0):
+        with self._lock:
+            entry = self._entries.get(key)
+            value = (entry[1] if entry is not None else initial) + 1
+            self._entries[key] = (float("inf"), value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class MmapCache:
+    """
+    Cache shared by every process mapping the same file. The file is a
+    direct mapped table of fixed size slots: a key hashes to exactly one slot
+    and replaces whatever was stored there, values that don't fit in a slot
+    are not cached but counted as too_large in stats, so slot_size should
+    fit the largest pickled values cached. Access is serialized with a lock
+    on the file.
+    """
+    HEADER = struct.Struct("<dII")  # expires, key length, value length
+    shared = True
+
+    def __init__(self, path, slots=4096, slot_size=4096, ttl=300):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.too_large = 0
+
+        size = slots * slot_size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    def _offset(self, key):
+        return (zlib.crc32(key) % self.slots) * self.slot_size
+
+    def _read(self, key):
+        offset = self._offset(key)
+        expires, key_length, value_length = self.HEADER.unpack_from(self._map, offset)
+        offset += self.HEADER.size
+        if expires < time.time() or self._map[offset:offset + key_length] != key:
+            return None
+        offset += key_length
+        return self._map[offset:offset + value_length]
+
+    def _write(self, key, value, expires):
+        offset = self._offset(key)
+        if self.HEADER.size + len(key) + len(value) > self.slot_size:
+            self.HEADER.pack_into(self._map, offset, 0, 0, 0)
+            return False
+        self.HEADER.pack_into(self._map, offset, expires, len(key), len(value))
+        offset += self.HEADER.size
+        self._map[offset:offset + len(key) + len(value)] = key + value
+        return True
+
+    def get(self, key, default=None):
+        fcntl.flock(self._fd, fcntl.LOCK_SH)
+        try:
+            value = self._read(key.encode("utf-8"))
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        value = pickle.dumps(value)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            written = self._write(key.encode("utf-8"), value, time.time() + (ttl or self.ttl))
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        if not written:
+            self.too_large += 1
+
+    def delete(self, *keys):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            for key in keys:
+                key = key.encode("utf-8")
+                if self._read(key) is not None:
+                    self.HEADER.pack_into(self._map, self._offset(key), 0, 0, 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def incr(self, key, initial=0):
+        key = key.encode("utf-8")
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            value = self._read(key)
+            value = (pickle.loads(value) if value is not None else initial) + 1
+            self._write(key, pickle.dumps(value), float("inf"))
+            return value
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def clear(self):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            self._map[:] = bytes(len(self._map))
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self.hits = 0
+        self.misses = 0
+        self.too_large = 0
+
+    @property
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, too_large=self.too_large)
+
+
+class MemcacheCache:
+    """
+    Cache on a memcached protocol server. Connection errors are treated as
+    misses, so the application keeps working without its cache.
+    """
+    shared = True
+
+    def __init__(self, host="localhost", port=11211, ttl=300, timeout=1):
+        from pymemcache import serde
+        from pymemcache.client.base import Client
+
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._client = Client(
+            (host, port),
+            serde=serde.pickle_serde,
+            connect_timeout=timeout,
+            timeout=timeout,
+        )
+
+    def _call(self, method, *args, **kwargs):
+        from pymemcache.exceptions import MemcacheError
+
+        try:
+            return getattr(self._client, method)(*args, **kwargs)
+        except (OSError, MemcacheError):
+            self._client.close()
+            return None
+
+    def get(self, key, default=None):
+        value = self._call("get", key)
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        self._call("set", key, value, expire=math.ceil(ttl or self.ttl))
+
+    def delete(self, *keys):
+        if keys:
+            self._call("delete_many", keys)
+
+    def incr(self, key, initial=0):
+        self._call("add", key, initial, noreply=False)
+        return self._call("incr", key, 1)
+
+    def clear(self):
+        self._call("flush_all")
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses)
+
+
+def from_url(url):
+    """
+    Returns the cache backend described by url, see the module docstring.
+    Query parameters are passed on to the backend, e.g.
+    mmap:///tmp/cache?slots=1024.
+    """
+    url = urlparse.urlparse(url or "local://")
+    options = {key: int(value) for key, value in urlparse.parse_qsl(url.query)}
+
+    if url.scheme == "local":
+        return LRUCache(**options)
+    if url.scheme == "mmap":
+        return MmapCache(url.path, **options)
+    if url.scheme == "memcache":
+        return MemcacheCache(url.hostname or "localhost", url.port or 11211, **options)
+    raise ValueError("Unknown cache backend: %s" % url.scheme)
+
+
+class Namespace:
+    """
+    One kind of cached values in a backend. Keys are prefixed with the
+    namespace name and version, bumping the version with invalidate drops
+    every value in the namespace for all processes sharing the backend.
+    Other processes notice a new version within version_ttl seconds.
+
+    The version counter is cached like any other value, so it can be evicted
+    or, in MmapCache, overwritten by a value hashing to its slot. A missing
+    version starts again from a random number instead of 0, so values cached
+    under earlier versions are never read again.
+    """
+    def __init__(self, backend, name, ttl=300, version_ttl=5):
+        self.backend = backend
+        self.name = name
+        self.ttl = ttl
+        self.version_ttl = version_ttl
+        self.hits = 0
+        self.misses = 0
+        self._version = None
+        self._version_expires = 0
+
+    @property
+    def version(self):
+        if self._version is None or self._version_expires < time.monotonic():
+            version = self.backend.get("%s:version" % self.name)
+            if version is None:
+                # None as well when the backend is unavailable
+                version = self._incr_version() or 0
+            self._version = version
+            self._version_expires = time.monotonic() + self.version_ttl
+        return self._version
+
+    def _key(self, key):
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return "%s:%s:%s" % (self.name, self.version, digest)
+
+    def get(self, key, default=None):
+        value = self.backend.get(self._key(key))
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(self._key(key), value, ttl or self.ttl)
+
+    def delete(self, *keys):
+        self.backend.delete(*[self._key(key) for key in keys])
+
+    def _incr_version(self):
+        return self.backend.incr("%s:version" % self.name, random.getrandbits(48))
+
+    def invalidate(self):
+        self._version = self._incr_version()
+        self._version_expires = time.monotonic() + self.version_ttl
+
+    def clear(self):
+        self.invalidate()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses)
@@ -12,6 +12,7 @@ from google.cloud import ndb
 from backend.api import application as api_application
 from backend.gunicorn.log_handler import LogHandler
 from backend.setup import setup
+from backend.wsgi import protojson
 
 ndb_client = ndb.Client()
 
@@ -20,6 +21,10 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(log_handler)
 
+# the fastest installed JSON library unless JSON_BACKEND names one
+json_backend = protojson.set_json_backend(os.getenv("JSON_BACKEND"))
+logger.info("Encoding JSON with %s", json_backend.name)
+
 # setup
 with ndb_client.context():
     setup()
@@ -29,6 +34,4 @@ def application(environ, start_response):
     log_handler.trace_context = environ.get('HTTP_X_CLOUD_TRACE_CONTEXT')
 
     with ndb_client.context():
-        response = api_application(environ, start_response)
-
-        return [r.encode("utf-8") if isinstance(r, str) else r for r in response]  # gunicorn expects bytes
+        return api_application(environ, start_response)
@@ -0,0 +1,52 @@
+import contextlib
+import datetime
+import random
+
+from google.cloud import ndb
+
+from backend import error
+
+
+class LockTaken(error.Error):
+    pass
+
+
+class Lock(ndb.Model):
+    """
+    Named lock in the datastore, shared by every worker and instance. A lock
+    expires after its ttl so a crashed holder can't keep it forever.
+    """
+    owner = ndb.TextProperty()
+    expires = ndb.DateTimeProperty(indexed=False)
+
+    @classmethod
+    def acquire(cls, name, ttl=600):
+        owner = "%040x" % random.getrandbits(160)
+        now = datetime.datetime.now()
+
+        def acquire():
+            entity = cls.get_by_id(name)
+            if entity is not None and entity.expires > now:
+                raise LockTaken("Lock %s is taken" % name)
+            cls(id=name, owner=owner, expires=now + datetime.timedelta(seconds=ttl)).put()
+
+        ndb.transaction(acquire)
+        return owner
+
+    @classmethod
+    def release(cls, name, owner):
+        def release():
+            entity = cls.get_by_id(name)
+            if entity is not None and entity.owner == owner:
+                entity.key.delete()
+
+        ndb.transaction(release)
+
+    @classmethod
+    @contextlib.contextmanager
+    def hold(cls, name, ttl=600):
+        owner = cls.acquire(name, ttl=ttl)
+        try:
+            yield
+        finally:
+            cls.release(name, owner)
@@ -1,10 +1,15 @@
+import binascii
 import datetime
 import re
+import time
 
+from google.api_core.exceptions import BadRequest
 from google.cloud import ndb
 from google.protobuf.message import DecodeError
 
-from backend import error
+from backend import cache_backend, error
+from backend.cache import Namespace
+from backend.search import TitleIndex
 
 
 class NotFound(error.Error):
@@ -27,6 +32,43 @@ class IMDBIdInvalid(error.Error):
     pass
 
 
+class CursorInvalid(error.Error):
+    pass
+
+
+class ListInvalid(error.Error):
+    pass
+
+
+# Movies are not modified after create, so lookups are cached until the
+# movie is deleted or the entry expires.
+cache = Namespace(cache_backend, "movie", ttl=600)
+
+# Titles searched by Movie.search. Every process keeps its own index, writes
+# bump index_version so the other processes rebuild theirs. They only see the
+# bump through a shared cache backend, with a process local one the index is
+# rebuilt once it's INDEX_TTL seconds old instead.
+INDEX_TTL = 300
+index = TitleIndex()
+index_version = Namespace(cache_backend, "movie_index", version_ttl=5)
+
+
+def parse_number(value, type=int):
+    """
+    Parses the first number in an OMDB field, e.g. "7,357", "82 min" or
+    "2019–2020", None for "N/A" and empty fields.
+    """
+    match = re.search(r"\d[\d,]*(\.\d+)?", value or "")
+    return type(match.group().replace(",", "")) if match else None
+
+
+def parse_list(value):
+    """
+    Splits a comma separated OMDB field, e.g. "Crime, Drama".
+    """
+    return [item.strip() for item in (value or "").split(",") if item.strip() and item.strip() != "N/A"]
+
+
 class Rating(ndb.Model):
     source = ndb.TextProperty()
     value = ndb.TextProperty()
@@ -60,32 +102,121 @@ class Movie(ndb.Model):
     imdb_rating = ndb.TextProperty()
     imdb_votes = ndb.TextProperty()
 
+    # Typed and indexed copies of the text fields above, for filtering and
+    # sorting in list_page.
+    release_year = ndb.ComputedProperty(lambda self: parse_number(self.year))
+    decade = ndb.ComputedProperty(lambda self: self.release_year and self.release_year // 10 * 10)
+    rating = ndb.ComputedProperty(lambda self: parse_number(self.imdb_rating, float))
+    votes = ndb.ComputedProperty(lambda self: parse_number(self.imdb_votes))
+    runtime_minutes = ndb.ComputedProperty(lambda self: parse_number(self.runtime))
+    genres = ndb.ComputedProperty(lambda self: parse_list(self.genre), repeated=True)
+    languages = ndb.ComputedProperty(lambda self: parse_list(self.language), repeated=True)
+
+    # Sort keys accepted by list_page, prefixed with "-" for descending.
+    SORTS = {
+        "title": "title",
+        "year": "release_year",
+        "rating": "rating",
+        "votes": "votes",
+        "runtime": "runtime_minutes",
+    }
+
+    # Filters list_page accepts, by argument and property, and the
+    # combinations of them it accepts. Every combination has a composite
+    # index in index.yaml for each of SORTS in both directions.
+    FILTERS = {
+        "genre": "genres",
+        "language": "languages",
+        "year": "release_year",
+        "decade": "decade",
+    }
+    LIST_FILTERS = [
+        (),
+        ("genres",),
+        ("languages",),
+        ("release_year",),
+        ("decade",),
+        ("genres", "decade"),
+        ("genres", "languages"),
+    ]
+
+    # Properties needed to render a movie list, listing with this projection
+    # only reads the title/imdb_id index instead of the full entities.
+    LIST_PROJECTION = ("title", "imdb_id")
+
     @classmethod
     def get(cls, id):
-        key = None
-        try:
-            key = ndb.Key(urlsafe=id)
-        except DecodeError:
-            raise IdInvalid("Id is invalid: %s" % id)
+        entity = cache.get(("id", id))
+        if entity is not None:
+            return entity
 
-        entity = key.get()
+        entity = cls._id_to_key(id).get()
 
         if entity is None or not isinstance(entity, cls):
             raise NotFound("No movie found with id: %s" % id)
+        cache.set(("id", id), entity)
         return entity
 
+    @classmethod
+    def _id_to_key(cls, id):
+        try:
+            return ndb.Key(urlsafe=id)
+        except (DecodeError, binascii.Error, ValueError, TypeError):
+            raise IdInvalid("Id is invalid: %s" % id)
+
+    @classmethod
+    def get_multi(cls, ids):
+        """
+        Batched version of get, resolves all ids with a single datastore
+        lookup. Returns a list in the same order as ids, holding either the
+        movie or the IdInvalid/NotFound error for that id.
+        """
+        results = [None] * len(ids)
+        keys = []
+        positions = []
+        for position, id in enumerate(ids):
+            entity = cache.get(("id", id))
+            if entity is not None:
+                results[position] = entity
+                continue
+            try:
+                keys.append(cls._id_to_key(id))
+                positions.append(position)
+            except IdInvalid as e:
+                results[position] = e
+
+        for position, entity in zip(positions, ndb.get_multi(keys)):
+            if entity is None or not isinstance(entity, cls):
+                results[position] = NotFound("No movie found with id: %s" % ids[position])
+            else:
+                cache.set(("id", ids[position]), entity)
+                results[position] = entity
+        return results
+
     @classmethod
     def get_by_title(cls, title):
+        entity = cache.get(("title", title))
+        if entity is not None:
+            return entity
+
         entities = cls.query(cls.title == title).fetch(1)
 
         if not entities or not isinstance(entities[0], cls):
             raise NotFound("No movie found with title: %s" % title)
+        cache.set(("title", title), entities[0])
         return entities[0]
 
     @classmethod
     def find_by_imdb_id(cls, imdb_id):
-        entities = cls.query(cls.imdb_id == imdb_id).fetch(1)
-        return entities[0] if entities else None
+        if not cls.is_valid_imdb_id(imdb_id):
+            return None
+
+        entity = cache.get(("imdb_id", imdb_id))
+        if entity is None:
+            entity = ndb.Key(cls, imdb_id).get()
+            if entity is not None:
+                cache.set(("imdb_id", imdb_id), entity)
+        return entity
 
     @classmethod
     def list(cls, offset=0, limit=10):
@@ -93,6 +224,84 @@ class Movie(ndb.Model):
         query = query.order(Movie.title)
         return query.fetch(offset=offset, limit=limit)
 
+    @classmethod
+    def list_page(cls, cursor=None, offset=0, limit=10, projection=None, sort="title", **filters):
+        """
+        Returns a page of movies ordered by title together with an opaque
+        cursor for the next page, or None when there are no more movies.
+        Continuing from a cursor doesn't make the datastore skip the
+        previous pages the way offset does. With a projection, e.g.
+        LIST_PROJECTION, only those properties are loaded.
+
+        Movies can be filtered on genre, language, year, decade and
+        min_rating and sorted by any of SORTS instead, e.g. the top rated
+        dramas from the 90s are genre="Drama", decade=1990, sort="-rating".
+        Only the filter combinations in LIST_FILTERS are accepted, as the
+        others have no composite index in index.yaml.
+        """
+        start_cursor = None
+        if cursor:
+            try:
+                start_cursor = ndb.Cursor(urlsafe=cursor)
+            except (binascii.Error, ValueError):
+                raise CursorInvalid("Cursor is invalid: %s" % cursor)
+
+        query = cls._list_query(sort, **filters)
+        try:
+            entities, next_cursor, more = query.fetch_page(
+                limit, start_cursor=start_cursor, offset=offset, projection=projection
+            )
+        except (BadRequest, ValueError):
+            if start_cursor is None:
+                raise
+            # decodes fine, but isn't a cursor of this query or has expired
+            raise CursorInvalid("Cursor is invalid: %s" % cursor)
+
+        if not more or next_cursor is None:
+            return entities, None
+        return entities, next_cursor.urlsafe().decode("utf-8")
+
+    @classmethod
+    def _list_query(cls, sort="title", genre=None, language=None, year=None, decade=None, min_rating=None):
+        sort = sort or "title"
+        prop = cls.SORTS.get(sort.lstrip("-"))
+        if prop is None:
+            raise ListInvalid("Unknown sort: %s" % sort)
+        order = cls._properties[prop]
+        if sort.startswith("-"):
+            order = -order
+
+        values = dict(genre=genre, language=language, year=year, decade=decade)
+        filters = [name for name in cls.FILTERS if values[name] is not None]
+        if set(cls.FILTERS[name] for name in filters) not in [set(f) for f in cls.LIST_FILTERS]:
+            raise ListInvalid("Filters can't be combined: %s" % ", ".join(filters))
+
+        query = cls.query()
+        for name in filters:
+            query = query.filter(cls._properties[cls.FILTERS[name]] == values[name])
+        if min_rating is not None:
+            # the datastore requires the first sort order on the inequality
+            if prop != "rating":
+                raise ListInvalid("min_rating requires sorting by rating")
+            query = query.filter(cls.rating >= min_rating)
+        return query.order(order)
+
+    @classmethod
+    def reindex(cls, batch_size=100):
+        """
+        Rewrites every movie so computed properties added since it was
+        written, like the typed list properties, are indexed. Returns the
+        number of movies.
+        """
+        count = 0
+        cursor = None
+        while True:
+            entities, cursor, more = cls.query().fetch_page(batch_size, start_cursor=cursor)
+            ndb.put_multi(entities)
+            count += len(entities)
+            if not more or cursor is None:
+                return count
+
     @classmethod
     def create(
         cls,
@@ -122,17 +331,10 @@ class Movie(ndb.Model):
         imdb_rating=None,
         imdb_votes=None,
     ):
-
-        if not cls.is_valid_imdb_id(imdb_id):
-            raise IMDBIdInvalid("%s is invalid" % imdb_id)
-
-        if not cls.is_valid_title(title):
-            raise TitleInvalid("%s is not a valid title" % title)
-
-        if cls.find_by_imdb_id(imdb_id) is not None:
-            raise IMDBIdExists("%s already exists" % imdb_id)
+        cls.validate(title=title, imdb_id=imdb_id)
 
         entity = cls(
+            id=imdb_id,
             created=datetime.datetime.now(),
             actors=actors,
             awards=awards,
@@ -160,16 +362,26 @@ class Movie(ndb.Model):
             imdb_rating=imdb_rating,
             imdb_votes=imdb_votes,
         )
-        entity.put()
+
+        def insert():
+            # Movies are keyed by imdb id, checking and writing the key in a
+            # transaction makes duplicate detection atomic
+            if entity.key.get() is not None:
+                raise IMDBIdExists("%s already exists" % imdb_id)
+            entity.put()
+
+        ndb.transaction(insert)
+        entity.uncache()
+        cls._update_index(added=[entity])
 
         return entity
 
     @classmethod
-    def create_from_result(cls, result):
+    def result_to_dict(cls, result):
         ratings = []
         for rating in result["ratings"]:
             ratings.append(Rating(source=rating["source"], value=rating["value"]))
-        return cls.create(
+        return dict(
             actors=result["actors"],
             awards=result["awards"],
             box_office=result["box_office"],
@@ -197,12 +409,144 @@ class Movie(ndb.Model):
             imdb_votes=result["imdb_votes"],
         )
 
+    @classmethod
+    def create_from_result(cls, result):
+        return cls.create(**cls.result_to_dict(result))
+
+    @classmethod
+    def create_many_from_results(cls, results, chunk_size=500):
+        """
+        Bulk version of create_from_result. All results are validated before
+        anything is written, existing and repeated imdb ids are skipped using a
+        single batched key lookup and the new movies are written with put_multi
+        in chunks of chunk_size. Unlike create this isn't transactional, a
+        movie created concurrently with the import may be overwritten.
+        Returns the created movies.
+        """
+        values = {}
+        for result in results:
+            value = cls.validate_result(result)
+            values.setdefault(value["imdb_id"], value)
+
+        existing = ndb.get_multi([ndb.Key(cls, imdb_id) for imdb_id in values])
+
+        created = datetime.datetime.now()
+        entities = [
+            cls(id=imdb_id, created=created, **value)
+            for (imdb_id, value), entity in zip(values.items(), existing)
+            if entity is None
+        ]
+        for i in range(0, len(entities), chunk_size):
+            ndb.put_multi(entities[i:i + chunk_size])
+
+        for entity in entities:
+            entity.uncache()
+        cls._update_index(added=entities)
+        return entities
+
     @classmethod
     def delete(cls, id):
         entity = cls.get(id)
         res = entity.key.delete()
+        entity.uncache()
+        cls._update_index(removed=[entity])
         return res
 
+    @classmethod
+    def migrate_keys(cls, batch_size=100):
+        """
+        Re-keys movies stored with auto allocated ids to use their imdb id as
+        key name. Movies whose imdb id is already taken by a keyed movie are
+        removed as duplicates. Returns the number of migrated and removed
+        movies.
+        """
+        migrated = 0
+        removed = 0
+        legacy_keys = [key for key in cls.query().fetch(keys_only=True) if key.integer_id() is not None]
+        for i in range(0, len(legacy_keys), batch_size):
+            entities = [entity for entity in ndb.get_multi(legacy_keys[i:i + batch_size]) if entity is not None]
+            existing = ndb.get_multi([ndb.Key(cls, entity.imdb_id) for entity in entities])
+
+            migrations = {}
+            for entity, keyed in zip(entities, existing):
+                if keyed is None and entity.imdb_id not in migrations:
+                    migrations[entity.imdb_id] = cls(
+                        id=entity.imdb_id,
+                        **{
+                            name: getattr(entity, name) for name, prop in cls._properties.items()
+                            if not isinstance(prop, ndb.ComputedProperty)
+                        }
+                    )
+
+            ndb.put_multi(list(migrations.values()))
+            ndb.delete_multi([entity.key for entity in entities])
+            migrated += len(migrations)
+            removed += len(entities) - len(migrations)
+
+        cache.invalidate()
+        index.version = None
+        index_version.invalidate()
+        return migrated, removed
+
+    @classmethod
+    def search(cls, query, limit=10):
+        """
+        Searches movie titles in the in memory index, see TitleIndex, without
+        any datastore queries once the index is built. Returns a list of
+        (id, title, imdb_id) tuples, best match first.
+        """
+        if cls._index_stale():
+            cls.build_index()
+        return index.search(query, limit=limit)
+
+    @classmethod
+    def _index_stale(cls):
+        if index.version is None or index.version != index_version.version:
+            return True
+        return not cache_backend.shared and time.monotonic() - index.built > INDEX_TTL
+
+    @classmethod
+    def build_index(cls):
+        """
+        Builds the search index from a projection query of every movie.
+        """
+        version = index_version.version
+        movies = cls.query().fetch(projection=cls.LIST_PROJECTION)
+        index.rebuild([(m.id, m.title, m.imdb_id) for m in movies], version)
+
+    @classmethod
+    def _update_index(cls, added=(), removed=()):
+        # Apply the write to this process' index and bump the shared version.
+        # Unless some other process bumped it in between, this index is then
+        # up to date with the new version, otherwise it's rebuilt on search.
+        version = index.version
+        for entity in added:
+            index.add(entity.id, entity.title, entity.imdb_id)
+        for entity in removed:
+            index.remove(entity.id)
+        index_version.invalidate()
+        if version is None or index_version.version != version + 1:
+            index.version = None
+        else:
+            index.version = index_version.version
+
+    @classmethod
+    def validate_result(cls, result):
+        """
+        Validates an OMDB result without writing it. Returns its values.
+        """
+        value = cls.result_to_dict(result)
+        cls.validate(title=value["title"], imdb_id=value["imdb_id"])
+        return value
+
+    @classmethod
+    def validate(cls, title, imdb_id):
+        if not cls.is_valid_imdb_id(imdb_id):
+            raise IMDBIdInvalid("%s is invalid" % imdb_id)
+
+        if not cls.is_valid_title(title):
+            raise TitleInvalid("%s is not a valid title" % title)
+
     @classmethod
     def is_valid_title(cls, title):
         return bool(title) and isinstance(title, str) and len(title) >= 1
@@ -216,6 +560,9 @@ class Movie(ndb.Model):
             and bool(re.match(pattern, imdb_id))
         )
 
+    def uncache(self):
+        cache.delete(("id", self.id), ("title", self.title), ("imdb_id", self.imdb_id))
+
     @property
     def id(self):
         return self.key.urlsafe().decode("utf-8")
@@ -1,14 +1,35 @@
 """
 Oauth2 implementation using Resource Owner Password Credentials:
 https://tools.ietf.org/html/draft-ietf-oauth-v2-30#section-1.3.3
+
+Access tokens are either random tokens, looked up in the datastore, or, when
+OAUTH2_SIGNING_KEYS is set, signed tokens carrying the session id, user key
+and expiry which are verified without a datastore lookup. Sessions are
+stored either way, for their refresh tokens.
 """
+import base64
 import datetime
+import hashlib
+import hmac
+import json
+import logging
+import os
 import random
 import functools
+import threading
+import time
 
 from google.cloud import ndb
 
-from backend import user, error
+from backend import cache_backend, user, error
+from backend.cache import Namespace
+
+logger = logging.getLogger()
+
+# Validated sessions by access token, cached no longer than the access token
+# is valid. Every write to a session removes it from the cache, so revoked
+# and expired sessions are never served from it.
+cache = Namespace(cache_backend, "oauth2", ttl=300)
 
 
 class Unauthorized(error.Error):
@@ -62,11 +83,123 @@ class Decorator(object):
 oauth2 = Decorator
 
 
+class TokenSigner(object):
+    """
+    Signs and verifies access tokens with HMAC-SHA256. keys is a list of
+    (key id, secret) pairs, the first key signs and every key verifies, so a
+    key is rotated by putting a new key first and removing the old one once
+    the tokens it signed have expired. Without keys tokens aren't signed.
+    """
+    VERSION = "v1"
+
+    def __init__(self, keys=()):
+        self.keys = list(keys)
+        self._secrets = {kid: secret.encode("utf-8") for kid, secret in self.keys}
+
+    @classmethod
+    def from_string(cls, value):
+        """
+        Parses keys from a "kid:secret,kid:secret" string.
+        """
+        keys = [key.strip().split(":", 1) for key in (value or "").split(",") if key.strip()]
+        return cls([(kid, secret) for kid, secret in keys])
+
+    @property
+    def enabled(self):
+        return len(self.keys) > 0
+
+    @classmethod
+    def is_signed(cls, token):
+        return bool(token) and token.startswith(cls.VERSION + ".")
+
+    def _signature(self, secret, message):
+        digest = hmac.new(secret, message.encode("utf-8"), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).decode("ascii").rstrip("=")
+
+    def sign(self, claims):
+        kid, secret = self.keys[0]
+        payload = base64.urlsafe_b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+        message = "%s.%s.%s" % (self.VERSION, kid, payload.decode("ascii").rstrip("="))
+        return "%s.%s" % (message, self._signature(self._secrets[kid], message))
+
+    def verify(self, token):
+        """
+        Returns the claims of a token signed by one of the keys, or None.
+        """
+        try:
+            version, kid, payload, signature = token.split(".")
+        except (AttributeError, ValueError):
+            return None
+        secret = self._secrets.get(kid)
+        if version != self.VERSION or secret is None:
+            return None
+        if not hmac.compare_digest(self._signature(secret, "%s.%s.%s" % (version, kid, payload)), signature):
+            return None
+        try:
+            return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        except ValueError:
+            return None
+
+
+signer = TokenSigner.from_string(os.getenv("OAUTH2_SIGNING_KEYS"))
+
+
+class RevokedToken(ndb.Model):
+    """
+    Session id of a revoked signed access token, kept until the token would
+    have expired anyway.
+    """
+    expires = ndb.DateTimeProperty(indexed=True)
+
+
+class Revocations(object):
+    """
+    Process local copy of the unexpired revoked tokens, reloaded from the
+    datastore every refresh_interval seconds. Tokens revoked in this process
+    are seen immediately, by other processes after their next reload.
+    """
+    def __init__(self, refresh_interval=30):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._revoked = set()
+        self._expires = 0
+
+    def add(self, session_id, expires):
+        RevokedToken(id=session_id, expires=expires).put()
+        with self._lock:
+            self._revoked.add(session_id)
+
+    def contains(self, session_id):
+        if self._expires < time.monotonic():
+            self.refresh()
+        return session_id in self._revoked
+
+    def refresh(self):
+        keys = RevokedToken.query(RevokedToken.expires > datetime.datetime.now()).fetch(keys_only=True)
+        with self._lock:
+            self._revoked = set(key.id() for key in keys)
+            self._expires = time.monotonic() + self.refresh_interval
+
+    def clear(self):
+        with self._lock:
+            self._revoked = set()
+            self._expires = 0
+
+
+revocations = Revocations()
+
+
 class Oauth2(ndb.Model):
+    _from_token = False  # built by _get_signed, not loaded from the datastore
+
     created = ndb.DateTimeProperty(indexed=False)
     user_key = ndb.KeyProperty(indexed=False)
     access_token_token = ndb.StringProperty(indexed=True)
     refresh_token_token = ndb.StringProperty(indexed=True)
+    access_token_expires = ndb.DateTimeProperty(indexed=False)
+    refresh_token_expires = ndb.DateTimeProperty(indexed=False)
+    # when the session can no longer be renewed, indexed for sweep
+    expires = ndb.ComputedProperty(lambda self: self.refresh_token.expires)
 
     def __init__(self, *args, **kwargs):
         super(Oauth2, self).__init__(*args, **kwargs)
@@ -76,13 +209,13 @@ class Oauth2(ndb.Model):
     @property
     def access_token(self):
         if self._access_token is None:
-            self._access_token = AccessToken(self.access_token_token, self.created)
+            self._access_token = AccessToken(self.access_token_token, self.created, self.access_token_expires)
         return self._access_token
 
     @property
     def refresh_token(self):
         if self._refresh_token is None:
-            self._refresh_token = RefreshToken(self.refresh_token_token, self.created)
+            self._refresh_token = RefreshToken(self.refresh_token_token, self.created, self.refresh_token_expires)
         return self._refresh_token
 
     @property
@@ -91,23 +224,28 @@ class Oauth2(ndb.Model):
 
     @classmethod
     def create(cls, user_key, access_token=None, refresh_token=None):
-        if access_token is None:
-            access_token = AccessToken.create()
+        created = datetime.datetime.now()
+        if access_token is None and signer.enabled:
+            session_id = "%040x" % random.getrandbits(160)
+            access_token = AccessToken.create_signed(session_id, user_key, created)
+        else:
+            if access_token is None:
+                access_token = AccessToken.create()
+            session_id = access_token.token
         if refresh_token is None:
             refresh_token = RefreshToken.create()
 
-        entity = cls.get_or_insert(ndb.Key(cls, access_token.token).id())
+        entity = cls.get_or_insert(ndb.Key(cls, session_id).id())
         if entity.user_key is not None and not entity.refresh_token.expired():
-            raise Exception("Token collision: %s" % access_token.token)
-
-        entity._access_token = None
-        entity._refresh_token = None
+            raise Exception("Token collision: %s" % session_id)
 
         entity.update(
-            created=datetime.datetime.now(),
+            created=created,
             user_key=user_key,
             access_token_token=access_token.token,
-            refresh_token_token=refresh_token.token
+            refresh_token_token=refresh_token.token,
+            access_token_expires=None,
+            refresh_token_expires=None
         )
 
         return entity
@@ -116,19 +254,54 @@ class Oauth2(ndb.Model):
     def _get(cls, token):
         return ndb.Key(cls, token).get()
 
+    @classmethod
+    def _get_signed(cls, token):
+        """
+        Returns an unsaved session built from a signed token, or None if the
+        token is invalid, expired or revoked.
+        """
+        claims = signer.verify(token)
+        if claims is None or claims["exp"] < time.time() or revocations.contains(claims["sid"]):
+            return None
+
+        entity = cls(
+            id=claims["sid"],
+            created=datetime.datetime.fromtimestamp(claims["iat"]),
+            user_key=ndb.Key(urlsafe=claims["sub"].encode("ascii")),
+            access_token_token=token,
+            access_token_expires=datetime.datetime.fromtimestamp(claims["exp"]),
+        )
+        entity._from_token = True
+        return entity
+
     @classmethod
     def get(cls, token):
-        if token:
+        if TokenSigner.is_signed(token):
+            entity = cls._get_signed(token)
+            if entity is not None:
+                return entity
+        elif token:
+            entity = cache.get(token)
+            if entity is not None and not entity.access_token.expired():
+                return entity
+
             entity = cls._get(token)
 
             if entity is not None:
                 if not entity.access_token.expired():
+                    lifetime = (entity.access_token.expires - datetime.datetime.now()).total_seconds()
+                    if lifetime > 0:
+                        # a ttl of 0 would fall back to the cache's full ttl
+                        cache.set(token, entity, ttl=min(cache.ttl, lifetime))
                     return entity
 
         raise Unauthorized("Invalid or expired access token")
 
     @classmethod
     def renew(cls, token, refresh_token):
+        if TokenSigner.is_signed(token):
+            token = (signer.verify(token) or {}).get("sid")
+
         if token:
             entity = cls._get(token)
 
@@ -140,42 +313,117 @@ class Oauth2(ndb.Model):
 
         raise Unauthorized("Invalid or expired access token")
 
+    @classmethod
+    def reindex(cls, batch_size=100):
+        """
+        Rewrites every session so the expires property, added since they
+        were written, is indexed and sweep finds them. Returns the number of
+        sessions.
+        """
+        count = 0
+        cursor = None
+        while True:
+            entities, cursor, more = cls.query().fetch_page(batch_size, start_cursor=cursor)
+            ndb.put_multi(entities)
+            count += len(entities)
+            if not more or cursor is None:
+                return count
+
+    @classmethod
+    def sweep(cls, batch_size=500, cursor=None, max_batches=None):
+        """
+        Deletes the sessions that can no longer be renewed, batch_size keys
+        at a time, and once they are all gone the expired revoked tokens.
+        Sessions written before expires existed are only found after reindex.
+        Stops after max_batches batches, pass the returned cursor back in to
+        resume. Returns a dict with the number of sessions and revoked tokens
+        removed, batches run and the cursor, None when the sweep is done.
+        """
+        if max_batches is not None and max_batches < 1:
+            raise ValueError("max_batches must be at least 1, got %s" % max_batches)
+
+        now = datetime.datetime.now()
+        query = cls.query(cls.expires < now).order(cls.expires)
+        start_cursor = ndb.Cursor(urlsafe=cursor) if cursor else None
+        result = dict(sessions=0, revoked_tokens=0, batches=0, cursor=None)
+
+        while max_batches is None or result["batches"] < max_batches:
+            keys, start_cursor, more = query.fetch_page(batch_size, start_cursor=start_cursor, keys_only=True)
+            ndb.delete_multi(keys)
+            result["sessions"] += len(keys)
+            result["batches"] += 1
+            if not more or start_cursor is None:
+                break
+        else:
+            if start_cursor is not None:
+                result["cursor"] = start_cursor.urlsafe().decode("ascii")
+
+        if result["cursor"] is None:
+            keys = RevokedToken.query(RevokedToken.expires < now).fetch(keys_only=True)
+            ndb.delete_multi(keys)
+            result["revoked_tokens"] = len(keys)
+
+        logger.info("Swept %(sessions)s sessions and %(revoked_tokens)s revoked tokens in %(batches)s batches", result)
+        return result
+
     def update(self, **kwargs):
         updates = [setattr(self, key, value) for key, value in kwargs.items() if getattr(self, key) != value]
         if len(updates) > 0:
+            self._access_token = None
+            self._refresh_token = None
             self.put()
+            cache.delete(self.key.id())
         return self
 
     def expire(self):
-        t = datetime.datetime.now() - datetime.timedelta(seconds=1)
-        self.access_token.expires = t
-        self.refresh_token.expires = t
-        self.put()
+        self._end(datetime.datetime.now() - datetime.timedelta(seconds=1))
 
     def revoke(self):
-        t = datetime.datetime.now() - datetime.timedelta(days=1)
-        self.access_token.expires = t
-        self.refresh_token.expires = t
-        self.put()
+        self._end(datetime.datetime.now() - datetime.timedelta(days=1))
+
+    def _end(self, t):
+        if TokenSigner.is_signed(self.access_token.token):
+            revocations.add(self.key.id(), self.access_token.expires)
+
+        if self._from_token:
+            # built from the token, update the stored session instead
+            entity = self.key.get()
+            if entity is not None:
+                entity.update(access_token_expires=t, refresh_token_expires=t)
+            self.access_token_expires = self.refresh_token_expires = t
+            self._access_token = self._refresh_token = None
+        else:
+            self.update(access_token_expires=t, refresh_token_expires=t)
 
 
 class AccessToken(object):
-    def __init__(self, token, created=None):
+    def __init__(self, token, created=None, expires=None):
         self.token = token
-        self.expires = (created or datetime.datetime.now()) + datetime.timedelta(hours=6)
+        self.expires = expires or (created or datetime.datetime.now()) + datetime.timedelta(hours=6)
 
     @classmethod
     def create(cls):
         return cls("%040x" % random.getrandbits(160))
 
+    @classmethod
+    def create_signed(cls, session_id, user_key, created):
+        expires = created + datetime.timedelta(hours=6)
+        token = signer.sign(dict(
+            sid=session_id,
+            sub=user_key.urlsafe().decode("ascii"),
+            iat=created.timestamp(),
+            exp=expires.timestamp(),
+        ))
+        return cls(token, created, expires)
+
     def expired(self):
         return datetime.datetime.now() > self.expires
 
 
 class RefreshToken(object):
-    def __init__(self, token, created=None):
+    def __init__(self, token, created=None, expires=None):
         self.token = token
-        self.expires = (created or datetime.datetime.now()) + datetime.timedelta(days=10)
+        self.expires = expires or (created or datetime.datetime.now()) + datetime.timedelta(days=10)
 
     @classmethod
     def create(cls):
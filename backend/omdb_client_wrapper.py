@@ -1,3 +1,10 @@
+import json
+import sqlite3
+import threading
+import time
+
+from concurrent.futures import Future
+
 from omdb import OMDB, OMDBNoResults
 
 from backend import error
@@ -7,21 +14,157 @@ class NotFound(error.Error):
     pass
 
 
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Callers asking for a key that
+    is already in flight wait for that call and share its result, or error,
+    instead of making the same call again.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+
+        if leader:
+            try:
+                call.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                # e.g. SystemExit as well, or the callers waiting never return
+                call.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._calls[key]
+
+        return call.result()
+
+
+class ResponseCache:
+    """
+    Cache of OMDB responses in a SQLite database, so reseeds and repeated
+    adds don't pay for the same requests again, and restarts neither as long
+    as the file survives them. NotFound responses are cached as well, for
+    not_found_ttl seconds. Every prune_interval writes expired responses are
+    deleted and, as NotFound responses are keyed by whatever titles users
+    type, the responses expiring first beyond max_rows.
+    """
+    def __init__(self, path, ttl=7 * 24 * 3600, not_found_ttl=24 * 3600, max_rows=2000, prune_interval=100):
+        self.ttl = ttl
+        self.not_found_ttl = not_found_ttl
+        self.max_rows = max_rows
+        self.prune_interval = prune_interval
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._connection = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, response TEXT, not_found TEXT, expires REAL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires)")
+        with self._lock:
+            self._prune()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def get(self, key):
+        """
+        Returns a (response, not_found) tuple where not_found is the NotFound
+        message of a negative entry, or None if there is no fresh entry.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response, not_found FROM responses WHERE key = ? AND expires > ?", (key, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        response, not_found = row
+        return (json.loads(response) if response is not None else None), not_found
+
+    def set(self, key, response=None, not_found=None):
+        ttl = self.ttl if not_found is None else self.not_found_ttl
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, json.dumps(response) if not_found is None else None, not_found, time.time() + ttl)
+            )
+            self._writes += 1
+            if self._writes % self.prune_interval == 0:
+                self._prune()
+
+    def _prune(self):
+        # call holding the lock
+        self._connection.execute("DELETE FROM responses WHERE expires <= ?", (time.time(),))
+        self._connection.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.max_rows,)
+        )
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+
+
 class OMDBClientWrapper:
-    def __init__(self, apikey):
+    def __init__(self, apikey, cache_path=None):
         self.omdb = OMDB(apikey)
+        self.single_flight = SingleFlight()
+        self.response_cache = ResponseCache(cache_path) if cache_path else None
 
     def search_by_title(self, title):
-        return self.omdb.search(title, type="movie")
+        return self._request("search", title, self._search_by_title)
 
     def get_movie_by_title(self, title):
+        return self._request("title", title, self._get_movie_by_title)
+
+    def get_movie_by_imdb_id(self, imdb_id):
+        return self._request("imdb_id", imdb_id, self._get_movie_by_imdb_id)
+
+    def _request(self, kind, query, func):
+        key = "%s:%s" % (kind, self._normalize(query))
+        return self.single_flight.do(key, self._cached, key, func, query)
+
+    def _cached(self, key, func, query):
+        if self.response_cache is None:
+            return func(query)
+
+        cached = self.response_cache.get(key)
+        if cached is not None:
+            response, not_found = cached
+            if not_found is not None:
+                raise NotFound(not_found)
+            return response
+
+        try:
+            response = func(query)
+        except NotFound as e:
+            self.response_cache.set(key, not_found=str(e))
+            raise
+        self.response_cache.set(key, response)
+        return response
+
+    def _search_by_title(self, title):
+        return self.omdb.search(title, type="movie")
+
+    def _get_movie_by_title(self, title):
         try:
             return self.omdb.get_movie(title=title, type="movie")
         except OMDBNoResults:
             raise NotFound("No movie found with title %s" % title)
 
-    def get_movie_by_imdb_id(self, imdb_id):
+    def _get_movie_by_imdb_id(self, imdb_id):
         try:
             return self.omdb.get_movie(imdbid=imdb_id, type="movie")
         except OMDBNoResults:
             raise NotFound("No movie found with imdb id %s" % imdb_id)
+
+    @staticmethod
+    def _normalize(query):
+        return " ".join((query or "").lower().split())
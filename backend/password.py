@@ -0,0 +1,86 @@
+"""
+Password hashing with a key derivation function, scrypt or PBKDF2. Hashes
+are stored as "<kdf>$<parameters>$<hash>", e.g.
+
+    scrypt$n=16384,r=8,p=1$9f86d08...
+    pbkdf2_sha256$iterations=600000$9f86d08...
+
+so hashes made with other parameters still verify after the parameters
+change, and can be recognized as outdated to be rehashed.
+"""
+import hashlib
+import hmac
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib import parse as urlparse
+
+from backend import error
+
+
+class HashingBusy(error.Error):
+    pass
+
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords on a pool of worker threads. At most
+    max_pending passwords are hashed or waiting at a time, more raise
+    HashingBusy instead of queueing, so a burst of logins can't tie up every
+    request thread.
+    """
+    KDFS = ("scrypt", "pbkdf2_sha256")
+
+    def __init__(self, kdf="scrypt", n=2 ** 14, r=8, p=1, iterations=600000, workers=2, max_pending=32):
+        if kdf not in self.KDFS:
+            raise ValueError("Unknown password kdf: %s" % kdf)
+        self.kdf = kdf
+        self.parameters = dict(n=n, r=r, p=p) if kdf == "scrypt" else dict(iterations=iterations)
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password")
+        self._pending = threading.BoundedSemaphore(max_pending)
+
+    @classmethod
+    def from_string(cls, value):
+        """
+        Parses "kdf?parameter=value&...", e.g. "scrypt?n=32768&workers=4" or
+        "pbkdf2_sha256?iterations=600000".
+        """
+        kdf, _, query = (value or "scrypt").partition("?")
+        return cls(kdf, **{key: int(value) for key, value in urlparse.parse_qsl(query)})
+
+    @property
+    def prefix(self):
+        return "%s$%s$" % (self.kdf, ",".join("%s=%s" % item for item in sorted(self.parameters.items())))
+
+    @classmethod
+    def is_hash(cls, hashed):
+        return bool(hashed) and hashed.split("$", 1)[0] in cls.KDFS
+
+    def needs_update(self, hashed):
+        return not (hashed or "").startswith(self.prefix)
+
+    def hash(self, salt, password):
+        return self.prefix + self._run(self._derive, self.kdf, self.parameters, salt, password)
+
+    def verify(self, salt, password, hashed):
+        kdf, parameters, expected = hashed.split("$")
+        parameters = dict((key, int(value)) for key, value in (p.split("=") for p in parameters.split(",")))
+        return hmac.compare_digest(self._run(self._derive, kdf, parameters, salt, password), expected)
+
+    def _run(self, func, *args):
+        if not self._pending.acquire(blocking=False):
+            raise HashingBusy("Too many passwords are being checked, try again")
+        try:
+            return self._executor.submit(func, *args).result()
+        finally:
+            self._pending.release()
+
+    @staticmethod
+    def _derive(kdf, parameters, salt, password):
+        password = (password or "").encode("utf-8")
+        salt = salt.encode("utf-8")
+        if kdf == "scrypt":
+            n, r, p = parameters["n"], parameters["r"], parameters["p"]
+            return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p, dklen=64).hex()
+        return hashlib.pbkdf2_hmac("sha256", password, salt, parameters["iterations"]).hex()
@@ -0,0 +1,137 @@
+import heapq
+import re
+import threading
+import time
+import unicodedata
+
+
+def tokenize(text):
+    """
+    Splits text into lowercase words with accents removed, so "Amélie" and
+    "amelie" are the same token.
+    """
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    return re.findall(r"\w+", text)
+
+
+class TitleIndex:
+    """
+    In memory inverted index of titles. Every word of a title maps to the
+    ids of the titles containing it, and a trie of the words completes the
+    words being typed. Searches match titles containing a word starting with
+    each word of the query, ranked by how many words match exactly and then
+    by shorter titles. version tells which version of the data the index was
+    built from, None until it is built, and built when, in time.monotonic().
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents = {}  # id -> (title, data)
+        self._postings = {}  # word -> set of ids
+        self._trie = {}  # character -> node, "" -> the word ending at a node
+        self.version = None
+        self.built = None
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, id, title, data=None):
+        with self._lock:
+            self._remove(id)
+            self._documents[id] = (title, data)
+            for word in set(tokenize(title)):
+                if word not in self._postings:
+                    self._postings[word] = set()
+                    self._insert(word)
+                self._postings[word].add(id)
+
+    def remove(self, id):
+        with self._lock:
+            self._remove(id)
+
+    def rebuild(self, documents, version=None):
+        """
+        Replaces the index with documents, (id, title, data) tuples.
+        """
+        index = TitleIndex()
+        for id, title, data in documents:
+            index.add(id, title, data)
+        with self._lock:
+            self._documents, self._postings, self._trie = index._documents, index._postings, index._trie
+            self.version = version
+            self.built = time.monotonic()
+
+    def clear(self):
+        self.rebuild([])
+
+    def search(self, query, limit=10):
+        """
+        Returns up to limit (id, title, data) tuples, best match first.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+
+        with self._lock:
+            scores = None
+            for word in words:
+                matches = {}
+                for completion in self._complete(word):
+                    score = 2 if completion == word else 1
+                    for id in self._postings[completion]:
+                        matches[id] = max(matches.get(id, 0), score)
+                if scores is not None:
+                    matches = {id: scores[id] + score for id, score in matches.items() if id in scores}
+                scores = matches
+                if not scores:
+                    return []
+
+            ranked = heapq.nsmallest(limit, scores, key=lambda id: (
+                -scores[id], len(self._documents[id][0]), self._documents[id][0], id
+            ))
+            return [(id,) + self._documents[id] for id in ranked]
+
+    def _remove(self, id):
+        document = self._documents.pop(id, None)
+        if document is None:
+            return
+        for word in set(tokenize(document[0])):
+            ids = self._postings[word]
+            ids.discard(id)
+            if not ids:
+                del self._postings[word]
+                self._delete(word)
+
+    def _insert(self, word):
+        node = self._trie
+        for c in word:
+            node = node.setdefault(c, {})
+        node[""] = word
+
+    def _delete(self, word):
+        path = [self._trie]
+        for c in word:
+            path.append(path[-1][c])
+        del path[-1][""]
+        for node, c in zip(reversed(path[:-1]), reversed(word)):
+            if node[c]:
+                break
+            del node[c]
+
+    def _complete(self, prefix):
+        node = self._trie
+        for c in prefix:
+            node = node.get(c)
+            if node is None:
+                return []
+
+        words = []
+        nodes = [node]
+        while nodes:
+            node = nodes.pop()
+            for c, child in node.items():
+                if c == "":
+                    words.append(child)
+                else:
+                    nodes.append(child)
+        return words
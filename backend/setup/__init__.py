@@ -1,10 +1,16 @@
+import os
+
+from backend import movie
 from backend.setup.seed import Seed
 
 
-# Currently this has concurrency issues if there is more than one worker.
-# There's a data race checking if the db is empty, perhaps could be solved
-# by preloading or perhaps using db transactions. Best would probably be to
-# not run this on application initialization
+# Seeding from OMDB is done offline with manage.py seed_snapshot, workers
+# only load the resulting snapshot, which is done once under a lock.
 def setup():
-    seed = Seed()
-    seed.movies()
+    path = os.getenv("SEED_SNAPSHOT")
+    if path:
+        seed = Seed()
+        seed.load(path)
+
+    # build the movie search index before serving requests
+    movie.Movie.build_index()
@@ -1,31 +1,136 @@
+import datetime
+import hashlib
+import itertools
+import json
 import logging
+import threading
+import time
 
-from backend import movie, movie_api_client
+from concurrent.futures import ThreadPoolExecutor
+
+from google.cloud import ndb
+
+from backend import error, movie, movie_api_client
+from backend.lock import Lock, LockTaken
 
 logger = logging.getLogger()
 
+SNAPSHOT_VERSION = 1
 
-class Seed:
-    def movies(self):
-        count = movie.Movie.query().count(1)
-        if count != 0:  # Check if movies is empty
-            return
-        logger.info("Seeding movies start")
-        results = self.__get_hundred_movies()
 
-        count = movie.Movie.query().count(1)
-        if count != 0:  # Second check to see if movies still empty
-            logger.info("Movies no longer empty, abort")
+class SnapshotInvalid(error.Error):
+    pass
+
+
+class SeedSnapshot(ndb.Model):
+    """
+    Marks a snapshot, keyed by its id, as loaded.
+    """
+    loaded = ndb.DateTimeProperty(indexed=False)
+    count = ndb.IntegerProperty(indexed=False)
+
+
+class RateLimiter:
+    """
+    Spaces calls to wait so that at most rate calls per second pass, shared
+    by all threads using the limiter. A rate of None doesn't limit.
+    """
+    def __init__(self, rate=None):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def wait(self):
+        if not self.rate:
             return
-        for result in results:
-            movie.Movie.create_from_result(result)
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + 1 / self.rate
+        if delay > 0:
+            time.sleep(delay)
 
-        logger.info("Seeding movies done")
+
+class Seed:
+    def __init__(self, concurrency=10, rate_limit=None):
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.failures = {}
 
     def __get_hundred_movies(self):
         search_result = movie_api_client.search_by_title("Steven")
         imdb_ids = [result["imdb_id"] for result in search_result["search"]]
-        movies = []
-        for imdb_id in imdb_ids[:100]:
-            movies.append(movie_api_client.get_movie_by_imdb_id(imdb_id))
-        return movies
+        return self.get_movies(imdb_ids[:100])
+
+    def snapshot(self, path):
+        """
+        Writes a snapshot of the seed movies, a JSON header line with the
+        snapshot format version and id followed by one OMDB result per line.
+        """
+        results = self.__get_hundred_movies()
+        lines = [json.dumps(result, sort_keys=True) for result in results]
+        header = dict(
+            version=SNAPSHOT_VERSION,
+            id=hashlib.sha1("\n".join(lines).encode("utf-8")).hexdigest(),
+            created=datetime.datetime.now().isoformat(),
+            count=len(lines),
+        )
+        with open(path, "w") as f:
+            f.write(json.dumps(header) + "\n")
+            for line in lines:
+                f.write(line + "\n")
+        return header
+
+    def load(self, path, chunk_size=500):
+        """
+        Loads a snapshot written by snapshot with batched writes. Only one
+        process loads at a time and each snapshot is loaded once, so every
+        worker may call this on startup. Returns whether it was loaded.
+        """
+        with open(path) as f:
+            header = json.loads(f.readline() or "{}")
+            if header.get("version") != SNAPSHOT_VERSION:
+                raise SnapshotInvalid("Unsupported snapshot version: %s" % header.get("version"))
+
+            key = ndb.Key(SeedSnapshot, header["id"])
+            if key.get() is not None:
+                return False
+
+            try:
+                with Lock.hold("seed", ttl=600):
+                    if key.get(use_cache=False) is not None:
+                        return False
+
+                    logger.info("Loading seed snapshot %s", header["id"])
+                    results = (json.loads(line) for line in f if line.strip())
+                    while True:
+                        chunk = list(itertools.islice(results, chunk_size))
+                        if not chunk:
+                            break
+                        movie.Movie.create_many_from_results(chunk, chunk_size=chunk_size)
+
+                    SeedSnapshot(key=key, loaded=datetime.datetime.now(), count=header["count"]).put()
+                    logger.info("Loading seed snapshot %s done", header["id"])
+                    return True
+            except LockTaken:
+                logger.info("Seed snapshot is being loaded by another process")
+                return False
+
+    def get_movies(self, imdb_ids):
+        """
+        Fetches the movies from OMDB with up to concurrency requests in
+        flight. Results keep the order of imdb_ids, movies that couldn't be
+        fetched are left out and their errors recorded in failures.
+        """
+        def get_movie(imdb_id):
+            self.rate_limiter.wait()
+            try:
+                return movie_api_client.get_movie_by_imdb_id(imdb_id)
+            except Exception as e:
+                logger.warning("Fetching movie %s failed: %s", imdb_id, e)
+                self.failures[imdb_id] = e
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            movies = list(executor.map(get_movie, imdb_ids))
+        return [m for m in movies if m is not None]
@@ -1,14 +1,127 @@
+import collections
+
+import google.cloud.datastore.helpers as ds_helpers
+
 from google.cloud import ndb
+from google.cloud.datastore_v1 import types
 
 from InMemoryCloudDatastoreStub import datastore_stub
 
 
+class DatastoreStub(datastore_stub.LocalDatastoreStub):
+    """
+    Extends the in memory datastore stub with query cursors. A cursor points
+    into a snapshot of the keys a query returned, continuing from it skips
+    the keys up to that position, so like datastore cursors it isn't moved by
+    entities deleted in the meantime.
+
+    Only the latest MAX_SNAPSHOTS snapshots are kept, continuing from an
+    older cursor raises ValueError, as datastore cursors expire too.
+
+    Queries may also have several sort orders. Like in the datastore,
+    entities without a sort property are left out and null values sort
+    before any other value.
+    """
+    MAX_SNAPSHOTS = 1000
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._snapshots = collections.OrderedDict()
+        self._next_snapshot = 0
+
+    def _run_query(self, request, *args, **kwargs):
+        query = request.query
+        seen = []
+        if query.start_cursor:
+            snapshot, position = map(int, query.start_cursor.split(b":"))
+            if snapshot not in self._snapshots:
+                raise ValueError("Cursor expired")
+            seen = self._snapshots[snapshot][:position]
+        offset = query.offset
+        limit = query.limit.value if query.HasField("limit") else None
+
+        unbounded = types.RunQueryRequest()
+        unbounded.CopyFrom(request)
+        unbounded.query.start_cursor = b""
+        unbounded.query.offset = 0
+        unbounded.query.ClearField("limit")
+        del unbounded.query.order[:]
+        del unbounded.query.projection[:]
+
+        response = super()._run_query(unbounded, *args, **kwargs)
+        batch = response.batch
+
+        skip = set(seen)
+        results = [r for r in batch.entity_results if r.entity.key.SerializeToString() not in skip]
+        results = self._order(results, query.order)
+        results = self._project(batch, results, query.projection)
+        snapshot = self._next_snapshot
+        self._next_snapshot += 1
+        self._snapshots[snapshot] = seen + [r.entity.key.SerializeToString() for r in results]
+        while len(self._snapshots) > self.MAX_SNAPSHOTS:
+            self._snapshots.popitem(last=False)
+
+        skipped = min(offset, len(results))
+        results = results[skipped:]
+        more = limit is not None and len(results) > limit
+        results = results[:limit]
+
+        position = len(seen) + skipped
+        for result in results:
+            position += 1
+            result.cursor = b"%d:%d" % (snapshot, position)
+
+        del batch.entity_results[:]
+        batch.entity_results.extend(results)
+        batch.skipped_results = skipped
+        batch.skipped_cursor = b"%d:%d" % (snapshot, len(seen) + skipped)
+        batch.end_cursor = b"%d:%d" % (snapshot, position)
+        batch.more_results = (
+            types.QueryResultBatch.MoreResultsType.MORE_RESULTS_AFTER_LIMIT if more
+            else types.QueryResultBatch.MoreResultsType.NO_MORE_RESULTS
+        )
+        return response
+
+    @staticmethod
+    def _order(results, orders):
+        for order in reversed(orders):
+            name = order.property.name
+            results = [r for r in results if name in r.entity.properties]
+
+            def key(result):
+                value = ds_helpers._get_value_from_value_pb(result.entity.properties[name])
+                return (value is not None, value)
+
+            results.sort(key=key, reverse=order.direction == types.PropertyOrder.Direction.DESCENDING)
+        return results
+
+    @staticmethod
+    def _project(batch, results, projection):
+        names = [p.property.name for p in projection]
+        if not names:
+            return results
+
+        projected = []
+        for result in results:
+            entity = types.Entity(key=result.entity.key)
+            for name in names:
+                if name in result.entity.properties:
+                    entity.properties[name].CopyFrom(result.entity.properties[name])
+            projected.append(types.EntityResult(entity=entity, version=result.version))
+
+        batch.entity_result_type = (
+            types.EntityResult.ResultType.KEY_ONLY if names == ["__key__"]
+            else types.EntityResult.ResultType.PROJECTION
+        )
+        return projected
+
+
 class Client:
     def __init__(self, project=None, namespace=None, credentials=None):
         self.project = project or "stub"
         self.namespace = namespace
         self.credentials = credentials
-        self.stub = datastore_stub.LocalDatastoreStub()
+        self.stub = DatastoreStub()
         self._context = ndb.context.Context(self)
 
     def context(self):
@@ -8,7 +8,7 @@ import backend.stub.omdb_client_wrapper  # noqa F401
 
 from google.cloud import ndb
 
-from backend import api
+from backend import api, movie, oauth2
 
 
 class TestCase(unittest.TestCase):
@@ -17,6 +17,12 @@ class TestCase(unittest.TestCase):
         self.ndb_context = ndb.Client().context()
         self.ndb_context.__enter__()
 
+        # every test starts with an empty datastore, so empty the caches too
+        movie.cache.clear()
+        movie.index.clear()
+        oauth2.cache.clear()
+        oauth2.revocations.clear()
+
         # set up api client
         self.api_client = api.application.client
 
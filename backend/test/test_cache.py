@@ -0,0 +1,227 @@
+import os
+import socketserver
+import tempfile
+import threading
+import time
+import unittest
+
+from backend import cache, test
+
+try:
+    import pymemcache
+except ImportError:
+    pymemcache = None
+
+
+class MemcacheHandler(socketserver.StreamRequestHandler):
+    """
+    Serves the subset of the memcached text protocol used by MemcacheCache.
+    """
+    def handle(self):
+        for line in self.rfile:
+            command, *args = line.split()
+            noreply = args[-1:] == [b"noreply"]
+            reply = getattr(self, command.decode("utf-8"))(self.server.values, *args)
+            if reply is not None and not noreply:
+                self.wfile.write(reply + b"\r\n")
+            self.wfile.flush()
+
+    def get(self, values, *keys):
+        for key in keys:
+            if key in values:
+                flags, _, data = values[key]
+                self.wfile.write(b"VALUE %s %s %d\r\n%s\r\n" % (key, flags, len(data), data))
+        return b"END"
+
+    def set(self, values, key, flags, expire, length, *args):
+        values[key] = (flags, expire, self.rfile.read(int(length) + 2)[:-2])
+        return b"STORED"
+
+    def add(self, values, key, *args):
+        if key in values:
+            self.rfile.read(int(args[2]) + 2)
+            return b"NOT_STORED"
+        return self.set(values, key, *args)
+
+    def delete(self, values, key, *args):
+        return b"DELETED" if values.pop(key, None) else b"NOT_FOUND"
+
+    def incr(self, values, key, value, *args):
+        if key not in values:
+            return b"NOT_FOUND"
+        flags, expire, data = values[key]
+        data = b"%d" % (int(data) + int(value))
+        values[key] = (flags, expire, data)
+        return data
+
+    def flush_all(self, values, *args):
+        values.clear()
+        return b"OK"
+
+
+class MemcacheStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("localhost", 0), MemcacheHandler)
+        self.values = {}
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+class CacheBackendTests:
+    def test_get(self):
+        self.assertEqual(self.cache.get("key"), None)
+        self.assertEqual(self.cache.get("key", "default"), "default")
+
+        self.cache.set("key", dict(value=1))
+        self.assertEqual(self.cache.get("key"), dict(value=1))
+        self.assertEqual(self.cache.stats["hits"], 1)
+        self.assertEqual(self.cache.stats["misses"], 2)
+
+        self.cache.delete("key", "missing_key")
+        self.assertEqual(self.cache.get("key"), None)
+
+    def test_ttl(self):
+        self.cache.set("key", "value", ttl=1)
+        self.assertEqual(self.cache.get("key"), "value")
+        time.sleep(1.1)
+        self.assertEqual(self.cache.get("key"), None)
+
+    def test_incr(self):
+        self.assertEqual(self.cache.incr("counter"), 1)
+        self.assertEqual(self.cache.incr("counter"), 2)
+        self.assertEqual(self.cache.incr("other", 10), 11)
+        self.assertEqual(self.cache.get("counter"), 2)
+
+    def test_clear(self):
+        self.cache.set("key", "value")
+        self.cache.clear()
+        self.assertEqual(self.cache.get("key"), None)
+
+
+class TestLRUCache(CacheBackendTests, test.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = cache.LRUCache()
+
+    def test_maxsize(self):
+        self.cache = cache.LRUCache(maxsize=2)
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get("b"), None)
+        self.assertEqual(self.cache.get("c"), 3)
+
+
+class TestMmapCache(CacheBackendTests, test.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "cache")
+        self.cache = cache.MmapCache(self.path, slots=64, slot_size=256)
+
+    def tearDown(self):
+        self.directory.cleanup()
+        super().tearDown()
+
+    def test_shared(self):
+        other = cache.MmapCache(self.path, slots=64, slot_size=256)
+        self.cache.set("key", "value")
+        self.assertEqual(other.get("key"), "value")
+        other.delete("key")
+        self.assertEqual(self.cache.get("key"), None)
+
+    def test_slot_size(self):
+        self.cache.set("key", "value")
+        self.cache.set("key", "v" * 256)
+        self.assertEqual(self.cache.get("key"), None)
+        self.assertEqual(self.cache.stats["too_large"], 1)
+
+
+@unittest.skipIf(pymemcache is None, "pymemcache is not installed")
+class TestMemcacheCache(CacheBackendTests, test.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = MemcacheStandIn()
+        self.cache = cache.from_url("memcache://localhost:%s" % self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def test_ttl(self):
+        # the stand in server doesn't expire values
+        self.cache.set("key", "value", ttl=1)
+        self.assertEqual(self.cache.get("key"), "value")
+        self.assertEqual(self.server.values[b"key"][1], b"1")
+
+    def test_unavailable(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.cache = cache.MemcacheCache("localhost", self.server.server_address[1])
+        self.cache.set("key", "value")
+        self.assertEqual(self.cache.get("key"), None)
+        self.assertEqual(self.cache.incr("counter"), None)
+
+
+class TestNamespace(test.TestCase):
+    def test_namespace(self):
+        backend = cache.LRUCache()
+        namespace = cache.Namespace(backend, "test")
+        other = cache.Namespace(backend, "other")
+
+        namespace.set("key", "value")
+        other.set("key", "other_value")
+        self.assertEqual(namespace.get("key"), "value")
+        self.assertEqual(namespace.stats, dict(hits=1, misses=0))
+
+        namespace.delete("key")
+        self.assertEqual(namespace.get("key"), None)
+        self.assertEqual(other.get("key"), "other_value")
+
+    def test_invalidate(self):
+        backend = cache.LRUCache()
+        namespace = cache.Namespace(backend, "test", version_ttl=0)
+        other_process = cache.Namespace(backend, "test", version_ttl=0)
+
+        namespace.set(("id", 1), "value")
+        self.assertEqual(other_process.get(("id", 1)), "value")
+
+        namespace.invalidate()
+        self.assertEqual(namespace.get(("id", 1)), None)
+        self.assertEqual(other_process.get(("id", 1)), None)
+
+    def test_version_evicted(self):
+        backend = cache.LRUCache()
+        namespace = cache.Namespace(backend, "test", version_ttl=0)
+        namespace.set(("id", 1), "value")
+        namespace.invalidate()
+        namespace.set(("id", 1), "new_value")
+
+        # the version counter evicted, or overwritten in an MmapCache slot
+        backend.delete("test:version")
+        self.assertEqual(namespace.get(("id", 1)), None)
+        self.assertNotIn(namespace.version, [0, 1, 2])
+
+        namespace.set(("id", 1), "value")
+        self.assertEqual(cache.Namespace(backend, "test").get(("id", 1)), "value")
+
+
+class TestFromUrl(test.TestCase):
+    def test_from_url(self):
+        self.assertIsInstance(cache.from_url(None), cache.LRUCache)
+        self.assertEqual(cache.from_url("local://?maxsize=10").maxsize, 10)
+
+        with tempfile.TemporaryDirectory() as directory:
+            backend = cache.from_url("mmap://%s/cache?slots=16&slot_size=8192" % directory)
+            self.assertIsInstance(backend, cache.MmapCache)
+            self.assertEqual((backend.slots, backend.slot_size), (16, 8192))
+
+        if pymemcache is not None:
+            self.assertIsInstance(cache.from_url("memcache://localhost:11211"), cache.MemcacheCache)
+        self.assertRaises(ValueError, lambda: cache.from_url("unknown://"))
@@ -0,0 +1,36 @@
+import datetime
+
+from backend import test
+from backend.lock import Lock, LockTaken
+
+
+class TestLock(test.TestCase):
+    def test_acquire(self):
+        owner = Lock.acquire("test")
+        self.assertRaises(LockTaken, lambda: Lock.acquire("test"))
+        Lock.acquire("other")
+
+        Lock.release("test", "not_the_owner")
+        self.assertRaises(LockTaken, lambda: Lock.acquire("test"))
+
+        Lock.release("test", owner)
+        Lock.acquire("test")
+
+    def test_expires(self):
+        Lock.acquire("test", ttl=600)
+        lock = Lock.get_by_id("test")
+        lock.expires = datetime.datetime.now() - datetime.timedelta(seconds=1)
+        lock.put()
+        Lock.acquire("test")
+
+    def test_hold(self):
+        with Lock.hold("test"):
+            self.assertRaises(LockTaken, lambda: Lock.acquire("test"))
+        Lock.acquire("test")
+
+        def fail():
+            with Lock.hold("failing"):
+                raise ValueError()
+
+        self.assertRaises(ValueError, fail)
+        Lock.acquire("failing")
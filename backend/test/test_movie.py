@@ -1,6 +1,14 @@
+import os
 import random
 
+from unittest import mock
+
+from google.api_core.exceptions import BadRequest
+from google.cloud import ndb
+
 from backend import movie, test
+from backend.api import movie as api_movie
+from backend.stub.omdb_client_wrapper import DATA
 
 
 class TestMovie(test.TestCase):
@@ -85,11 +93,34 @@ class TestMovie(test.TestCase):
         obj = movie.Movie.create_from_result(result)
         self.assertEqual(obj.title, result["title"])
 
+    def test_create_many_from_results(self):
+        existing = movie.Movie.create(title="existing", imdb_id="tt1234567")
+        results = [
+            dict(DATA[-1], title=f"test{i}", imdb_id=f"tt7654{str(i).zfill(3)}")
+            for i in range(25)
+        ]
+        results += [dict(DATA[-1], title="duplicate", imdb_id="tt7654000"), dict(DATA[-1], imdb_id="tt1234567")]
+
+        entities = movie.Movie.create_many_from_results(results, chunk_size=10)
+        self.assertEqual(len(entities), 25)
+        self.assertEqual(movie.Movie.query().count(), 26)
+        self.assertEqual(movie.Movie.find_by_imdb_id("tt7654000").title, "test0")
+        self.assertEqual(movie.Movie.find_by_imdb_id("tt7654024").ratings[0].source, "source1")
+        self.assertEqual(movie.Movie.find_by_imdb_id("tt1234567").title, existing.title)
+
+        self.assertRaises(
+            movie.IMDBIdInvalid,
+            lambda: movie.Movie.create_many_from_results([dict(DATA[-1], imdb_id="tt1111111"), dict(DATA[-1], imdb_id=None)]),
+        )
+        self.assertEqual(movie.Movie.find_by_imdb_id("tt1111111"), None)
+        self.assertRaises(movie.TitleInvalid, lambda: movie.Movie.validate_result(dict(DATA[-1], title="")))
+
     def test_get(self):
         obj = movie.Movie.create(title="test", imdb_id="tt1234567")
         self.assertEqual(obj, movie.Movie.get(obj.id))
 
         self.assertRaises(movie.IdInvalid, lambda: movie.Movie.get(id="invalid_id"))
+        self.assertRaises(movie.IdInvalid, lambda: movie.Movie.get(id="a"))
 
         missing_id = obj.id
         movie.Movie.delete(missing_id)
@@ -106,6 +137,45 @@ class TestMovie(test.TestCase):
 
         self.assertRaises(movie.IdInvalid, lambda: movie.Movie.delete("invalid_id"))
 
+    def test_get_multi(self):
+        obj = movie.Movie.create(title="test", imdb_id="tt1234567")
+        obj1 = movie.Movie.create(title="test1", imdb_id="tt7654321")
+        missing = movie.Movie.create(title="test2", imdb_id="tt1111111")
+        missing_id = missing.id
+        movie.Movie.delete(missing_id)
+
+        results = movie.Movie.get_multi([obj1.id, "invalid_id", missing_id, obj.id, "a", "!!"])
+        self.assertEqual(len(results), 6)
+        self.assertEqual(results[0], obj1)
+        self.assertIsInstance(results[1], movie.IdInvalid)
+        self.assertIsInstance(results[2], movie.NotFound)
+        self.assertEqual(results[3], obj)
+        # not base64 and an empty key path
+        self.assertIsInstance(results[4], movie.IdInvalid)
+        self.assertIsInstance(results[5], movie.IdInvalid)
+
+        self.assertEqual(movie.Movie.get_multi([]), [])
+
+    def test_cache(self):
+        obj = movie.Movie.create(title="test", imdb_id="tt1234567")
+        movie.Movie.get(obj.id)
+        movie.Movie.get_by_title(obj.title)
+        movie.Movie.find_by_imdb_id(obj.imdb_id)
+        self.assertEqual(movie.cache.stats, dict(hits=0, misses=3))
+
+        self.assertEqual(movie.Movie.get(obj.id), obj)
+        self.assertEqual(movie.Movie.get_by_title(obj.title), obj)
+        self.assertEqual(movie.Movie.find_by_imdb_id(obj.imdb_id), obj)
+        self.assertEqual(movie.Movie.get_multi([obj.id]), [obj])
+        self.assertEqual(movie.cache.stats, dict(hits=4, misses=3))
+
+        movie.Movie.delete(obj.id)
+        self.assertRaises(movie.NotFound, lambda: movie.Movie.get_by_title(obj.title))
+        self.assertEqual(movie.Movie.find_by_imdb_id(obj.imdb_id), None)
+
+        obj = movie.Movie.create(title="test", imdb_id="tt1234567")
+        self.assertEqual(movie.Movie.get_by_title(obj.title), obj)
+
     def test_get_by_title(self):
         obj = movie.Movie.create(title="test", imdb_id="tt1234567")
         self.assertEqual(obj, movie.Movie.get_by_title(obj.title))
@@ -120,6 +190,28 @@ class TestMovie(test.TestCase):
 
         self.assertEqual(movie.Movie.find_by_imdb_id("missing_imdb_id"), None)
 
+    def test_imdb_id_key(self):
+        obj = movie.Movie.create(title="test", imdb_id="tt1234567")
+        self.assertEqual(obj.key, ndb.Key(movie.Movie, "tt1234567"))
+
+    def test_migrate_keys(self):
+        legacy = movie.Movie(title="test", imdb_id="tt1234567", ratings=[movie.Rating(source="source", value="1")])
+        legacy.put()
+        movie.Movie(title="test", imdb_id="tt1234567").put()
+        movie.Movie(title="test1", imdb_id="tt7654321").put()
+        movie.Movie.create(title="test2", imdb_id="tt1111111")
+        movie.Movie(title="test2", imdb_id="tt1111111").put()
+
+        self.assertEqual(movie.Movie.migrate_keys(batch_size=2), (2, 2))
+        self.assertEqual(movie.Movie.query().count(), 3)
+
+        obj = movie.Movie.find_by_imdb_id("tt1234567")
+        self.assertEqual(obj.key, ndb.Key(movie.Movie, "tt1234567"))
+        self.assertEqual(obj.ratings[0].source, "source")
+        self.assertEqual(movie.Movie.find_by_imdb_id("tt7654321").title, "test1")
+
+        self.assertEqual(movie.Movie.migrate_keys(), (0, 0))
+
     def test_list(self):
         indexes = [str(i).zfill(3) for i in [*range(1, 21)]]
         random.shuffle(indexes)
@@ -149,6 +241,158 @@ class TestMovie(test.TestCase):
             [m.title for m in movies],
         )
 
+    def test_list_page(self):
+        indexes = [str(i).zfill(3) for i in [*range(1, 26)]]
+        random.shuffle(indexes)
+        for i in indexes:
+            movie.Movie.create(title=f"test{i}", imdb_id=f"tt1234{i}")
+
+        titles = []
+        movies, cursor = movie.Movie.list_page()
+        titles += [m.title for m in movies]
+        self.assertEqual(len(movies), 10)
+        self.assertTrue(cursor)
+
+        movies, cursor = movie.Movie.list_page(cursor=cursor)
+        titles += [m.title for m in movies]
+        self.assertEqual(len(movies), 10)
+        self.assertTrue(cursor)
+
+        movies, cursor = movie.Movie.list_page(cursor=cursor)
+        titles += [m.title for m in movies]
+        self.assertEqual(len(movies), 5)
+        self.assertEqual(cursor, None)
+
+        self.assertEqual([f"test{str(i).zfill(3)}" for i in range(1, 26)], titles)
+
+        movies, cursor = movie.Movie.list_page(offset=20, limit=3)
+        self.assertEqual([m.title for m in movies], ["test021", "test022", "test023"])
+        self.assertTrue(cursor)
+
+        self.assertRaises(movie.CursorInvalid, lambda: movie.Movie.list_page(cursor="invalid_cursor"))
+        # cursors that decode, but the datastore rejects
+        self.assertRaises(movie.CursorInvalid, lambda: movie.Movie.list_page(cursor="bm90IGEgY3Vyc29y"))
+        with mock.patch.object(ndb.Query, "fetch_page", side_effect=BadRequest("Invalid cursor")):
+            self.assertRaises(movie.CursorInvalid, lambda: movie.Movie.list_page(cursor=cursor))
+
+    def test_list_page_projection(self):
+        obj = movie.Movie.create(title="test", imdb_id="tt1234567", plot="plot")
+
+        movies, _ = movie.Movie.list_page(projection=movie.Movie.LIST_PROJECTION)
+        self.assertEqual(len(movies), 1)
+        self.assertEqual(movies[0].id, obj.id)
+        self.assertEqual(movies[0].title, "test")
+        self.assertEqual(movies[0].imdb_id, "tt1234567")
+        self.assertRaises(ndb.UnprojectedPropertyError, lambda: movies[0].plot)
+
+    def test_typed_properties(self):
+        obj = movie.Movie.create_from_result(dict(DATA[-1], year="1995", genre="Crime, Drama"))
+        self.assertEqual(movie.parse_number("7,357"), 7357)
+        self.assertEqual(movie.parse_number("82 min"), 82)
+        self.assertEqual(movie.parse_number("2019–2020"), 2019)
+        self.assertEqual(movie.parse_number("7.7", float), 7.7)
+        self.assertEqual(movie.parse_number("N/A"), None)
+        self.assertEqual(movie.parse_list("Crime, Drama"), ["Crime", "Drama"])
+        self.assertEqual(movie.parse_list("N/A"), [])
+        self.assertEqual((obj.release_year, obj.decade), (1995, 1990))
+        self.assertEqual(obj.genres, ["Crime", "Drama"])
+
+    def test_list_page_filters(self):
+        def create(title, year, rating, genre, votes="1,000"):
+            return movie.Movie.create(
+                title=title, imdb_id="tt%07d" % random.randint(0, 9999999),
+                year=year, imdb_rating=rating, genre=genre, imdb_votes=votes, language="English",
+            )
+
+        heat = create("Heat", "1995", "8.3", "Action, Crime, Drama")
+        se7en = create("Se7en", "1995", "8.6", "Crime, Drama, Mystery")
+        create("Speed", "1994", "7.3", "Action, Thriller")
+        create("Gladiator", "2000", "8.5", "Action, Drama")
+        create("Unrated", "1999", "N/A", "Drama")
+
+        page, cursor = movie.Movie.list_page(genre="Drama", decade=1990, sort="-rating", limit=1)
+        self.assertEqual(page, [se7en])
+        page, cursor = movie.Movie.list_page(genre="Drama", decade=1990, sort="-rating", cursor=cursor, limit=2)
+        self.assertEqual([m.title for m in page], ["Heat", "Unrated"])
+
+        page, _ = movie.Movie.list_page(min_rating=8.4, sort="rating")
+        self.assertEqual([m.title for m in page], ["Gladiator", "Se7en"])
+        page, _ = movie.Movie.list_page(year=1995, sort="-votes")
+        self.assertEqual(set(page), set([heat, se7en]))
+        page, _ = movie.Movie.list_page(genre="Crime", language="English", sort="title")
+        self.assertEqual(page, [heat, se7en])
+        page, _ = movie.Movie.list_page(sort="year", limit=2)
+        self.assertEqual([m.title for m in page], ["Speed", "Heat"])
+
+        self.assertRaises(movie.ListInvalid, lambda: movie.Movie.list_page(sort="plot"))
+        self.assertRaises(movie.ListInvalid, lambda: movie.Movie.list_page(min_rating=8, sort="-year"))
+        # no index for these
+        self.assertRaises(movie.ListInvalid, lambda: movie.Movie.list_page(year=1995, language="English"))
+        self.assertRaises(movie.ListInvalid, lambda: movie.Movie.list_page(genre="Drama", year=1995, sort="-votes"))
+        # no sort sorts by title
+        self.assertEqual(movie.Movie.list_page(sort=None)[0], movie.Movie.list_page()[0])
+
+    def test_list_indexes(self):
+        indexes = []
+        with open(os.path.join(os.path.dirname(__file__), "..", "..", "index.yaml")) as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("- kind:"):
+                    indexes.append([])
+                elif line.startswith("- name:"):
+                    indexes[-1].append([line.split(":")[1].strip(), "asc"])
+                elif line.startswith("direction:"):
+                    indexes[-1][-1][1] = line.split(":")[1].strip()
+        indexes = [(set(name for name, _ in index[:-1]), tuple(index[-1])) for index in indexes]
+
+        filters = dict(genres="genre", languages="language", release_year="year", decade="decade")
+        values = dict(genre="Drama", language="English", year=1995, decade=1990)
+        for combination in movie.Movie.LIST_FILTERS:
+            for sort, prop in movie.Movie.SORTS.items():
+                for direction in ("asc", "desc"):
+                    kwargs = dict((filters[name], values[filters[name]]) for name in combination)
+                    # accepted by list_page
+                    movie.Movie._list_query(sort if direction == "asc" else "-" + sort, **kwargs)
+                    # built in single property indexes, and sorts on an equality filter are dropped
+                    if not combination or prop in combination:
+                        continue
+                    with self.subTest(filters=combination, sort=prop, direction=direction):
+                        self.assertIn((set(combination), (prop, direction)), indexes)
+
+    def test_search(self):
+        heat = movie.Movie.create(title="Heat", imdb_id="tt0113277")
+        movie.Movie(id="tt0097165", title="Dead Poets Society", imdb_id="tt0097165").put()
+
+        self.assertEqual(movie.Movie.search("hea"), [(heat.id, "Heat", "tt0113277")])
+        self.assertEqual(len(movie.index), 2)
+        self.assertEqual([m[2] for m in movie.Movie.search("dead poet")], ["tt0097165"])
+
+        # kept up to date by create and delete without rebuilding
+        with mock.patch.object(movie.Movie, "build_index", side_effect=AssertionError):
+            movie.Movie.create(title="Heathers", imdb_id="tt0097493")
+            self.assertEqual([m[1] for m in movie.Movie.search("heat")], ["Heat", "Heathers"])
+            movie.Movie.delete(heat.id)
+            self.assertEqual([m[1] for m in movie.Movie.search("heat")], ["Heathers"])
+
+        # a movie created by another process
+        movie.Movie(id="tt0113278", title="Heat 2", imdb_id="tt0113278").put()
+        movie.index_version.invalidate()
+        self.assertEqual([m[1] for m in movie.Movie.search("heat")], ["Heat 2", "Heathers"])
+
+        # with a process local cache the other process' bump isn't seen
+        movie.Movie(id="tt0113279", title="Heat 3", imdb_id="tt0113279").put()
+        with mock.patch.object(movie.cache_backend, "shared", False):
+            self.assertEqual(len(movie.Movie.search("heat")), 2)
+            movie.index.built -= movie.INDEX_TTL + 1
+            self.assertEqual(len(movie.Movie.search("heat")), 3)
+
+    def test_search_migrate_keys(self):
+        legacy = movie.Movie(title="Heat", imdb_id="tt0113277")
+        legacy.put()
+        self.assertEqual(movie.Movie.search("heat")[0][0], legacy.id)
+        movie.Movie.migrate_keys()
+        self.assertEqual(movie.Movie.search("heat")[0][0], ndb.Key(movie.Movie, "tt0113277").urlsafe().decode())
+
 
 class TestMovieApi(test.TestCase):
     def test_list(self):
@@ -183,6 +427,31 @@ class TestMovieApi(test.TestCase):
             [m["title"] for m in movies],
         )
 
+        for limit in [0, -1]:
+            resp = self.api_client.post("movie.list", dict(limit=limit))
+            self.assertEqual(resp.get("error").get("error_name"), "ListRequestInvalid")
+        with mock.patch.object(api_movie, "LIST_LIMIT", 3):
+            self.assertEqual(len(self.api_client.post("movie.list", dict(limit=10)).get("movies")), 3)
+
+    def test_list_cursor(self):
+        for i in [str(i).zfill(3) for i in [*range(1, 16)]]:
+            movie.Movie.create(title=f"test{i}", imdb_id=f"tt1234{i}")
+
+        resp = self.api_client.post("movie.list", dict(limit=10))
+        self.assertEqual(len(resp.get("movies")), 10)
+        next_cursor = resp.get("next_cursor")
+        self.assertTrue(next_cursor)
+
+        resp = self.api_client.post("movie.list", dict(limit=10, cursor=next_cursor))
+        self.assertEqual(
+            [f"test{str(i).zfill(3)}" for i in range(11, 16)],
+            [m["title"] for m in resp.get("movies")],
+        )
+        self.assertEqual(resp.get("next_cursor"), None)
+
+        resp = self.api_client.post("movie.list", dict(cursor="invalid_cursor"))
+        self.assertEqual(resp.get("error").get("error_name"), "CursorInvalid")
+
     def test_get(self):
         obj = movie.Movie.create(title="test", imdb_id="tt1234567")
         obj1 = movie.Movie.create(title="test1", imdb_id="tt7654321")
@@ -207,6 +476,26 @@ class TestMovieApi(test.TestCase):
         resp = self.api_client.post("movie.get", dict(title="missing_title"))
         self.assertEqual(resp.get("error").get("error_name"), "NotFound")
 
+    def test_get_many(self):
+        obj = movie.Movie.create(title="test", imdb_id="tt1234567")
+        obj1 = movie.Movie.create(title="test1", imdb_id="tt7654321")
+
+        resp = self.api_client.post("movie.get_many", dict(ids=[obj1.id, "invalid_id", obj.id]))
+        self.assertEqual(resp.get("error"), None)
+        self.assertEqual([m["id"] for m in resp.get("movies")], [obj1.id, obj.id])
+        self.assertEqual(resp.get("movies")[0]["title"], "test1")
+        self.assertEqual(resp.get("errors"), [dict(id="invalid_id", error_name="IdInvalid", message="Id is invalid: invalid_id")])
+
+        resp = self.api_client.post("movie.get_many", dict(ids=["a", "b"]))
+        self.assertEqual(resp.get("error"), None)
+        self.assertEqual([e["error_name"] for e in resp.get("errors")], ["IdInvalid", "IdInvalid"])
+
+        resp = self.api_client.post("movie.get_many")
+        self.assertEqual(resp.get("error").get("error_name"), "GetManyRequestInvalid")
+
+        resp = self.api_client.post("movie.get_many", dict(ids=[obj.id] * 101))
+        self.assertEqual(resp.get("error").get("error_name"), "GetManyRequestInvalid")
+
     def test_add(self):
         resp = self.api_client.post("movie.add", dict(title="LOL"))
         self.assertEqual(resp.get("error"), None)
@@ -260,3 +549,26 @@ class TestMovieApi(test.TestCase):
             headers=dict(authorization=access_token),
         )
         self.assertEqual(resp.get("error").get("error_name"), "IdInvalid")
+
+    def test_search(self):
+        movie.Movie.create(title="Heat", imdb_id="tt0113277")
+        movie.Movie.create(title="Heathers", imdb_id="tt0097493")
+
+        resp = self.api_client.post("movie.search", dict(query="heat"))
+        self.assertEqual(resp.get("error"), None)
+        self.assertEqual([m.get("imdb_id") for m in resp.get("movies")], ["tt0113277", "tt0097493"])
+
+        resp = self.api_client.post("movie.search", dict(query="heat", limit=1))
+        self.assertEqual([m.get("title") for m in resp.get("movies")], ["Heat"])
+
+    def test_list_filters(self):
+        movie.Movie.create(title="Heat", imdb_id="tt0113277", year="1995", imdb_rating="8.3", genre="Crime, Drama")
+        movie.Movie.create(title="Se7en", imdb_id="tt0114369", year="1995", imdb_rating="8.6", genre="Crime, Drama")
+        movie.Movie.create(title="Gladiator", imdb_id="tt0172495", year="2000", imdb_rating="8.5", genre="Drama")
+
+        resp = self.api_client.post("movie.list", dict(genre="Drama", decade=1990, sort="-rating"))
+        self.assertEqual(resp.get("error"), None)
+        self.assertEqual([m.get("title") for m in resp.get("movies")], ["Se7en", "Heat"])
+
+        resp = self.api_client.post("movie.list", dict(sort="plot"))
+        self.assertEqual(resp.get("error").get("error_name"), "ListInvalid")
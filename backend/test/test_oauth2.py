@@ -1,4 +1,7 @@
 import datetime
+import time
+
+from unittest import mock
 
 from backend import api, wsgi, test, oauth2
 from backend.wsgi import messages, message_types
@@ -49,8 +52,55 @@ class TestOauth2(test.TestCase):
         session.access_token.expires = datetime.datetime.now() - datetime.timedelta(seconds=1)
         self.assertTrue(session.access_token.expired())
 
+    def test_revoke_persisted(self):
+        session = oauth2.Oauth2.create(ndb.Key("Test", "123"))
+        token = session.access_token.token
+        self.assertEqual(oauth2.Oauth2.get(token), session)
+
+        session.revoke()
+        ndb.get_context().clear_cache()
+        self.assertRaises(oauth2.Unauthorized, lambda: oauth2.Oauth2.get(token))
+
+        session = oauth2.Oauth2.create(ndb.Key("Test", "123"))
+        session.expire()
+        ndb.get_context().clear_cache()
+        self.assertRaises(oauth2.Unauthorized, lambda: oauth2.Oauth2.get(session.access_token.token))
+
+    def test_cache(self):
+        session = oauth2.Oauth2.create(ndb.Key("Test", "123"))
+        token = session.access_token.token
+        self.assertEqual(oauth2.cache.get(token), None)
+
+        self.assertEqual(oauth2.Oauth2.get(token), session)
+        self.assertEqual(oauth2.cache.get(token), session)
+        self.assertEqual(oauth2.Oauth2.get(token), session)
+        self.assertEqual(oauth2.cache.stats, dict(hits=2, misses=2))
+
+        session.revoke()
+        self.assertEqual(oauth2.cache.get(token), None)
+        self.assertRaises(oauth2.Unauthorized, lambda: oauth2.Oauth2.get(token))
+
+    def test_cache_lifetime(self):
+        session = oauth2.Oauth2.create(ndb.Key("Test", "123"))
+        token = session.access_token.token
+        session.update(access_token_expires=datetime.datetime.now() + datetime.timedelta(seconds=0.5))
+
+        oauth2.Oauth2.get(token)
+        self.assertEqual(oauth2.cache.get(token), session)
+        time.sleep(0.6)
+        self.assertEqual(oauth2.cache.get(token), None)
+        self.assertRaises(oauth2.Unauthorized, lambda: oauth2.Oauth2.get(token))
+
+        # looked up the instant it expires, with no lifetime left to cache it for
+        session.update(access_token_expires=datetime.datetime.now() + datetime.timedelta(hours=1))
+        with mock.patch.object(oauth2, "datetime") as now:
+            now.datetime.now.return_value = session.access_token.expires
+            self.assertEqual(oauth2.Oauth2.get(token), session)
+        self.assertEqual(oauth2.cache.get(token), None)
+
     def test_renew(self):
         session = oauth2.Oauth2.create(ndb.Key("Test", "123"))
+        oauth2.Oauth2.get(session.access_token.token)
 
         self.assertRaises(oauth2.Unauthorized, lambda: oauth2.Oauth2.renew(session.access_token.token, "this_should_fail"))
 
@@ -58,6 +108,47 @@ class TestOauth2(test.TestCase):
 
         self.assertEqual(session.user_key, new_session.user_key)
         self.assertTrue(session.access_token.token != new_session.access_token.token)
+        self.assertRaises(oauth2.Unauthorized, lambda: oauth2.Oauth2.get(session.access_token.token))
+
+    def test_sweep(self):
+        sessions = [oauth2.Oauth2.create(ndb.Key("Test", str(i))) for i in range(7)]
+        for session in sessions[:5]:
+            session.revoke()
+        oauth2.RevokedToken(id="old", expires=datetime.datetime.now() - datetime.timedelta(seconds=1)).put()
+        oauth2.RevokedToken(id="new", expires=datetime.datetime.now() + datetime.timedelta(hours=1)).put()
+
+        result = oauth2.Oauth2.sweep(batch_size=2, max_batches=1)
+        self.assertEqual(result["sessions"], 2)
+        self.assertTrue(result["cursor"])
+
+        result = oauth2.Oauth2.sweep(batch_size=2, cursor=result["cursor"])
+        self.assertEqual(result, dict(sessions=3, revoked_tokens=1, batches=2, cursor=None))
+        self.assertEqual(set(s.key for s in oauth2.Oauth2.query()), set(s.key for s in sessions[5:]))
+        self.assertEqual([k.id() for k in oauth2.RevokedToken.query().fetch(keys_only=True)], ["new"])
+
+        self.assertEqual(oauth2.Oauth2.sweep()["sessions"], 0)
+        self.assertRaises(ValueError, lambda: oauth2.Oauth2.sweep(max_batches=0))
+
+    def test_reindex(self):
+        class LegacyOauth2(ndb.Model):
+            # a session written before expires existed
+            created = ndb.DateTimeProperty(indexed=False)
+            refresh_token_token = ndb.StringProperty(indexed=True)
+
+            @classmethod
+            def _get_kind(cls):
+                return "Oauth2"
+
+        created = datetime.datetime.now() - datetime.timedelta(days=30)
+        LegacyOauth2(id="old", created=created, refresh_token_token="token").put()
+        LegacyOauth2(id="new", created=datetime.datetime.now(), refresh_token_token="token").put()
+        ndb.Model._kind_map["Oauth2"] = oauth2.Oauth2
+        ndb.get_context().clear_cache()
+        self.assertEqual(oauth2.Oauth2.sweep()["sessions"], 0)
+
+        self.assertEqual(oauth2.Oauth2.reindex(batch_size=1), 2)
+        self.assertEqual(oauth2.Oauth2.sweep()["sessions"], 1)
+        self.assertEqual([s.key.id() for s in oauth2.Oauth2.query()], ["new"])
 
     def test_collision(self):
         access_token = oauth2.AccessToken("token")
@@ -75,6 +166,84 @@ class TestOauth2(test.TestCase):
         self.assertTrue(session.refresh_token.expires > datetime.datetime.now())
 
 
+class TestSignedOauth2(test.TestCase):
+    def setUp(self):
+        super(TestSignedOauth2, self).setUp()
+        patcher = mock.patch.object(oauth2, "signer", oauth2.TokenSigner([("k2", "new"), ("k1", "old")]))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_signer(self):
+        signer = oauth2.TokenSigner.from_string("k2:new, k1:old")
+        self.assertEqual(signer.keys, [("k2", "new"), ("k1", "old")])
+        self.assertFalse(oauth2.TokenSigner.from_string(None).enabled)
+
+        token = signer.sign(dict(sid="123"))
+        self.assertTrue(token.startswith("v1.k2."))
+        self.assertEqual(signer.verify(token), dict(sid="123"))
+
+        # tokens signed by an older key still verify, until it's removed
+        old_token = oauth2.TokenSigner([("k1", "old")]).sign(dict(sid="123"))
+        self.assertEqual(signer.verify(old_token), dict(sid="123"))
+        self.assertEqual(oauth2.TokenSigner([("k2", "new")]).verify(old_token), None)
+
+        self.assertEqual(oauth2.TokenSigner([("k2", "other")]).verify(token), None)
+        self.assertEqual(signer.verify(token[:-1]), None)
+        self.assertEqual(signer.verify("token"), None)
+        self.assertEqual(signer.verify(None), None)
+
+    def test_create(self):
+        session = oauth2.Oauth2.create(ndb.Key("Test", "123"))
+        token = session.access_token.token
+        self.assertTrue(oauth2.TokenSigner.is_signed(token))
+        self.assertNotEqual(session.key.id(), token)
+
+        with mock.patch.object(oauth2.Oauth2, "_get", side_effect=AssertionError):
+            verified = oauth2.Oauth2.get(token)
+        self.assertEqual(verified.key, session.key)
+        self.assertEqual(verified.user_key, ndb.Key("Test", "123"))
+        self.assertEqual(verified.access_token.expires, session.access_token.expires)
+
+        self.assertRaises(oauth2.Unauthorized, lambda: oauth2.Oauth2.get(token[:-1]))
+        with mock.patch.object(oauth2, "signer", oauth2.TokenSigner([("k3", "newer")])):
+            self.assertRaises(oauth2.Unauthorized, lambda: oauth2.Oauth2.get(token))
+
+    def test_expired(self):
+        created = datetime.datetime.now() - datetime.timedelta(hours=7)
+        access_token = oauth2.AccessToken.create_signed("123", ndb.Key("Test", "123"), created)
+        self.assertTrue(access_token.expired())
+        self.assertRaises(oauth2.Unauthorized, lambda: oauth2.Oauth2.get(access_token.token))
+
+    def test_revoke(self):
+        session = oauth2.Oauth2.create(ndb.Key("Test", "123"))
+        token = session.access_token.token
+
+        oauth2.Oauth2.get(token).revoke()
+        self.assertRaises(oauth2.Unauthorized, lambda: oauth2.Oauth2.get(token))
+        self.assertTrue(session.key.get().refresh_token.expired())
+        self.assertRaises(oauth2.Unauthorized, lambda: oauth2.Oauth2.renew(token, session.refresh_token.token))
+
+        # other processes see the revocation once they reload the list
+        oauth2.revocations.clear()
+        self.assertRaises(oauth2.Unauthorized, lambda: oauth2.Oauth2.get(token))
+
+    def test_renew(self):
+        session = oauth2.Oauth2.create(ndb.Key("Test", "123"))
+        token = session.access_token.token
+        self.assertRaises(oauth2.Unauthorized, lambda: oauth2.Oauth2.renew(token, "this_should_fail"))
+
+        new_session = oauth2.Oauth2.renew(token, session.refresh_token.token)
+        self.assertEqual(new_session.user_key, session.user_key)
+        self.assertTrue(oauth2.TokenSigner.is_signed(new_session.access_token.token))
+        self.assertEqual(oauth2.Oauth2.get(new_session.access_token.token).key, new_session.key)
+        self.assertRaises(oauth2.Unauthorized, lambda: oauth2.Oauth2.get(token))
+
+    def test_api(self):
+        session = oauth2.Oauth2.create(ndb.Key("Test", "123"))
+        resp = self.api_client.post("test.required", headers=dict(authorization=session.access_token.token))
+        self.assertEqual(resp.get("id"), "123")
+
+
 class TestOauth2Api(test.TestCase):
     def test_authorized(self):
         session = oauth2.Oauth2.create(ndb.Key("Test", "123"))
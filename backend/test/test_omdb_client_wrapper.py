@@ -0,0 +1,185 @@
+import os
+import tempfile
+import threading
+import time
+
+from omdb import OMDBNoResults
+
+from backend import test
+from backend.omdb_client_wrapper import NotFound, OMDBClientWrapper, ResponseCache, SingleFlight
+
+
+class FakeOMDB:
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = []
+
+    def get_movie(self, title=None, imdbid=None, **kwargs):
+        self.calls.append(title or imdbid)
+        time.sleep(self.delay)
+        if (title or imdbid) == "missing":
+            raise OMDBNoResults("Movie not found!", kwargs)
+        return dict(title=title, imdb_id=imdbid)
+
+    def search(self, title, **kwargs):
+        self.calls.append(title)
+        time.sleep(self.delay)
+        return dict(search=[dict(title=title)])
+
+
+def run_concurrently(func, *args, count=5):
+    results = []
+
+    def call():
+        try:
+            results.append(func(*args))
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(count)]
+    [thread.start() for thread in threads]
+    [thread.join() for thread in threads]
+    return results
+
+
+class TestSingleFlight(test.TestCase):
+    def test_do(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        def slow(value):
+            calls.append(value)
+            time.sleep(0.05)
+            return value
+
+        self.assertEqual(run_concurrently(single_flight.do, "key", slow, "value"), ["value"] * 5)
+        self.assertEqual(calls, ["value"])
+
+        # finished calls are not reused
+        self.assertEqual(single_flight.do("key", slow, "value2"), "value2")
+        self.assertEqual(calls, ["value", "value2"])
+
+    def test_error(self):
+        single_flight = SingleFlight()
+
+        def fail():
+            time.sleep(0.05)
+            raise ValueError("fail")
+
+        results = run_concurrently(single_flight.do, "key", fail)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    def test_base_exception(self):
+        class Abort(BaseException):
+            pass
+
+        single_flight = SingleFlight()
+        started = threading.Event()
+        results = []
+
+        def abort():
+            started.set()
+            time.sleep(0.05)
+            raise Abort()
+
+        def follow():
+            started.wait()
+            try:
+                single_flight.do("key", abort)
+            except Abort as e:
+                results.append(e)
+
+        thread = threading.Thread(target=follow, daemon=True)
+        thread.start()
+        self.assertRaises(Abort, lambda: single_flight.do("key", abort))
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(results), 1)
+
+
+class TestOMDBClientWrapper(test.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = OMDBClientWrapper("apikey")
+        self.client.omdb = FakeOMDB(delay=0.05)
+
+    def test_get_movie_by_title(self):
+        results = run_concurrently(self.client.get_movie_by_title, "LOL")
+        self.assertEqual(results, [dict(title="LOL", imdb_id=None)] * 5)
+        self.assertEqual(self.client.omdb.calls, ["LOL"])
+
+        results = run_concurrently(self.client.get_movie_by_title, "missing")
+        self.assertTrue(all(isinstance(result, NotFound) for result in results))
+        self.assertEqual(self.client.omdb.calls, ["LOL", "missing"])
+
+    def test_get_movie_by_imdb_id(self):
+        run_concurrently(self.client.get_movie_by_imdb_id, "tt1592873")
+        self.assertEqual(self.client.omdb.calls, ["tt1592873"])
+
+        self.assertRaises(NotFound, lambda: self.client.get_movie_by_imdb_id("missing"))
+
+    def test_search_by_title(self):
+        run_concurrently(self.client.search_by_title, "Steven")
+        self.assertEqual(self.client.omdb.calls, ["Steven"])
+
+
+class TestResponseCache(test.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "omdb.sqlite")
+        self.client = OMDBClientWrapper("apikey", cache_path=self.path)
+        self.client.omdb = FakeOMDB()
+
+    def tearDown(self):
+        self.directory.cleanup()
+        super().tearDown()
+
+    def test_cache(self):
+        self.assertEqual(self.client.get_movie_by_title("LOL"), dict(title="LOL", imdb_id=None))
+        self.assertEqual(self.client.get_movie_by_title(" lol "), dict(title="LOL", imdb_id=None))
+        self.client.search_by_title("Steven")
+        self.client.search_by_title("steven")
+        self.assertEqual(self.client.omdb.calls, ["LOL", "Steven"])
+
+        # persisted across instances
+        client = OMDBClientWrapper("apikey", cache_path=self.path)
+        client.omdb = FakeOMDB()
+        self.assertEqual(client.get_movie_by_title("LOL"), dict(title="LOL", imdb_id=None))
+        self.assertEqual(client.omdb.calls, [])
+
+    def test_not_found(self):
+        self.assertRaises(NotFound, lambda: self.client.get_movie_by_imdb_id("missing"))
+        self.assertRaises(NotFound, lambda: self.client.get_movie_by_imdb_id("missing"))
+        self.assertEqual(self.client.omdb.calls, ["missing"])
+
+    def test_ttl(self):
+        self.client.response_cache.ttl = 0
+        self.client.response_cache.not_found_ttl = 0
+        self.client.get_movie_by_title("LOL")
+        self.client.get_movie_by_title("LOL")
+        self.assertRaises(NotFound, lambda: self.client.get_movie_by_title("missing"))
+        self.assertRaises(NotFound, lambda: self.client.get_movie_by_title("missing"))
+        self.assertEqual(self.client.omdb.calls, ["LOL", "LOL", "missing", "missing"])
+
+    def test_prune(self):
+        response_cache = ResponseCache(self.path, ttl=0, max_rows=3, prune_interval=1)
+        response_cache.set("title:expired", dict(title="expired"))
+        for i in range(4):
+            response_cache.set("title:%s" % i, not_found="Movie not found!")
+            time.sleep(0.01)
+        self.assertEqual(len(response_cache), 3)
+        self.assertEqual(response_cache.get("title:0"), None)
+        self.assertEqual(response_cache.get("title:3"), (None, "Movie not found!"))
+
+        # also pruned when opened
+        ResponseCache(self.path, ttl=0).set("title:expired", dict(title="expired"))
+        self.assertEqual(len(response_cache), 4)
+        self.assertEqual(len(ResponseCache(self.path)), 3)
+
+    def test_clear(self):
+        self.client.get_movie_by_title("LOL")
+        self.client.response_cache.clear()
+        self.client.get_movie_by_title("LOL")
+        self.assertEqual(self.client.omdb.calls, ["LOL", "LOL"])
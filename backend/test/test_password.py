@@ -0,0 +1,46 @@
+import threading
+
+from backend import test
+from backend.password import PasswordHasher, HashingBusy
+
+
+class TestPasswordHasher(test.TestCase):
+    def test_hash(self):
+        hasher = PasswordHasher(n=2 ** 10)
+        hashed = hasher.hash("salt", "password")
+        self.assertTrue(hashed.startswith("scrypt$n=1024,p=1,r=8$"))
+        self.assertTrue(PasswordHasher.is_hash(hashed))
+        self.assertTrue(hasher.verify("salt", "password", hashed))
+        self.assertFalse(hasher.verify("salt", "wrong_password", hashed))
+        self.assertFalse(hasher.verify("other_salt", "password", hashed))
+        self.assertFalse(hasher.needs_update(hashed))
+
+    def test_parameters(self):
+        hasher = PasswordHasher.from_string("pbkdf2_sha256?iterations=1000&workers=1")
+        hashed = hasher.hash("salt", "password")
+        self.assertEqual(hasher.prefix, "pbkdf2_sha256$iterations=1000$")
+
+        # hashes keep verifying with the parameters they were made with
+        newer = PasswordHasher.from_string("scrypt?n=1024")
+        self.assertTrue(newer.verify("salt", "password", hashed))
+        self.assertTrue(newer.needs_update(hashed))
+        self.assertTrue(newer.needs_update("legacy"))
+        self.assertFalse(PasswordHasher.is_hash("legacy"))
+
+        self.assertRaises(ValueError, lambda: PasswordHasher.from_string("md5"))
+
+    def test_busy(self):
+        hasher = PasswordHasher(n=2 ** 10, max_pending=1)
+        started, release = threading.Event(), threading.Event()
+
+        def slow(*args):
+            started.set()
+            release.wait()
+
+        thread = threading.Thread(target=hasher._run, args=(slow,))
+        thread.start()
+        started.wait()
+        self.assertRaises(HashingBusy, lambda: hasher.hash("salt", "password"))
+        release.set()
+        thread.join()
+        self.assertTrue(hasher.hash("salt", "password"))
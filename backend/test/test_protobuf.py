@@ -0,0 +1,122 @@
+import datetime
+
+from unittest import mock
+
+from backend import movie as movie_model
+from backend import test
+from backend.api import movie
+from backend.test.test_protojson import Color, Everything, Node, everything
+from backend.wsgi import remote
+from backend.wsgi.protorpc import message_types, messages, protobuf
+
+
+class Numbers(messages.Message):
+    int64 = messages.IntegerField(1)
+    int32 = messages.IntegerField(2, variant=messages.Variant.INT32)
+    uint64 = messages.IntegerField(3, variant=messages.Variant.UINT64)
+    sint32 = messages.IntegerField(4, variant=messages.Variant.SINT32)
+    sint64 = messages.IntegerField(5, variant=messages.Variant.SINT64)
+    float32 = messages.FloatField(6, variant=messages.Variant.FLOAT)
+    data = messages.BytesField(7)
+    values = messages.IntegerField(8, repeated=True)
+
+
+class TestProtobuf(test.TestCase):
+    def test_encode(self):
+        # examples from the protocol buffers encoding documentation
+        self.assertEqual(protobuf.encode_message(Numbers(int64=150)), b"\x08\x96\x01")
+        self.assertEqual(protobuf.encode_message(Everything(string="testing")), b"\x22\x07testing")
+        self.assertEqual(protobuf.encode_message(Numbers(sint32=-1, sint64=1)), b"\x20\x01\x28\x02")
+        self.assertEqual(protobuf.encode_message(Numbers(int32=-1)), b"\x10" + b"\xff" * 9 + b"\x01")
+        self.assertEqual(protobuf.encode_message(Numbers(values=[1, 2])), b"\x40\x01\x40\x02")
+        self.assertEqual(protobuf.encode_message(Everything(flag=True, color=Color.GREEN)), b"\x18\x01\x30\x02")
+        self.assertEqual(protobuf.encode_message(Everything()), b"")
+
+        self.assertRaises(messages.ValidationError, lambda: protobuf.encode_message(Node()))
+        self.assertRaises(messages.EncodeError, lambda: protobuf.encode_message(Numbers(uint64=2 ** 64)))
+
+    def test_round_trip(self):
+        messages_ = [
+            everything(),
+            Everything(created=datetime.datetime(2020, 1, 2, 3, 4, 5, 123000), strings=["", "ünïcode"]),
+            Numbers(int64=-2 ** 63, int32=-5, uint64=2 ** 64 - 1, sint32=-300, sint64=2 ** 63 - 1,
+                    float32=0.5, data=b"\x00\xff", values=[0, -1, 2 ** 40]),
+        ]
+        for message in messages_:
+            with self.subTest(message=message):
+                self.assertEqual(protobuf.decode_message(type(message), protobuf.encode_message(message)), message)
+
+    def test_decode(self):
+        self.assertEqual(protobuf.decode_message(Numbers, b""), Numbers())
+        self.assertEqual(protobuf.decode_message(Numbers, b"\x08\x96\x01"), Numbers(int64=150))
+        # packed repeated fields
+        self.assertEqual(protobuf.decode_message(Numbers, b"\x42\x03\x01\x96\x01\x40\x02"), Numbers(values=[1, 150, 2]))
+        # the last value of a field that isn't repeated wins
+        self.assertEqual(protobuf.decode_message(Numbers, b"\x08\x01\x08\x02"), Numbers(int64=2))
+
+    def test_decode_unrecognized_fields(self):
+        encoded = protobuf.encode_message(Numbers(int64=-1, float32=1.5, data=b"data", values=[1, 2]))
+        message = protobuf.decode_message(message_types.VoidMessage, encoded)
+
+        self.assertEqual(message.get_unrecognized_field_info(1), (-1, messages.Variant.INT64))
+        self.assertEqual(message.get_unrecognized_field_info(6), (1.5, messages.Variant.FLOAT))
+        self.assertEqual(message.get_unrecognized_field_info(7), (b"data", messages.Variant.BYTES))
+        self.assertEqual(message.get_unrecognized_field_info(8), ([1, 2], messages.Variant.INT64))
+        self.assertEqual(protobuf.decode_message(Numbers, protobuf.encode_message(message)),
+                         Numbers(int64=-1, float32=1.5, data=b"data", values=[1, 2]))
+
+    def test_decode_errors(self):
+        for encoded in [b"\x08", b"\x22\x05abc", b"\x0b", b"\x22\x01\xff", b"\x30\x07", b"\x08" + b"\xff" * 10]:
+            with self.subTest(encoded=encoded):
+                self.assertRaises(messages.DecodeError, lambda: protobuf.decode_message(Everything, encoded))
+        # nested message running past the end of its length
+        self.assertRaises(messages.DecodeError, lambda: protobuf.decode_message(Everything, b"\x4a\x02\x0a\x05hello"))
+        # datetime message missing its required fields
+        self.assertRaises(messages.DecodeError, lambda: protobuf.decode_message(Everything, b"\x42\x00"))
+        # required field missing
+        self.assertRaises(messages.ValidationError, lambda: protobuf.decode_message(Node, b""))
+
+    def test_compiled_published_complete(self):
+        # other threads only find an encoder or decoder once all its fields are compiled
+        class Leaf(messages.Message):
+            name = messages.StringField(1)
+
+        class Tree(messages.Message):
+            leaves = messages.MessageField(Leaf, 1, repeated=True)
+
+        field_reader, field_writer = protobuf._field_reader, protobuf._field_writer
+
+        def reader(field, compiling):
+            self.assertNotIn(Tree, protobuf._decoders)
+            return field_reader(field, compiling)
+
+        def writer(field, compiling):
+            self.assertNotIn(Tree, protobuf._encoders)
+            return field_writer(field, compiling)
+
+        tree = Tree(leaves=[Leaf(name="leaf")])
+        with mock.patch.object(protobuf, "_field_reader", reader), mock.patch.object(protobuf, "_field_writer", writer):
+            self.assertEqual(protobuf.decode_message(Tree, protobuf.encode_message(tree)), tree)
+        self.assertIn(Leaf, protobuf._encoders)
+        self.assertIn(Leaf, protobuf._decoders)
+
+    def test_protocol(self):
+        protocol = remote.Protocols.get_default().lookup_by_content_type("application/x-protobuf")
+        self.assertEqual(protocol.name, "protobuf")
+
+    def test_api(self):
+        for i in range(3):
+            movie_model.Movie.create(title="test%s" % i, imdb_id="tt000000%s" % i)
+
+        headers = {"Content-Type": "application/x-protobuf"}
+        resp = self.api_client.post("movie.list", protobuf.encode_message(movie.ListRequest(limit=2)), headers=headers)
+        self.assertEqual(self.api_client.status, "200 OK")
+        self.assertEqual(self.api_client.headers["content-type"], "application/x-protobuf")
+
+        resp = protobuf.decode_message(movie.ListResponse, resp)
+        self.assertEqual([m.title for m in resp.movies], ["test0", "test1"])
+        self.assertEqual(self.api_client.post("movie.list", dict(limit=2))["movies"][1]["imdb_id"], resp.movies[1].imdb_id)
+
+        resp = self.api_client.post("movie.get", protobuf.encode_message(movie.GetRequest()), headers=headers)
+        self.assertEqual(self.api_client.status[:3], "400")
+        self.assertEqual(protobuf.decode_message(remote.RpcStatus, resp).state, remote.RpcState.APPLICATION_ERROR)
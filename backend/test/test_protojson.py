@@ -0,0 +1,221 @@
+import datetime
+import json
+import unittest
+
+from unittest import mock
+
+from backend.api import movie
+from backend.wsgi.protorpc import message_types, messages, protojson
+
+
+class Color(messages.Enum):
+    RED = 1
+    GREEN = 2
+
+
+class Node(messages.Message):
+    name = messages.StringField(1, required=True)
+    children = messages.MessageField("Node", 2, repeated=True)
+
+
+class Everything(messages.Message):
+    integer = messages.IntegerField(1)
+    number = messages.FloatField(2)
+    flag = messages.BooleanField(3)
+    string = messages.StringField(4)
+    strings = messages.StringField(5, repeated=True)
+    color = messages.EnumField(Color, 6)
+    colors = messages.EnumField(Color, 7, repeated=True)
+    created = message_types.DateTimeField(8)
+    node = messages.MessageField(Node, 9)
+    nodes = messages.MessageField(Node, 10, repeated=True)
+    empty = messages.StringField(11, repeated=True)
+
+
+class UpperProtoJson(protojson.ProtoJson):
+    def encode_field(self, field, value):
+        if isinstance(field, messages.StringField) and not field.repeated:
+            return value.upper()
+        return super(UpperProtoJson, self).encode_field(field, value)
+
+
+def everything():
+    return Everything(
+        integer=0,
+        number=1.5,
+        flag=False,
+        string="string",
+        strings=["a", "b"],
+        color=Color.RED,
+        colors=[Color.GREEN, Color.RED],
+        created=datetime.datetime(2020, 1, 2, 3, 4, 5),
+        node=Node(name="root", children=[Node(name="child", children=[Node(name="grandchild")])]),
+        nodes=[Node(name="first"), Node(name="second")],
+    )
+
+
+class TestProtoJsonEncode(unittest.TestCase):
+    def assertEncodesLikeEncoder(self, message, protocol=None):
+        protocol = protocol or protojson.ProtoJson()
+        expected = json.dumps(message, cls=protojson.MessageJSONEncoder, protojson_protocol=protocol)
+        self.assertEqual(json.loads(protocol.encode_message(message)), json.loads(expected))
+
+    def test_encode(self):
+        self.assertEncodesLikeEncoder(everything())
+        self.assertEncodesLikeEncoder(Everything())
+        self.assertEncodesLikeEncoder(Node(name="leaf"))
+        self.assertEqual(protojson.ProtoJson().encode_object(Everything(integer=0, empty=[])), dict(integer=0))
+
+    def test_encoders_published_complete(self):
+        # other threads only find an encoder once all its fields are compiled
+        protocol = protojson.ProtoJson()
+        field_encoder = protojson.ProtoJson._ProtoJson__field_encoder
+
+        def compile_field(self_, field, compiling):
+            self.assertNotIn(Everything, getattr(protocol, "_ProtoJson__encoders", {}))
+            return field_encoder(self_, field, compiling)
+
+        with mock.patch.object(protojson.ProtoJson, "_ProtoJson__field_encoder", compile_field):
+            self.assertEncodesLikeEncoder(everything(), protocol)
+        self.assertIn(Node, protocol._ProtoJson__encoders)
+
+    def test_encode_api_messages(self):
+        self.assertEncodesLikeEncoder(movie.ListResponse(
+            movies=[movie.ListResult(id=str(i), title="title %s" % i, imdb_id="tt%07d" % i) for i in range(100)],
+            next_cursor="cursor",
+        ))
+        self.assertEncodesLikeEncoder(movie.GetResponse(
+            id="id", title="title", ratings=[movie.RatingResult(source="source", value="9/10")], created="now",
+        ))
+
+    def test_encode_unrecognized_fields(self):
+        message = protojson.ProtoJson().decode_message(Node, '{"name": "root", "extra": [1, 2]}')
+        self.assertEqual(protojson.ProtoJson().encode_object(message), dict(name="root", extra=[1, 2]))
+
+    def test_encode_bytes(self):
+        class Blob(messages.Message):
+            data = messages.BytesField(1)
+            chunks = messages.BytesField(2, repeated=True)
+
+        message = Blob(data=b"\x00data", chunks=[b"a", b"b"])
+        encoded = protojson.ProtoJson().encode_message(message)
+        self.assertEqual(json.loads(encoded), dict(data="AGRhdGE=", chunks=["YQ==", "Yg=="]))
+        self.assertEqual(protojson.ProtoJson().decode_message(Blob, encoded), message)
+
+    def test_encode_custom_encode_field(self):
+        protocol = UpperProtoJson()
+        self.assertEncodesLikeEncoder(everything(), protocol)
+        self.assertEqual(protocol.encode_object(Node(name="leaf")), dict(name="LEAF"))
+
+    def test_encode_uninitialized(self):
+        self.assertRaises(messages.ValidationError, lambda: protojson.ProtoJson().encode_message(Node()))
+
+
+class LowerProtoJson(protojson.ProtoJson):
+    def decode_field(self, field, value):
+        if isinstance(field, messages.StringField):
+            return value.lower()
+        return super(LowerProtoJson, self).decode_field(field, value)
+
+
+class TestProtoJsonDecode(unittest.TestCase):
+    def decode(self, message_type, value, protocol=None):
+        return (protocol or protojson.ProtoJson()).decode_message(message_type, json.dumps(value))
+
+    def test_decode(self):
+        message = everything()
+        protocol = protojson.ProtoJson()
+        self.assertEqual(protocol.decode_message(Everything, protocol.encode_message(message)), message)
+        self.assertEqual(self.decode(Everything, {}), Everything())
+        self.assertEqual(protocol.decode_message(Everything, "  "), Everything())
+
+    def test_decoders_published_complete(self):
+        # other threads only find a decoder once all its fields are compiled
+        protocol = protojson.ProtoJson()
+        field_decoder = protojson.ProtoJson._ProtoJson__field_decoder
+
+        def compile_field(self_, field, compiling):
+            self.assertNotIn(Everything, getattr(protocol, "_ProtoJson__decoders", {}))
+            return field_decoder(self_, field, compiling)
+
+        with mock.patch.object(protojson.ProtoJson, "_ProtoJson__field_decoder", compile_field):
+            self.assertEqual(protocol.decode_message(Everything, protocol.encode_message(everything())), everything())
+        self.assertIn(Node, protocol._ProtoJson__decoders)
+
+    def test_decode_conversions(self):
+        message = self.decode(Everything, dict(integer="12", number=3, strings="single", color="GREEN", colors=[2]))
+        self.assertEqual(message.integer, 12)
+        self.assertEqual(message.number, 3.0)
+        self.assertIsInstance(message.number, float)
+        self.assertEqual(message.strings, ["single"])
+        self.assertEqual(message.color, Color.GREEN)
+        self.assertEqual(message.colors, [Color.GREEN])
+
+        # the last value of a list is used for fields that aren't repeated
+        self.assertEqual(self.decode(Everything, dict(string=["a", "b"])).string, "b")
+        self.assertEqual(self.decode(Everything, dict(string=[])).string, None)
+        self.assertEqual(self.decode(Everything, dict(string=None, strings=None)), Everything())
+
+    def test_decode_errors(self):
+        self.assertRaises(messages.ValidationError, lambda: self.decode(Everything, dict(integer="twelve")))
+        self.assertRaises(messages.ValidationError, lambda: self.decode(Everything, dict(strings=[1])))
+        self.assertRaises(messages.ValidationError, lambda: self.decode(Everything, dict(flag="true")))
+        self.assertRaises(messages.DecodeError, lambda: self.decode(Everything, dict(created="yesterday")))
+        self.assertRaises(messages.ValidationError, lambda: self.decode(Node, dict(children=[dict(name="child")])))
+        self.assertRaises(messages.ValidationError, lambda: self.decode(movie.ListRequest, dict(limit=1.5)))
+
+    def test_decode_unrecognized_fields(self):
+        message = self.decode(Node, {"name": "root", "extra": [1, 2.5], "7": "seven", "object": {}})
+        self.assertEqual(message.get_unrecognized_field_info("extra"), ([1, 2.5], messages.Variant.DOUBLE))
+        self.assertEqual(message.get_unrecognized_field_info(7), ("seven", messages.Variant.STRING))
+        self.assertEqual(message.all_unrecognized_fields(), ["extra", 7])
+
+    def test_decode_custom_decode_field(self):
+        message = self.decode(Node, dict(name="ROOT", children=[dict(name="CHILD")]), LowerProtoJson())
+        self.assertEqual(message, Node(name="root", children=[Node(name="child")]))
+
+
+def json_backends():
+    for name, _ in protojson.JSON_BACKENDS:
+        try:
+            yield protojson.load_json_backend(name)
+        except ImportError:
+            pass
+
+
+class TestJsonBackend(unittest.TestCase):
+    def tearDown(self):
+        protojson.set_json_backend(None)
+
+    def test_backends(self):
+        value = {"name": "Amélie", "path": "a/b", "number": 1.5, "list": [1, None, True], "big": 2 ** 70, 7: "seven"}
+        expected = dict(value, **{"7": "seven"})
+        del expected[7]
+
+        for backend in json_backends():
+            with self.subTest(backend=backend.name):
+                encoded = backend.dumps(value)
+                self.assertIsInstance(encoded, bytes)
+                self.assertEqual(json.loads(encoded), expected)
+                self.assertEqual(backend.loads(encoded), expected)
+                self.assertEqual(backend.loads(encoded.decode("utf-8")), expected)
+                self.assertRaises(ValueError, lambda: backend.loads(b"{invalid"))
+
+    def test_protocol_backends(self):
+        message = everything()
+        for backend in json_backends():
+            with self.subTest(backend=backend.name):
+                protocol = protojson.ProtoJson(json_backend=backend)
+                encoded = protocol.encode_message(message)
+                self.assertIsInstance(encoded, bytes)
+                self.assertEqual(protocol.decode_message(Everything, encoded), message)
+
+    def test_load_json_backend(self):
+        self.assertEqual(protojson.load_json_backend("json").name, "json")
+        self.assertIn(protojson.load_json_backend().name, dict(protojson.JSON_BACKENDS))
+        self.assertRaises(ValueError, lambda: protojson.load_json_backend("yaml"))
+
+    def test_set_json_backend(self):
+        backend = protojson.set_json_backend("json")
+        self.assertIs(protojson.get_json_backend(), backend)
+        self.assertEqual(protojson.ProtoJson().encode_message(Node(name="root")), b'{"name":"root"}')
@@ -0,0 +1,122 @@
+import unittest
+
+from backend import movie as movie_model
+from backend import test
+from backend.test.test_protojson import Everything, Node, everything
+from backend.wsgi import remote
+from backend.wsgi.protorpc import messages, protojson, protomsgpack
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+VALUES = [
+    None, True, False, 0, 127, 128, 255, 256, 2 ** 16, 2 ** 32, 2 ** 64 - 1, -1, -32, -33, -128, -129,
+    -2 ** 15 - 1, -2 ** 31 - 1, -2 ** 63, 1.5, "", "a" * 31, "a" * 32, "ünïcode" * 100, "a" * 70000,
+    b"", b"\x00" * 300, [], [1] * 15, [1] * 16, [None] * 70000, {}, {str(i): i for i in range(16)},
+    {"a": {"b": [1, {"c": None}]}, 7: "seven"},
+]
+
+
+class TestPacker(unittest.TestCase):
+    def test_pack(self):
+        # examples from the MessagePack specification
+        self.assertEqual(protomsgpack.packb({"compact": True, "schema": 0}), b"\x82\xa7compact\xc3\xa6schema\x00")
+        self.assertEqual(protomsgpack.packb(-33), b"\xd0\xdf")
+        self.assertEqual(protomsgpack.packb(2 ** 64 - 1), b"\xcf" + b"\xff" * 8)
+        self.assertEqual(protomsgpack.packb("a" * 32)[:2], b"\xd9\x20")
+        self.assertEqual(protomsgpack.packb([1] * 16)[:3], b"\xdc\x00\x10")
+        self.assertEqual(protomsgpack.packb(b"data"), b"\xc4\x04data")
+
+        self.assertRaises(OverflowError, lambda: protomsgpack.packb(2 ** 64))
+        self.assertRaises(TypeError, lambda: protomsgpack.packb(object()))
+
+    def test_round_trip(self):
+        for value in VALUES:
+            with self.subTest(value=repr(value)[:20]):
+                self.assertEqual(protomsgpack.unpackb(protomsgpack.packb(value)), value)
+
+    def test_bin_and_str(self):
+        self.assertEqual(protomsgpack.packb("data"), b"\xa4data")
+        self.assertEqual(protomsgpack.packb(b"data"), b"\xc4\x04data")
+        self.assertEqual(protomsgpack.unpackb(b"\xa4data"), "data")
+        self.assertEqual(protomsgpack.unpackb(b"\xc4\x04data"), b"data")
+        self.assertEqual(protomsgpack.unpackb(b"\xc4\x00"), b"")
+        # str must be UTF-8, bin may hold any bytes
+        self.assertRaises(ValueError, lambda: protomsgpack.unpackb(b"\xa2\xff\xfe"))
+        self.assertEqual(protomsgpack.unpackb(b"\xc4\x02\xff\xfe"), b"\xff\xfe")
+
+    def test_truncated(self):
+        for value in VALUES:
+            data = protomsgpack.packb(value)
+            with self.subTest(value=repr(value)[:20]):
+                self.assertRaises(ValueError, lambda: protomsgpack.unpackb(data[:-1]))
+
+    def test_extra_data(self):
+        for value in VALUES:
+            data = protomsgpack.packb(value)
+            with self.subTest(value=repr(value)[:20]):
+                self.assertRaises(ValueError, lambda: protomsgpack.unpackb(data + b"\xc0"))
+
+    def test_unpack_errors(self):
+        for data in [b"\xc1", b"\x81\x90\x01"]:
+            with self.subTest(data=data):
+                self.assertRaises(ValueError, lambda: protomsgpack.unpackb(data))
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        for value in VALUES:
+            with self.subTest(value=repr(value)[:20]):
+                data = msgpack.packb(value, use_bin_type=True)
+                self.assertEqual(protomsgpack.packb(value), data)
+                self.assertEqual(protomsgpack.unpackb(data), msgpack.unpackb(data, raw=False, strict_map_key=False))
+
+
+class TestProtoMsgpack(test.TestCase):
+    def protocols(self):
+        return [protomsgpack.ProtoMsgpack(pure_python=True), protomsgpack.ProtoMsgpack()]
+
+    def test_encode(self):
+        message = everything()
+        for protocol in self.protocols():
+            with self.subTest(packer=protocol.packer):
+                encoded = protocol.encode_message(message)
+                self.assertEqual(protomsgpack.unpackb(encoded), protojson.ProtoJson().encode_object(message))
+                self.assertEqual(protocol.decode_message(Everything, encoded), message)
+                self.assertEqual(protocol.decode_message(Everything, b""), Everything())
+
+                self.assertRaises(messages.ValidationError, lambda: protocol.encode_message(Node()))
+                self.assertRaises(messages.EncodeError, lambda: protocol.encode_message(Everything(integer=2 ** 64)))
+
+    def test_decode_errors(self):
+        for protocol in self.protocols():
+            with self.subTest(packer=protocol.packer):
+                # truncated, extra data and not a map
+                self.assertRaises(messages.DecodeError, lambda: protocol.decode_message(Everything, b"\x81\xa1a"))
+                self.assertRaises(messages.DecodeError, lambda: protocol.decode_message(Everything, b"\x80\xc0"))
+                self.assertRaises(messages.DecodeError, lambda: protocol.decode_message(Everything, b"\x91\x01"))
+                self.assertRaises(messages.ValidationError, lambda: protocol.decode_message(Node, b"\x80"))
+                self.assertRaises(
+                    messages.ValidationError,
+                    lambda: protocol.decode_message(Everything, protomsgpack.packb(dict(integer="twelve")))
+                )
+
+    def test_protocol(self):
+        protocol = remote.Protocols.get_default().lookup_by_content_type("application/msgpack")
+        self.assertEqual(protocol.name, "protomsgpack")
+
+    def test_api(self):
+        for i in range(3):
+            movie_model.Movie.create(title="test%s" % i, imdb_id="tt000000%s" % i)
+
+        headers = {"Content-Type": "application/msgpack"}
+        resp = self.api_client.post("movie.list", protomsgpack.packb(dict(limit=2)), headers=headers)
+        self.assertEqual(self.api_client.status, "200 OK")
+        self.assertEqual(self.api_client.headers["content-type"], "application/msgpack")
+        self.assertEqual(protomsgpack.unpackb(resp)["movies"], self.api_client.post("movie.list", dict(limit=2))["movies"])
+
+        resp = self.api_client.post("movie.get", protomsgpack.packb(dict()), headers=headers)
+        self.assertEqual(self.api_client.status[:3], "400")
+        self.assertEqual(protomsgpack.unpackb(resp)["state"], "APPLICATION_ERROR")
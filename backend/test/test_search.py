@@ -0,0 +1,55 @@
+from backend import test
+from backend.search import TitleIndex, tokenize
+
+
+class TestTitleIndex(test.TestCase):
+    def setUp(self):
+        super(TestTitleIndex, self).setUp()
+        self.index = TitleIndex()
+        self.index.add("1", "The Lord of the Rings", "tt1")
+        self.index.add("2", "Lord of War", "tt2")
+        self.index.add("3", "Amélie", "tt3")
+        self.index.add("4", "The Lord of the Rings: The Two Towers", "tt4")
+
+    def ids(self, query, limit=10):
+        return [id for id, title, data in self.index.search(query, limit=limit)]
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize("The Lord of the Rings: Amélie's"), ["the", "lord", "of", "the", "rings", "amelie", "s"])
+        self.assertEqual(tokenize(None), [])
+
+    def test_search(self):
+        self.assertEqual(self.index.search("amelie"), [("3", "Amélie", "tt3")])
+        self.assertEqual(self.ids("lord"), ["2", "1", "4"])
+        self.assertEqual(self.ids("lord of the rings"), ["1", "4"])
+        self.assertEqual(self.ids("LORD", limit=1), ["2"])
+        self.assertEqual(self.ids("rings war"), [])
+        self.assertEqual(self.ids("!"), [])
+
+    def test_prefix(self):
+        self.assertEqual(self.ids("lo"), ["2", "1", "4"])
+        self.assertEqual(self.ids("the ri"), ["1", "4"])
+        self.assertEqual(self.ids("tow"), ["4"])
+        # exact words rank above completions
+        self.index.add("5", "Lordy", "tt5")
+        self.assertEqual(self.ids("lord"), ["2", "1", "4", "5"])
+
+    def test_remove(self):
+        self.index.remove("2")
+        self.index.remove("2")
+        self.assertEqual(self.ids("war"), [])
+        self.assertEqual(self.ids("lord"), ["1", "4"])
+
+        self.index.remove("4")
+        self.assertEqual(self.ids("two"), [])
+        self.assertEqual(self.index._complete("t"), ["the"])
+
+        self.index.add("1", "Rings", "tt1")
+        self.assertEqual(self.ids("lord"), [])
+        self.assertEqual(len(self.index), 2)
+
+    def test_rebuild(self):
+        self.index.rebuild([("5", "Heat", "tt5")], version=3)
+        self.assertEqual(self.ids("lord"), [])
+        self.assertEqual(self.ids("heat"), ["5"])
+        self.assertEqual(self.index.version, 3)
@@ -1,19 +1,85 @@
+import json
+import os
+import tempfile
+import time
+
 from backend import movie, test
-from backend.setup import Seed
+from backend.lock import Lock
+from backend.setup import Seed, seed, setup
+from backend.setup.seed import RateLimiter
 
 
 class TestSeed(test.TestCase):
-    def test_movies(self):
-        seed = Seed()
+    def test_get_movies(self):
+        seed = Seed(concurrency=4)
+        imdb_ids = ["tt10515852", "tt10515001", "tt0000000", "tt2407380", "tt10515002"]
+
+        movies = seed.get_movies(imdb_ids)
+        self.assertEqual([m["imdb_id"] for m in movies], ["tt10515852", "tt10515001", "tt2407380", "tt10515002"])
+        self.assertEqual(list(seed.failures.keys()), ["tt0000000"])
+
+
+class TestRateLimiter(test.TestCase):
+    def test_wait(self):
+        rate_limiter = RateLimiter(rate=50)
+        start = time.monotonic()
+        for _ in range(6):
+            rate_limiter.wait()
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+
+        rate_limiter = RateLimiter()
+        start = time.monotonic()
+        for _ in range(100):
+            rate_limiter.wait()
+        self.assertLess(time.monotonic() - start, 0.1)
+
+
+class TestSeedSnapshot(test.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "snapshot.jsonl")
+
+    def tearDown(self):
+        self.directory.cleanup()
+        super().tearDown()
+
+    def test_snapshot(self):
+        header = Seed().snapshot(self.path)
+        self.assertEqual(header["version"], seed.SNAPSHOT_VERSION)
+        self.assertEqual(header["count"], 100)
+        self.assertEqual(movie.Movie.query().count(), 0)
+
+        self.assertEqual(Seed().load(self.path, chunk_size=30), True)
+        self.assertEqual(movie.Movie.query().count(), 100)
+
+        # loaded once
+        movie.Movie.query().fetch(1)[0].key.delete()
+        self.assertEqual(Seed().load(self.path), False)
+        self.assertEqual(movie.Movie.query().count(), 99)
+
+        self.assertEqual(Seed().snapshot(self.path)["id"], header["id"])
+
+    def test_load_locked(self):
+        Seed().snapshot(self.path)
+        with Lock.hold("seed"):
+            self.assertEqual(Seed().load(self.path), False)
+        self.assertEqual(movie.Movie.query().count(), 0)
 
-        obj = movie.Movie.create(title="test", imdb_id="tt1234567")
-        self.assertEqual(movie.Movie.query().count(), 1)
+    def test_load_invalid(self):
+        with open(self.path, "w") as f:
+            f.write(json.dumps(dict(version=0)) + "\n")
+        self.assertRaises(seed.SnapshotInvalid, lambda: Seed().load(self.path))
 
-        seed.movies()
-        self.assertEqual(movie.Movie.query().count(), 1)
+    def test_setup(self):
+        Seed().snapshot(self.path)
 
-        obj.key.delete()
+        setup()
         self.assertEqual(movie.Movie.query().count(), 0)
 
-        seed.movies()
+        os.environ["SEED_SNAPSHOT"] = self.path
+        try:
+            setup()
+        finally:
+            del os.environ["SEED_SNAPSHOT"]
         self.assertEqual(movie.Movie.query().count(), 100)
@@ -1,3 +1,7 @@
+from unittest import mock
+
+from google.cloud import ndb
+
 from backend import test, user
 
 
@@ -28,6 +32,50 @@ class TestUser(test.TestCase):
         user.User.create("test@gmail.com", "test", name="test")
         self.assertEqual(1, len(user.User.search("test", offset=0)))
 
+    def test_search_words(self):
+        john = user.User.create("john@gmail.com", "test", name="John Smith")
+        jane = user.User.create("jane@gmail.com", "test", name="Jane Smithson")
+        bob = user.User.create("bob@gmail.com", "test", name="Bob Jones")
+
+        # in name order
+        self.assertEqual(user.User.search("smi"), [jane, john])
+        self.assertEqual(user.User.search("Smith J"), [jane, john])
+        self.assertEqual(user.User.search("smithson"), [jane])
+        self.assertEqual(user.User.search("jo smi"), [john])
+        self.assertEqual(user.User.search("mith"), [])
+        self.assertEqual(user.User.search("jo"), [bob, jane, john])
+
+    def test_search_page(self):
+        users = [user.User.create("test%s@gmail.com" % i, "test", name="Test %s" % i) for i in reversed(range(5))]
+        users.reverse()
+
+        page, cursor = user.User.search_page("test", limit=2)
+        self.assertEqual(page, users[:2])
+        page, cursor = user.User.search_page("test", cursor=cursor, limit=2)
+        self.assertEqual(page, users[2:4])
+        page, cursor = user.User.search_page("test", cursor=cursor, limit=2)
+        self.assertEqual((page, cursor), (users[4:], None))
+        self.assertRaises(user.CursorInvalid, lambda: user.User.search_page("test", cursor="invalid_cursor"))
+        self.assertRaises(user.CursorInvalid, lambda: user.User.search_page("test", cursor="bm90IGEgY3Vyc29y"))
+
+    def test_reindex(self):
+        class LegacyUser(ndb.Model):
+            # a user written before name_prefixes existed
+            name = ndb.StringProperty(indexed=True)
+
+            @classmethod
+            def _get_kind(cls):
+                return "User"
+
+        LegacyUser(name="John Smith").put()
+        LegacyUser(name="Jane Smith").put()
+        ndb.Model._kind_map["User"] = user.User
+        ndb.get_context().clear_cache()
+        self.assertEqual(user.User.search("smith"), [])
+
+        self.assertEqual(user.User.reindex(batch_size=1), 2)
+        self.assertEqual([u.name for u in user.User.search("smith")], ["Jane Smith", "John Smith"])
+
     def test_update_password(self):
         obj = user.User.create("test@gmail.com", "test")
         obj.update_password(current_password="test", password="test2")
@@ -38,6 +86,141 @@ class TestUser(test.TestCase):
         obj.update_email(current_password="test", email="test2@gmail.com")
         self.assertEqual(obj, user.User.login("test2@gmail.com", "test"))
 
+    def test_credentials_read_once(self):
+        obj = user.User.create("test@gmail.com", "test")
+        get_by_user = mock.patch.object(user.UserCredentials, "get_by_user", wraps=user.UserCredentials.get_by_user)
+
+        ndb.get_context().clear_cache()
+        with get_by_user as reads:
+            obj = user.User.get(obj.id)
+            self.assertEqual((obj.email, obj.email_verified), ("test@gmail.com", None))
+            self.assertEqual(reads.call_count, 1)
+
+        with get_by_user as reads:
+            obj = user.User.login("test@gmail.com", "test")
+            obj.update_email(current_password="test", email="test2@gmail.com")
+            self.assertEqual(obj.email, "test2@gmail.com")
+            self.assertEqual(reads.call_count, 0)
+
+    def test_email_index(self):
+        obj = user.User.create("Test@gmail.com", "test")
+        self.assertEqual(user.EmailIndex.get_user_key("test@gmail.com "), obj.key)
+        with mock.patch.object(user.UserCredentials, "get_by_email", side_effect=AssertionError):
+            self.assertEqual(user.User.get_by_email("test@GMAIL.com"), obj)
+        self.assertRaises(user.EmailTaken, lambda: user.User.create("test@gmail.com", "test"))
+        self.assertEqual(user.User.query().count(), 1)
+
+        # a claim in a concurrent request that passed the get_by_email check
+        self.assertRaises(user.EmailTaken, lambda: ndb.transaction(
+            lambda: user.EmailIndex.claim("test@gmail.com", ndb.Key(user.User, "other"))))
+
+        obj.update_email(current_password="test", email="test2@gmail.com")
+        self.assertEqual(user.User.get_by_email("test@gmail.com"), None)
+        self.assertEqual(user.User.get_by_email("test2@gmail.com"), obj)
+        self.assertEqual(user.User.create("test@gmail.com", "test").email, "test@gmail.com")
+
+    def test_email_index_legacy(self):
+        obj = user.User.create("test@gmail.com", "test")
+        ndb.Key(user.EmailIndex, "test@gmail.com").delete()
+        self.assertEqual(user.User.get_by_email("test@gmail.com"), obj)
+        self.assertRaises(user.EmailTaken, lambda: user.User.create("test@gmail.com", "test"))
+
+    def test_email_index_case(self):
+        obj = user.User.create("test@gmail.com", "test")
+        obj.update_email(current_password="test", email="Test@Gmail.com")
+        self.assertEqual(user.User.get(obj.id).email, "Test@Gmail.com")
+        self.assertEqual(user.EmailIndex.get_user_key("test@gmail.com"), obj.key)
+        self.assertEqual(user.User.login("test@gmail.com", "test"), obj)
+
+        other = user.User.create("other@gmail.com", "test")
+        self.assertRaises(user.EmailTaken, lambda: other.update_email(current_password="test", email="TEST@gmail.com"))
+
+        # claimed concurrently, after update_email's check
+        with mock.patch.object(user.User, "get_by_email", return_value=None):
+            self.assertRaises(user.EmailTaken, lambda: other.update_email(current_password="test", email="TEST@gmail.com"))
+        self.assertEqual((other.email, other.email_verified), ("other@gmail.com", None))
+        other.credentials.put()
+        self.assertEqual(user.User.get_by_email("other@gmail.com"), other)
+
+    def test_reindex_credentials(self):
+        class LegacyUserCredentials(ndb.Model):
+            # credentials written before the email index and normalized_email
+            email = ndb.StringProperty(indexed=True)
+            password = ndb.StringProperty(indexed=True)
+            salt = ndb.StringProperty(indexed=True)
+
+            @classmethod
+            def _get_kind(cls):
+                return "UserCredentials"
+
+        users = [user.User.create("Test@gmail.com", "test"), user.User.create("other@gmail.com", "test")]
+        for obj, email in zip(users, ["Test@gmail.com", "test@GMAIL.com"]):
+            credentials = obj.credentials
+            ndb.Key(user.EmailIndex, user.EmailIndex.normalize(credentials.email)).delete()
+            LegacyUserCredentials(parent=obj.key, id=credentials.key.id(), email=email, password=credentials.password,
+                                  salt=credentials.salt).put()
+        ndb.Model._kind_map["UserCredentials"] = user.UserCredentials
+        ndb.get_context().clear_cache()
+        self.assertEqual(user.User.get_by_email("Test@gmail.com"), users[0])
+        self.assertEqual(user.User.get_by_email("test@gmail.com"), None)
+
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(user.UserCredentials.reindex(batch_size=1), 2)
+        self.assertEqual(user.EmailIndex.get_user_key("test@gmail.com"), users[0].key)
+        with mock.patch.object(user.EmailIndex, "get_user_key", return_value=None):
+            self.assertEqual(user.User.get_by_email("TEST@gmail.com"), users[0])
+
+    def test_password_upgrade(self):
+        obj = user.User.create("test@gmail.com", "test")
+        self.assertTrue(obj.credentials.password.startswith(user.hasher.prefix))
+
+        credentials = obj.credentials
+        credentials.password = user.UserCredentials._legacy_hash_password(credentials.salt, "test")
+        credentials.put()
+        self.assertTrue(credentials.needs_update)
+        self.assertRaises(user.CredentialsInvalid, lambda: user.User.login("test@gmail.com", "wrong_password"))
+        self.assertTrue(credentials.needs_update)
+
+        user.User.login("test@gmail.com", "test")
+        credentials = user.UserCredentials.get_by_user(obj)
+        self.assertFalse(credentials.needs_update)
+        self.assertEqual(obj, user.User.login("test@gmail.com", "test"))
+
+    def test_legacy_credentials(self):
+        obj = user.User.create("test@gmail.com", "test")
+        credentials = obj.credentials
+        legacy = user.UserCredentials(parent=obj.key, email=credentials.email, password=credentials.password,
+                                      salt=credentials.salt)
+        legacy.put()
+        credentials.key.delete()
+        ndb.get_context().clear_cache()
+
+        self.assertNotEqual(legacy.key.id(), user.UserCredentials.ID)
+        self.assertEqual(user.User.get(obj.id).credentials, legacy)
+        self.assertEqual(obj, user.User.login("test@gmail.com", "test"))
+
+    def test_migrate_keys(self):
+        users = [user.User.create("test%s@gmail.com" % i, "test") for i in range(3)]
+        for obj in users[:2]:
+            credentials = obj.credentials
+            for _ in range(2):
+                user.UserCredentials(parent=obj.key, email=credentials.email, password=credentials.password,
+                                     salt=credentials.salt).put()
+            credentials.key.delete()
+        # a legacy duplicate of credentials that already have the fixed id
+        user.UserCredentials(parent=users[2].key, email="old@gmail.com").put()
+
+        self.assertEqual(user.UserCredentials.migrate_keys(batch_size=2), (2, 3))
+        self.assertEqual(user.UserCredentials.query().count(), 3)
+        ndb.get_context().clear_cache()
+        with mock.patch.object(user.UserCredentials, "query", side_effect=AssertionError):
+            for i, obj in enumerate(users):
+                credentials = user.User.get(obj.id).credentials
+                self.assertEqual((credentials.key.id(), credentials.email), (user.UserCredentials.ID, "test%s@gmail.com" % i))
+        self.assertEqual(user.User.login("test0@gmail.com", "test"), users[0])
+
+        self.assertEqual(user.UserCredentials.migrate_keys(), (0, 0))
+
 
 class TestUserApi(test.TestCase):
 
@@ -88,6 +271,17 @@ class TestUserApi(test.TestCase):
         self.assertEqual(resp.get("error"), None)
         resp = self.api_client.post("user.search", dict(search="test"), headers=dict(authorization=access_token))
         self.assertEqual(len(resp.get("users")), 1)
+        self.assertEqual(resp.get("next_cursor"), None)
+
+        self.api_client.post("user.create", dict(email="test2@gmail.com", password="test", name="test two"))
+        resp = self.api_client.post("user.search", dict(search="test", limit=1), headers=dict(authorization=access_token))
+        self.assertEqual(len(resp.get("users")), 1)
+        resp = self.api_client.post("user.search", dict(search="test", cursor=resp.get("next_cursor")),
+                                    headers=dict(authorization=access_token))
+        self.assertEqual([u.get("name") for u in resp.get("users")], ["test two"])
+
+        resp = self.api_client.post("user.search", dict(search="test", limit=0), headers=dict(authorization=access_token))
+        self.assertEqual(resp.get("error").get("error_name"), "SearchRequestInvalid")
 
     def test_update_password(self):
         resp = self.api_client.post("user.create", dict(email="test@gmail.com", password="test"))
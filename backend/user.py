@@ -1,11 +1,22 @@
+import binascii
 import datetime
+import functools
 import hashlib
+import hmac
+import logging
+import os
 import random
 import re
 
+from google.api_core.exceptions import BadRequest
 from google.cloud import ndb
 
 from backend import error
+from backend.password import PasswordHasher
+
+logger = logging.getLogger()
+
+hasher = PasswordHasher.from_string(os.getenv("PASSWORD_KDF"))
 
 
 class EmailTaken(error.Error):
@@ -24,8 +35,56 @@ class NotFound(error.Error):
     pass
 
 
+class CursorInvalid(error.Error):
+    pass
+
+
+class EmailIndex(ndb.Model):
+    """
+    Points a normalized email to the user using it. Keyed by the email, so
+    looking a user up by email is a key get, and claiming an email in a
+    transaction makes sure no two users share it.
+    """
+    user_key = ndb.KeyProperty(indexed=False)
+
+    @classmethod
+    def normalize(cls, email):
+        return email.strip().lower()
+
+    @classmethod
+    def get_user_key(cls, email):
+        entity = cls.get_by_id(cls.normalize(email))
+        return entity.user_key if entity else None
+
+    @classmethod
+    def claim(cls, email, user_key):
+        """
+        Claims email for user_key, call in a transaction.
+        """
+        entity = cls.get_by_id(cls.normalize(email))
+        if entity is not None and entity.user_key != user_key:
+            raise EmailTaken("%s is already in use" % email)
+        cls(id=cls.normalize(email), user_key=user_key).put()
+
+    @classmethod
+    def release(cls, email, user_key):
+        """
+        Releases email if claimed by user_key, call in a transaction.
+        """
+        entity = cls.get_by_id(cls.normalize(email))
+        if entity is not None and entity.user_key == user_key:
+            entity.key.delete()
+
+
 class UserCredentials(ndb.Model):
+    """
+    Stored as a child of its user with a fixed id, so a user's credentials
+    are a key get away.
+    """
+    ID = "credentials"
+
     email = ndb.StringProperty(indexed=True)
+    normalized_email = ndb.ComputedProperty(lambda self: self.email and EmailIndex.normalize(self.email), indexed=True)
     email_verified = ndb.BooleanProperty(indexed=False)
     password = ndb.StringProperty(indexed=True)
     salt = ndb.StringProperty(indexed=True)
@@ -36,29 +95,106 @@ class UserCredentials(ndb.Model):
 
         entity = cls(
             parent=user.key,
+            id=cls.ID,
             email=email,
             password=cls._hash_password(salt, password),
             salt=salt
         )
-        entity.put()
+
+        def create():
+            if email is not None:
+                EmailIndex.claim(email, user.key)
+            entity.put()
+
+        ndb.transaction(create)
         return entity
 
     @classmethod
     def get_by_email(cls, email):
-        entities = cls.query(cls.email == email).fetch(1)
+        entities = cls.query(cls.normalized_email == EmailIndex.normalize(email)).fetch(1)
+        if not entities:
+            # credentials written before normalized_email, see reindex
+            entities = cls.query(cls.email == email).fetch(1)
         return entities[0] if entities else None
 
+    @classmethod
+    def migrate_keys(cls, batch_size=100):
+        """
+        Re-keys credentials stored with auto allocated ids to the fixed id.
+        When a user has more than one, the one get_by_user used is kept and
+        the others are removed, as are those of users that already have
+        credentials with the fixed id. Returns the number of migrated and
+        removed credentials.
+        """
+        migrated = 0
+        removed = 0
+        legacy_keys = [key for key in cls.query().fetch(keys_only=True) if key.id() != cls.ID]
+        for i in range(0, len(legacy_keys), batch_size):
+            entities = [entity for entity in ndb.get_multi(legacy_keys[i:i + batch_size]) if entity is not None]
+            existing = ndb.get_multi([ndb.Key(cls, cls.ID, parent=entity.key.parent()) for entity in entities])
+
+            migrations = {}
+            for entity, keyed in zip(entities, existing):
+                if keyed is None and entity.key.parent() not in migrations:
+                    migrations[entity.key.parent()] = cls(
+                        parent=entity.key.parent(),
+                        id=cls.ID,
+                        **{
+                            name: getattr(entity, name) for name, prop in cls._properties.items()
+                            if not isinstance(prop, ndb.ComputedProperty)
+                        }
+                    )
+
+            ndb.put_multi(list(migrations.values()))
+            ndb.delete_multi([entity.key for entity in entities])
+            migrated += len(migrations)
+            removed += len(entities) - len(migrations)
+        return migrated, removed
+
+    @classmethod
+    def reindex(cls, batch_size=100):
+        """
+        Rewrites all credentials so normalized_email is indexed, and claims
+        their emails in the email index, for credentials written before
+        either existed. Emails already claimed by another user are logged
+        and left to be resolved by hand. Returns the number of credentials.
+        """
+        count = 0
+        cursor = None
+        while True:
+            entities, cursor, more = cls.query().fetch_page(batch_size, start_cursor=cursor)
+            for entity in entities:
+                if entity.email is None:
+                    continue
+                try:
+                    ndb.transaction(functools.partial(EmailIndex.claim, entity.email, entity.key.parent()))
+                except EmailTaken:
+                    logger.warning("%s is used by more than one user, not indexed for %s", entity.email,
+                                   entity.key.parent().urlsafe().decode("utf-8"))
+            ndb.put_multi(entities)
+            count += len(entities)
+            if not more or cursor is None:
+                return count
+
     @classmethod
     def get_by_user(cls, user):
-        entities = cls.query(ancestor=user.key).fetch(1)
-        return entities[0] if entities else None
+        entity = ndb.Key(cls, cls.ID, parent=user.key).get()
+        if entity is None:
+            # credentials created before they had a fixed id, see migrate_keys
+            entities = cls.query(ancestor=user.key).fetch(1)
+            entity = entities[0] if entities else None
+        return entity
 
     @classmethod
     def _hash_password(cls, salt, password):
-        return hashlib.sha512(("%s%s" % (salt, (password or ""))).encode('utf8')).hexdigest()
+        return hasher.hash(salt, password)
 
     @classmethod
     def _legacy_hash_password(cls, salt, password):
+        return hashlib.sha512(("%s%s" % (salt, (password or ""))).encode('utf8')).hexdigest()
+
+    @classmethod
+    def _legacy_sha256_hash_password(cls, salt, password):
         return hashlib.sha256(("%s%s" % (salt, (password or ""))).encode('utf8')).hexdigest()
 
     @property
@@ -66,7 +202,14 @@ class UserCredentials(ndb.Model):
         return User.get(self.key.parent().urlsafe())
 
     def verify(self, password):
-        return self._hash_password(self.salt, password) == self.password or self._legacy_hash_password(self.salt, password) == self.password
+        if hasher.is_hash(self.password):
+            return hasher.verify(self.salt, password, self.password)
+        legacy = (self._legacy_hash_password, self._legacy_sha256_hash_password)
+        return any(hmac.compare_digest(hash_password(self.salt, password), self.password) for hash_password in legacy)
+
+    @property
+    def needs_update(self):
+        return hasher.needs_update(self.password)
 
     def update_password(self, password):
         self.salt = "%040x" % random.getrandbits(160)
@@ -74,9 +217,23 @@ class UserCredentials(ndb.Model):
         self.put()
 
     def update_email(self, email):
+        user_key = self.key.parent()
+        current_email, current_email_verified = self.email, self.email_verified
+
+        def update():
+            EmailIndex.claim(email, user_key)
+            if current_email is not None and EmailIndex.normalize(current_email) != EmailIndex.normalize(email):
+                EmailIndex.release(current_email, user_key)
+            self.put()
+
         self.email = email
         self.email_verified = False
-        self.put()
+        try:
+            ndb.transaction(update)
+        except BaseException:
+            # this instance is memoized by its user, don't leave the rejected email on it
+            self.email, self.email_verified = current_email, current_email_verified
+            raise
 
     def update(self, **kwargs):
         updates = [setattr(self, key, value) for key, value in kwargs.iteritems() if getattr(self, key) != value]
@@ -86,10 +243,21 @@ class UserCredentials(ndb.Model):
 
 
 class User(ndb.Model):
+    _credentials = None  # read once per instance, see credentials
+
+    NAME_PREFIX_LENGTH = 20
+
     created = ndb.DateTimeProperty(indexed=False)
     name = ndb.StringProperty(indexed=True)
     phone = ndb.StringProperty(indexed=True)
     normalized_name = ndb.ComputedProperty(lambda self: self.name and self.name.lower(), indexed=True)
+    # prefixes of every word in the name, searched by search_page
+    name_prefixes = ndb.ComputedProperty(lambda self: self.prefixes(self.name), indexed=True, repeated=True)
+
+    @classmethod
+    def prefixes(cls, name):
+        words = (name or "").lower().split()
+        return sorted(set(word[:i] for word in words for i in range(1, min(len(word), cls.NAME_PREFIX_LENGTH) + 1)))
 
     @classmethod
     def get(cls, id):
@@ -101,23 +269,81 @@ class User(ndb.Model):
 
     @classmethod
     def get_by_email(cls, email):
-        credentials = UserCredentials.get_by_email(email)
-        return credentials.user if credentials else None
+        user_key = EmailIndex.get_user_key(email)
+        if user_key is None:
+            # users created before the email index
+            credentials = UserCredentials.get_by_email(email)
+            if credentials is None:
+                return None
+            entity = credentials.user
+        else:
+            entity, credentials = ndb.get_multi([user_key, ndb.Key(UserCredentials, UserCredentials.ID, parent=user_key)])
+            if entity is None:
+                return None
+        entity._credentials = credentials
+        return entity
 
     @classmethod
     def login(cls, email, password):
         entity = cls.get_by_email(email)
 
         if entity and entity.credentials.verify(password):
+            if entity.credentials.needs_update:
+                # hashed with a legacy hash or older kdf parameters
+                entity.credentials.update_password(password)
             return entity
         raise CredentialsInvalid("No user found with given email and password")
 
     @classmethod
     def search(cls, search, offset=0, limit=25):
+        return cls.search_page(search, offset=offset, limit=limit)[0]
+
+    @classmethod
+    def search_page(cls, search, cursor=None, offset=0, limit=25):
+        """
+        Returns a page of users with a word in their name starting with each
+        word of search, in name order, together with a cursor for the next
+        page, or None when there are no more users. Searches shorter than
+        three characters match every user.
+        """
+        start_cursor = None
+        if cursor:
+            try:
+                start_cursor = ndb.Cursor(urlsafe=cursor)
+            except (binascii.Error, ValueError):
+                raise CursorInvalid("Cursor is invalid: %s" % cursor)
+
         query = cls.query()
         if search is not None and len(search) >= 3:
-            query = query.filter(cls.normalized_name >= search.lower(), cls.normalized_name < search.lower() + "\uFFFD")
-        return query.fetch(offset=offset, limit=limit)
+            for word in search.lower().split():
+                query = query.filter(cls.name_prefixes == word[:cls.NAME_PREFIX_LENGTH])
+        query = query.order(cls.normalized_name)
+        try:
+            entities, next_cursor, more = query.fetch_page(limit, start_cursor=start_cursor, offset=offset)
+        except (BadRequest, ValueError):
+            if start_cursor is None:
+                raise
+            # decodes fine, but isn't a cursor of this query or has expired
+            raise CursorInvalid("Cursor is invalid: %s" % cursor)
+
+        if not more or next_cursor is None:
+            return entities, None
+        return entities, next_cursor.urlsafe().decode("utf-8")
+
+    @classmethod
+    def reindex(cls, batch_size=100):
+        """
+        Rewrites every user so computed properties added since they were
+        written, like name_prefixes, are indexed. Returns the number of users.
+        """
+        count = 0
+        cursor = None
+        while True:
+            entities, cursor, more = cls.query().fetch_page(batch_size, start_cursor=cursor)
+            ndb.put_multi(entities)
+            count += len(entities)
+            if not more or cursor is None:
+                return count
 
     @classmethod
     def create(cls, email=None, password=None, name=None):
@@ -133,7 +359,11 @@ class User(ndb.Model):
         )
         entity.put()
 
-        UserCredentials.create(entity, email, password)
+        try:
+            entity._credentials = UserCredentials.create(entity, email, password)
+        except EmailTaken:
+            entity.key.delete()
+            raise
 
         return entity
 
@@ -157,7 +387,8 @@ class User(ndb.Model):
         if not self.is_valid_email(email):
             raise EmailInvalid("%s is not a valid email address" % email)
 
-        if self.get_by_email(email) is not None:
+        entity = self.get_by_email(email)
+        if entity is not None and entity.key != self.key:
             raise EmailTaken("%s is already in use" % email)
 
         if not self.credentials.verify(current_password):
@@ -167,15 +398,19 @@ class User(ndb.Model):
 
     @property
     def credentials(self):
-        return UserCredentials.get_by_user(self)
+        if self._credentials is None:
+            self._credentials = UserCredentials.get_by_user(self)
+        return self._credentials
 
     @property
     def email(self):
-        return self.credentials.email if self.credentials else None
+        credentials = self.credentials
+        return credentials.email if credentials else None
 
     @property
     def email_verified(self):
-        return self.credentials.email_verified if self.credentials else None
+        credentials = self.credentials
+        return credentials.email_verified if credentials else None
 
     @property
     def id(self):
@@ -1,10 +1,8 @@
-import json
-
-from .protorpc import remote, messages, message_types  # noqa F401
+from .protorpc import remote, messages, message_types, protojson  # noqa F401
 from .protorpc.wsgi import service
 
 from urllib import parse as urlparse
-from io import StringIO, BytesIO
+from io import BytesIO
 
 
 class Client:
@@ -12,8 +10,9 @@ class Client:
         self.application = application
         self.status = ''
 
-    def _start_response(self, status, _):
+    def _start_response(self, status, headers):
         self.status = status
+        self.headers = dict((k.lower(), v) for k, v in headers)
 
     def _request(self, url, method='POST', data=None, headers=dict()):
         url = urlparse.urlparse(url)
@@ -36,12 +35,12 @@ class Client:
             if isinstance(data, bytes):
                 env['wsgi.input'] = BytesIO(data)
                 env.update(dict(
-                    CONTENT_TYPE="application/octet-stream",
+                    CONTENT_TYPE=env.get("CONTENT_TYPE", "application/octet-stream"),
                     CONTENT_LENGTH="%s" % len(data)
                 ))
             else:
-                json_data = json.dumps(data or dict())
-                env['wsgi.input'] = StringIO(json_data)
+                json_data = protojson.get_json_backend().dumps(data or dict())
+                env['wsgi.input'] = BytesIO(json_data)
                 env.update(dict(
                     CONTENT_TYPE="application/json",
                     CONTENT_LENGTH="%s" % len(json_data)
@@ -49,11 +48,15 @@ class Client:
 
         resp = self.application(env, self._start_response)[0]
 
+        if isinstance(data, bytes):
+            # binary protocols, decoded by the caller
+            return resp
+
         try:
-            body = json.loads(resp)
+            body = protojson.get_json_backend().loads(resp)
         except ValueError:
             body = dict(
-                error_message=resp.strip()
+                error_message=resp.decode("utf-8").strip()
             )
         if self.status != '200 OK':
             body = dict(
@@ -85,6 +88,10 @@ class Application:
             self._app = service.service_mappings([(s.path, s) for s in self.services], registry_path=None)
         return self._app
 
+    @property
+    def content_types(self):
+        return remote.Protocols.get_default().content_types
+
     @property
     def client(self):
         if self._client is None:
@@ -98,17 +105,20 @@ class Application:
                 ('Access-Control-Max-Age', '600'),
                 ('Access-Control-Allow-Origin', '*')
             ])
-            return ['']
+            return [b'']
 
         if environ.get('REQUEST_METHOD') in ["GET", "POST"]:
             if environ.get('REQUEST_METHOD') in ["GET"]:
-                content = json.dumps(dict(urlparse.parse_qsl(environ.get('QUERY_STRING'))))
-                environ['wsgi.input'] = StringIO(content)
-                environ['CONTENT_LENGTH'] = len(content)
+                content = protojson.get_json_backend().dumps(dict(urlparse.parse_qsl(environ.get('QUERY_STRING'))))
+                environ['wsgi.input'] = BytesIO(content)
+                environ['CONTENT_LENGTH'] = str(len(content))
+                environ['CONTENT_TYPE'] = 'application/json'
 
             environ['REQUEST_METHOD'] = 'POST'
 
-            if environ.get('CONTENT_TYPE') not in ['application/octet-stream']:
+            # requests keep the content type of any registered protocol, JSON otherwise
+            content_type = (environ.get('CONTENT_TYPE') or '').split(';')[0].strip().lower()
+            if content_type not in self.content_types:
                 environ['CONTENT_TYPE'] = 'application/json'
 
             return self.app(
@@ -117,7 +127,7 @@ class Application:
             )
 
         start_response('405 Method Not Allowed', [('Allow', 'OPTIONS, GET, POST')])
-        return ['']
+        return [b'']
 
     def service(self, path, title=""):
         def decorator(f):
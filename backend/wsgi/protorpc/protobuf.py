@@ -0,0 +1,491 @@
+"""Protocol buffer wire format support for message types.
+
+Messages are encoded with the number and variant declared on each field, so
+they can be read by any protocol buffer implementation given the equivalent
+.proto definition.  Repeated fields are written unpacked and read packed or
+unpacked.  Fields with numbers unknown to the message type are kept as
+unrecognized fields and written back when the message is encoded again.
+
+Encoders and decoders are compiled once per message class.
+
+Public functions:
+  encode_message: Encodes a message in to protocol buffer bytes.
+  decode_message: Merge from protocol buffer bytes in to a message.
+"""
+
+import struct
+
+from . import messages
+
+__all__ = [
+    'ALTERNATIVE_CONTENT_TYPES',
+    'CONTENT_TYPE',
+    'encode_message',
+    'decode_message',
+]
+
+CONTENT_TYPE = 'application/x-protobuf'
+
+ALTERNATIVE_CONTENT_TYPES = [
+    'application/x-google-protobuf',
+]
+
+# Wire types.
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+_FIXED32 = 5
+
+_DOUBLE = struct.Struct('<d')
+_FLOAT = struct.Struct('<f')
+
+_UINT64_MASK = (1 << 64) - 1
+
+_WIRE_TYPES = {
+  messages.Variant.DOUBLE: _FIXED64,
+  messages.Variant.FLOAT: _FIXED32,
+  messages.Variant.INT64: _VARINT,
+  messages.Variant.UINT64: _VARINT,
+  messages.Variant.INT32: _VARINT,
+  messages.Variant.BOOL: _VARINT,
+  messages.Variant.STRING: _LENGTH_DELIMITED,
+  messages.Variant.MESSAGE: _LENGTH_DELIMITED,
+  messages.Variant.BYTES: _LENGTH_DELIMITED,
+  messages.Variant.UINT32: _VARINT,
+  messages.Variant.ENUM: _VARINT,
+  messages.Variant.SINT32: _VARINT,
+  messages.Variant.SINT64: _VARINT,
+}
+
+# Variants unrecognized fields are decoded as, by wire type.
+_UNRECOGNIZED_VARIANTS = {
+  _VARINT: messages.Variant.INT64,
+  _FIXED64: messages.Variant.DOUBLE,
+  _LENGTH_DELIMITED: messages.Variant.BYTES,
+  _FIXED32: messages.Variant.FLOAT,
+}
+
+_encoders = {}
+_decoders = {}
+
+
+def _write_varint(out, value):
+  if 0 <= value < 0x80:
+    out.append(value)
+    return
+  if not -(1 << 63) <= value <= _UINT64_MASK:
+    raise messages.EncodeError('Integer %d does not fit in 64 bits' % value)
+  # Negative numbers are written as 64 bit two's complement.
+  value &= _UINT64_MASK
+  while value > 0x7f:
+    out.append(value & 0x7f | 0x80)
+    value >>= 7
+  out.append(value)
+
+
+def _read_varint(data, pos):
+  result = data[pos]
+  if result < 0x80:
+    return result, pos + 1
+  result = 0
+  shift = 0
+  while True:
+    byte = data[pos]
+    pos += 1
+    result |= (byte & 0x7f) << shift
+    if not byte & 0x80:
+      return result, pos
+    shift += 7
+    if shift >= 70:
+      raise messages.DecodeError('Varint is too long')
+
+
+def _read_length(data, pos):
+  length, pos = _read_varint(data, pos)
+  end = pos + length
+  if end > len(data):
+    raise messages.DecodeError('Truncated length delimited value')
+  return pos, end
+
+
+def _value_writer(variant):
+  """Get the function writing a single value of variant.
+
+  Args:
+    variant: messages.Variant of the value, other than MESSAGE.
+
+  Returns:
+    Function (out, value) appending the encoded value to bytearray out.
+  """
+  if variant in (messages.Variant.SINT32, messages.Variant.SINT64):
+    return lambda out, value: _write_varint(out, (value << 1) ^ (value >> 63))
+  elif variant == messages.Variant.BOOL:
+    return lambda out, value: out.append(1 if value else 0)
+  elif variant == messages.Variant.ENUM:
+    return lambda out, value: _write_varint(out, int(value))
+  elif variant == messages.Variant.DOUBLE:
+    return lambda out, value: out.extend(_DOUBLE.pack(value))
+  elif variant == messages.Variant.FLOAT:
+    return lambda out, value: out.extend(_FLOAT.pack(value))
+  elif variant in (messages.Variant.STRING, messages.Variant.BYTES):
+    def write_bytes(out, value):
+      if isinstance(value, str):
+        value = value.encode('utf-8')
+      length = len(value)
+      if length < 0x80:
+        out.append(length)
+      else:
+        _write_varint(out, length)
+      out += value
+    return write_bytes
+  return _write_varint
+
+
+def _value_reader(variant):
+  """Get the function reading a single value of variant.
+
+  Args:
+    variant: messages.Variant of the value, other than MESSAGE and ENUM.
+
+  Returns:
+    Function (data, pos) returning the decoded value and the position after
+    it.
+  """
+  if variant in (messages.Variant.INT32, messages.Variant.INT64):
+    def read_int(data, pos):
+      value, pos = _read_varint(data, pos)
+      if value > 0x7fffffffffffffff:
+        value -= 1 << 64
+      return value, pos
+    return read_int
+  elif variant in (messages.Variant.SINT32, messages.Variant.SINT64):
+    def read_sint(data, pos):
+      value, pos = _read_varint(data, pos)
+      return (value >> 1) ^ -(value & 1), pos
+    return read_sint
+  elif variant == messages.Variant.BOOL:
+    def read_bool(data, pos):
+      value, pos = _read_varint(data, pos)
+      return bool(value), pos
+    return read_bool
+  elif variant == messages.Variant.DOUBLE:
+    return lambda data, pos: (_DOUBLE.unpack_from(data, pos)[0], pos + 8)
+  elif variant == messages.Variant.FLOAT:
+    return lambda data, pos: (_FLOAT.unpack_from(data, pos)[0], pos + 4)
+  elif variant == messages.Variant.STRING:
+    def read_string(data, pos):
+      pos, end = _read_length(data, pos)
+      try:
+        return data[pos:end].decode('utf-8'), end
+      except UnicodeDecodeError as err:
+        raise messages.DecodeError('Invalid UTF-8 string: %s' % err)
+    return read_string
+  elif variant == messages.Variant.BYTES:
+    def read_bytes(data, pos):
+      pos, end = _read_length(data, pos)
+      return data[pos:end], end
+    return read_bytes
+  return _read_varint
+
+
+def _skip_value(data, pos, wire_type):
+  """Read a value of a field unknown to the message type.
+
+  Returns:
+    Tuple (value, pos) of the value and the position after it.
+  """
+  variant = _UNRECOGNIZED_VARIANTS.get(wire_type)
+  if variant is None:
+    raise messages.DecodeError('Unsupported wire type %d' % wire_type)
+  return _value_reader(variant)(data, pos)
+
+
+def _get_encoder(message_type, compiling=None):
+  """Get the compiled encoder for a message class.
+
+  Args:
+    message_type: Message class to get the encoder for.
+    compiling: Encoders by message class compiled along with the one being
+      compiled, not published yet.
+
+  Returns:
+    Function (out, message) appending the encoded message to bytearray out.
+  """
+  global _encoders
+  try:
+    return _encoders[message_type]
+  except KeyError:
+    pass
+  if compiling is not None:
+    return (compiling.get(message_type) or
+            _compile_encoder(message_type, compiling))
+
+  compiling = {}
+  encoder = _compile_encoder(message_type, compiling)
+  # Published in a single assignment once complete, so other threads never
+  # use an encoder whose fields are still being compiled.
+  encoders = dict(_encoders)
+  encoders.update(compiling)
+  _encoders = encoders
+  return encoder
+
+
+def _compile_encoder(message_type, compiling):
+  """Compile an encoder for a message class.
+
+  Every field is turned in to a (number, repeated, key, write) entry, where
+  key is the encoded field number and wire type written before each value.
+  The encoder is registered in compiling, encoders not published yet.
+  """
+  plan = []
+
+  def encode(out, message):
+    tags = message._Message__tags
+    for number, repeated, key, write in plan:
+      value = tags.get(number)
+      if value is None:
+        continue
+      if repeated:
+        for item in value:
+          out.extend(key)
+          write(out, item)
+      else:
+        out.extend(key)
+        write(out, value)
+
+    unrecognized_fields = message._Message__unrecognized_fields
+    if unrecognized_fields:
+      for number, (value, variant) in unrecognized_fields.items():
+        # Fields decoded from other protocols may have names or values
+        # without a wire format, they are left out.
+        if (not isinstance(number, int) or number <= 0 or
+            variant == messages.Variant.MESSAGE):
+          continue
+        key = bytearray()
+        _write_varint(key, number << 3 | _WIRE_TYPES[variant])
+        write = _value_writer(variant)
+        for item in (value if isinstance(value, list) else [value]):
+          out.extend(key)
+          write(out, item)
+
+  # Registered before compiling the fields, so recursive message types find
+  # it.
+  compiling[message_type] = encode
+
+  for field in sorted(message_type.all_fields(), key=lambda f: f.number):
+    key = bytearray()
+    _write_varint(key, field.number << 3 | _WIRE_TYPES[field.variant])
+    plan.append((field.number, field.repeated, bytes(key),
+                 _field_writer(field, compiling)))
+  return encode
+
+
+def _field_writer(field, compiling):
+  """Get the function writing a single value of field."""
+  if not isinstance(field, messages.MessageField):
+    return _value_writer(field.variant)
+
+  encode_nested = _get_encoder(field.message_type, compiling)
+  # Fields like DateTimeField hold python values stored as messages.
+  to_message = (field.value_to_message
+                if field.type is not field.message_type else None)
+
+  def write_message(out, value):
+    if to_message is not None:
+      value = to_message(value)
+    nested = bytearray()
+    encode_nested(nested, value)
+    _write_varint(out, len(nested))
+    out += nested
+  return write_message
+
+
+def _get_decoder(message_type, compiling=None):
+  """Get the compiled decoder for a message class.
+
+  Args:
+    message_type: Message class to get the decoder for.
+    compiling: Decoders by message class compiled along with the one being
+      compiled, not published yet.
+
+  Returns:
+    Function (data, pos, end) decoding an instance of message_type from
+    data[pos:end].
+  """
+  global _decoders
+  try:
+    return _decoders[message_type]
+  except KeyError:
+    pass
+  if compiling is not None:
+    return (compiling.get(message_type) or
+            _compile_decoder(message_type, compiling))
+
+  compiling = {}
+  decoder = _compile_decoder(message_type, compiling)
+  # Published in a single assignment once complete, so other threads never
+  # use a decoder whose fields are still being compiled.
+  decoders = dict(_decoders)
+  decoders.update(compiling)
+  _decoders = decoders
+  return decoder
+
+
+def _compile_decoder(message_type, compiling):
+  """Compile a decoder for a message class.
+
+  The plan maps the key of every field, its number and wire type, to a
+  (number, repeated, read) entry.  Keys with another wire type, packed
+  repeated fields or fields unknown to the message type, take the slower
+  path.
+
+  Decoded values always have the type of their field, so they are stored
+  in the message's tags directly, skipping validation.  The decoder is
+  registered in compiling, decoders not published yet.
+  """
+  plan = {}
+  fields = {}
+
+  def decode(data, pos, end):
+    message = message_type()
+    tags = message._Message__tags
+    repeated_values = {}
+    unrecognized = None
+    while pos < end:
+      key, pos = _read_varint(data, pos)
+      entry = plan.get(key)
+
+      if entry is not None:
+        number, repeated, read = entry
+        value, pos = read(data, pos)
+        if repeated:
+          repeated_values.setdefault(number, []).append(value)
+        else:
+          tags[number] = value
+        continue
+
+      number = key >> 3
+      wire_type = key & 7
+      field = fields.get(number)
+      if field is None:
+        value, pos = _skip_value(data, pos, wire_type)
+        if unrecognized is None:
+          unrecognized = {}
+        unrecognized.setdefault(number, (wire_type, []))[1].append(value)
+      elif field.repeated and wire_type == _LENGTH_DELIMITED:
+        # Packed repeated scalars.
+        _, _, read = plan[number << 3 | _WIRE_TYPES[field.variant]]
+        pos, packed_end = _read_length(data, pos)
+        items = repeated_values.setdefault(number, [])
+        while pos < packed_end:
+          value, pos = read(data, pos)
+          items.append(value)
+        if pos != packed_end:
+          raise messages.DecodeError('Truncated packed field %s' % field.name)
+      else:
+        raise messages.DecodeError(
+          'Field %s can not be decoded from wire type %d' %
+          (field.name, wire_type))
+
+    if pos != end:
+      raise messages.DecodeError('Truncated message %s' %
+                                 message_type.definition_name())
+
+    for number, values in repeated_values.items():
+      tags[number] = messages.FieldList(fields[number], values)
+    if unrecognized is not None:
+      for number, (wire_type, values) in unrecognized.items():
+        message.set_unrecognized_field(
+          number, values if len(values) > 1 else values[0],
+          _UNRECOGNIZED_VARIANTS[wire_type])
+    return message
+
+  # Registered before compiling the fields, so recursive message types find
+  # it.
+  compiling[message_type] = decode
+
+  for field in message_type.all_fields():
+    fields[field.number] = field
+    key = field.number << 3 | _WIRE_TYPES[field.variant]
+    plan[key] = (field.number, field.repeated, _field_reader(field, compiling))
+  return decode
+
+
+def _field_reader(field, compiling):
+  """Get the function reading a single value of field."""
+  if isinstance(field, messages.MessageField):
+    decode_nested = _get_decoder(field.message_type, compiling)
+    from_message = (field.value_from_message
+                    if field.type is not field.message_type else None)
+
+    def read_message(data, pos):
+      pos, end = _read_length(data, pos)
+      value = decode_nested(data, pos, end)
+      if from_message is not None:
+        # e.g. a DateTimeField sent as an empty message
+        try:
+          value.check_initialized()
+          value = from_message(value)
+        except (messages.ValidationError, TypeError, ValueError) as err:
+          raise messages.DecodeError('Invalid value for %s: %s' %
+                                     (field.name, err))
+      return value, end
+    return read_message
+
+  if isinstance(field, messages.EnumField):
+    enum_type = field.type
+
+    def read_enum(data, pos):
+      number, pos = _read_varint(data, pos)
+      try:
+        return enum_type(number), pos
+      except TypeError:
+        raise messages.DecodeError('Invalid enum value %d for %s' %
+                                   (number, field.name))
+    return read_enum
+
+  return _value_reader(field.variant)
+
+
+def encode_message(message):
+  """Encode Message instance to protocol buffer bytes.
+
+  Args:
+    Message instance to encode in to protocol buffer bytes.
+
+  Returns:
+    Bytes encoding of Message instance in protocol buffer format.
+
+  Raises:
+    messages.ValidationError if message is not initialized.
+    messages.EncodeError if an integer does not fit in 64 bits.
+  """
+  message.check_initialized()
+
+  out = bytearray()
+  _get_encoder(type(message))(out, message)
+  return bytes(out)
+
+
+def decode_message(message_type, encoded_message):
+  """Decode protocol buffer bytes to Message instance.
+
+  Args:
+    message_type: Message type to decode data to.
+    encoded_message: Encoded version of message as bytes.
+
+  Returns:
+    Decoded instance of message_type.
+
+  Raises:
+    messages.DecodeError if an error occurs during decoding.
+    messages.ValidationError if merged message is not initialized.
+  """
+  data = bytes(encoded_message)
+  try:
+    message = _get_decoder(message_type)(data, 0, len(data))
+  except (IndexError, struct.error):
+    raise messages.DecodeError('Truncated message %s' %
+                               message_type.definition_name())
+  message.check_initialized()
+  return message
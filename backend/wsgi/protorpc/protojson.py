@@ -19,15 +19,20 @@
 
 Public classes:
   MessageJSONEncoder: JSON encoder for message objects.
+  JsonBackend: JSON library used to encode and decode messages.
 
 Public functions:
-  encode_message: Encodes a message in to a JSON string.
+  encode_message: Encodes a message in to JSON bytes.
   decode_message: Merge from a JSON string in to a message.
+  load_json_backend: Load a JSON backend, by default the fastest installed.
+  get_json_backend: Get the JSON backend in use.
+  set_json_backend: Set the JSON backend in use.
 """
 
 __author__ = 'rafek@google.com (Rafe Kaplan)'
 
 import base64
+import functools
 import logging
 
 from . import message_types
@@ -37,10 +42,14 @@ from . import util
 __all__ = [
     'ALTERNATIVE_CONTENT_TYPES',
     'CONTENT_TYPE',
+    'JsonBackend',
     'MessageJSONEncoder',
     'encode_message',
     'decode_message',
+    'get_json_backend',
+    'load_json_backend',
     'ProtoJson',
+    'set_json_backend',
 ]
 
 
@@ -80,6 +89,142 @@ def _load_json_module():
 json = _load_json_module()
 
 
+def _json_dumps(value):
+  return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+class JsonBackend(object):
+  """JSON library used to encode and decode protocol messages.
+
+  Wraps a JSON library behind the same two functions, dumps producing UTF-8
+  bytes ready to be sent, and loads accepting bytes or str.  Values the
+  library can not handle, like integers over 64 bits, are retried with the
+  standard json module so every backend accepts and produces the same data.
+
+  Attributes:
+    name: Name of the JSON library.
+  """
+
+  def __init__(self, name, dumps=_json_dumps, loads=json.loads):
+    """Constructor.
+
+    Args:
+      name: Name of the JSON library.
+      dumps: Function encoding a JSON serializable value to bytes.
+      loads: Function decoding bytes or str in to a value.
+    """
+    self.name = name
+    self.__dumps = dumps
+    self.__loads = loads
+
+  def dumps(self, value):
+    """Encode value to UTF-8 JSON bytes."""
+    try:
+      return self.__dumps(value)
+    except (TypeError, ValueError, OverflowError):
+      if self.__dumps is _json_dumps:
+        raise
+      return _json_dumps(value)
+
+  def loads(self, encoded):
+    """Decode JSON bytes or str.
+
+    Raises:
+      ValueError: If encoded is not valid JSON.
+    """
+    try:
+      return self.__loads(encoded)
+    except ValueError:
+      if self.__loads is json.loads:
+        raise
+      return json.loads(encoded)
+
+  def __repr__(self):
+    return '<JsonBackend %s>' % self.name
+
+
+def _orjson_backend():
+  import orjson
+  return JsonBackend(
+    'orjson',
+    lambda value: orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS),
+    orjson.loads)
+
+
+def _ujson_backend():
+  import ujson
+  return JsonBackend(
+    'ujson',
+    lambda value: ujson.dumps(
+      value, ensure_ascii=False, escape_forward_slashes=False).encode('utf-8'),
+    ujson.loads)
+
+
+def _simdjson_backend():
+  # simdjson only parses, encoding is left to the json module.
+  import simdjson
+  return JsonBackend('simdjson', loads=simdjson.loads)
+
+
+JSON_BACKENDS = [
+  ('orjson', _orjson_backend),
+  ('ujson', _ujson_backend),
+  ('simdjson', _simdjson_backend),
+  ('json', lambda: JsonBackend('json')),
+]
+
+
+def load_json_backend(name=None):
+  """Load a JSON backend.
+
+  Args:
+    name: Name of the backend to use, one of JSON_BACKENDS.  None picks the
+      fastest one installed.
+
+  Returns:
+    JsonBackend instance.
+
+  Raises:
+    ValueError if name is not a known backend.
+    ImportError if the named backend is not installed.
+  """
+  backends = dict(JSON_BACKENDS)
+  if name:
+    if name not in backends:
+      raise ValueError('Unknown json backend: %s' % name)
+    return backends[name]()
+
+  for _, load in JSON_BACKENDS:
+    try:
+      return load()
+    except ImportError:
+      pass
+
+
+_json_backend = load_json_backend()
+
+
+def get_json_backend():
+  """Get the JSON backend used by ProtoJson instances without their own."""
+  return _json_backend
+
+
+def set_json_backend(backend):
+  """Set the JSON backend used by ProtoJson instances without their own.
+
+  Args:
+    backend: JsonBackend instance, or the name of one to load.
+
+  Returns:
+    The JsonBackend instance now in use.
+  """
+  global _json_backend
+  if not isinstance(backend, JsonBackend):
+    backend = load_json_backend(backend)
+  _json_backend = backend
+  return backend
+
+
 # TODO: Rename this to MessageJsonEncoder.
 class MessageJSONEncoder(json.JSONEncoder):
   """Message JSON encoder class.
@@ -140,6 +285,15 @@ class ProtoJson(object):
       'text/json',
   ]
 
+  def __init__(self, json_backend=None):
+    """Constructor.
+
+    Args:
+      json_backend: JsonBackend to encode and decode with, None to use the
+        one set with set_json_backend.
+    """
+    self.json_backend = json_backend
+
   def encode_field(self, field, value):
     """Encode a python field value to a JSON value.
 
@@ -170,21 +324,161 @@ class ProtoJson(object):
       Message instance to encode in to JSON string.
 
     Returns:
-      String encoding of Message instance in protocol JSON format.
+      UTF-8 bytes encoding of Message instance in protocol JSON format.
 
     Raises:
       messages.ValidationError if message is not initialized.
     """
     message.check_initialized()
 
-    return json.dumps(message, cls=MessageJSONEncoder, protojson_protocol=self)
+    return (self.json_backend or _json_backend).dumps(
+      self.encode_object(message))
+
+  def encode_object(self, message):
+    """Encode Message instance to a JSON serializable dictionary.
+
+    Produces the same structure as MessageJSONEncoder, using an encoder
+    compiled once per message class instead of inspecting every field of
+    every message.
+
+    Args:
+      message: Message instance to encode.
+
+    Returns:
+      Dictionary of the assigned fields of message.
+    """
+    return self.__get_encoder(type(message))(message)
+
+  def __get_encoder(self, message_type, compiling=None):
+    """Get the compiled encoder for a message class.
+
+    Args:
+      message_type: Message class to get the encoder for.
+      compiling: Encoders by message class compiled along with the one being
+        compiled, not published yet.
+
+    Returns:
+      Function encoding an instance of message_type to a dictionary.
+    """
+    try:
+      return self.__encoders[message_type]
+    except AttributeError:
+      self.__encoders = {}
+    except KeyError:
+      pass
+    if compiling is not None:
+      return (compiling.get(message_type) or
+              self.__compile_encoder(message_type, compiling))
+
+    compiling = {}
+    encoder = self.__compile_encoder(message_type, compiling)
+    # Published in a single assignment once complete, so other threads never
+    # use an encoder whose fields are still being compiled.
+    encoders = dict(self.__encoders)
+    encoders.update(compiling)
+    self.__encoders = encoders
+    return encoder
+
+  def __compile_encoder(self, message_type, compiling):
+    """Compile an encoder for a message class.
+
+    Every field is turned in to a (name, number, repeated, convert, each)
+    entry, where convert is None for values JSON can serialize as they are
+    and each tells whether it converts the items of a repeated value one by
+    one.  The encoder then only reads the assigned values from the message's
+    tags.
+
+    Args:
+      message_type: Message class to compile the encoder for.
+      compiling: Encoders by message class compiled but not published yet.
+
+    Returns:
+      Function encoding an instance of message_type to a dictionary.
+    """
+    plan = []
+
+    def encode(message):
+      tags = message._Message__tags
+      result = {}
+      for name, number, repeated, convert, each in plan:
+        value = tags.get(number)
+        if value is None or (repeated and not value):
+          continue
+        if convert is None:
+          result[name] = value
+        elif each:
+          result[name] = [convert(item) for item in value]
+        else:
+          result[name] = convert(value)
+      unrecognized_fields = message._Message__unrecognized_fields
+      if unrecognized_fields:
+        for key, (value, _) in unrecognized_fields.items():
+          result[key] = value
+      return result
+
+    # Registered before compiling the fields, so recursive message types
+    # find it.
+    compiling[message_type] = encode
+
+    custom_encode_field = type(self).encode_field is not ProtoJson.encode_field
+    for field in sorted(message_type.all_fields(), key=lambda f: f.number):
+      if custom_encode_field:
+        plan.append((field.name, field.number, field.repeated,
+                     self.__custom_field_encoder(field), False))
+      else:
+        plan.append((field.name, field.number, field.repeated,
+                     self.__field_encoder(field, compiling), field.repeated))
+    return encode
+
+  def __field_encoder(self, field, compiling):
+    """Get the function converting a single value of field for JSON.
+
+    Args:
+      field: A ProtoRPC field instance.
+      compiling: Encoders by message class compiled but not published yet.
+
+    Returns:
+      Function converting a value, or None if values need no conversion.
+    """
+    if isinstance(field, messages.BytesField):
+      return lambda value: base64.b64encode(value).decode('ascii')
+    elif isinstance(field, message_types.DateTimeField):
+      return lambda value: value.isoformat()
+    elif isinstance(field, messages.EnumField):
+      return str
+    elif isinstance(field, messages.MessageField):
+      field_type = field.type
+      get_encoder = self.__get_encoder
+      nested = get_encoder(field_type, compiling)
+      return lambda value: (nested(value) if type(value) is field_type
+                            else get_encoder(type(value))(value))
+    return None
+
+  def __custom_field_encoder(self, field):
+    """Get the function encoding field with an overridden encode_field.
+
+    Args:
+      field: A ProtoRPC field instance.
+
+    Returns:
+      Function converting a value of field, repeated or not, for JSON.
+    """
+    def to_json(value):
+      if isinstance(value, messages.Message):
+        return self.encode_object(value)
+      elif isinstance(value, messages.Enum):
+        return str(value)
+      elif isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+      return value
+    return lambda value: to_json(self.encode_field(field, value))
 
   def decode_message(self, message_type, encoded_message):
     """Merge JSON structure to Message instance.
 
     Args:
       message_type: Message to decode data to.
-      encoded_message: JSON encoded version of message.
+      encoded_message: JSON encoded version of message, bytes or str.
 
     Returns:
       Decoded instance of message_type.
@@ -196,11 +490,25 @@ class ProtoJson(object):
     if not encoded_message.strip():
       return message_type()
 
-    dictionary = json.loads(encoded_message)
+    dictionary = (self.json_backend or _json_backend).loads(encoded_message)
     message = self.__decode_dictionary(message_type, dictionary)
     message.check_initialized()
     return message
 
+  def decode_object(self, message_type, dictionary):
+    """Decode a dictionary as parsed from JSON to a Message instance.
+
+    The reverse of encode_object, for protocols sharing the JSON structure.
+
+    Args:
+      message_type: Message class to decode to.
+      dictionary: Dictionary of field names to values.
+
+    Returns:
+      Decoded instance of message_type, not checked for initialization.
+    """
+    return self.__decode_dictionary(message_type, dictionary)
+
   def __find_variant(self, value):
     """Find the messages.Variant type that describes this value.
 
@@ -244,45 +552,200 @@ class ProtoJson(object):
       dictionary: Dictionary to extract information from.  Dictionary
         is as parsed from JSON.  Nested objects will also be dictionaries.
     """
-    message = message_type()
-    for key, value in dictionary.items():
-      if value is None:
-        try:
-          message.reset(key)
-        except AttributeError:
-          pass  # This is an unrecognized field, skip it.
-        continue
+    return self.__get_decoder(message_type)(dictionary)
 
-      try:
-        field = message.field_by_name(key)
-      except KeyError:
-        # Save unknown values.
-        variant = self.__find_variant(value)
-        if variant:
-          if key.isdigit():
-            key = int(key)
-          message.set_unrecognized_field(key, value, variant)
-        else:
-          logging.warning('No variant found for unrecognized field: %s', key)
-        continue
+  def __get_decoder(self, message_type, compiling=None):
+    """Get the compiled decoder for a message class.
+
+    Args:
+      message_type: Message class to get the decoder for.
+      compiling: Decoders by message class compiled along with the one being
+        compiled, not published yet.
+
+    Returns:
+      Function decoding a dictionary to an instance of message_type.
+    """
+    try:
+      return self.__decoders[message_type]
+    except AttributeError:
+      self.__decoders = {}
+    except KeyError:
+      pass
+    if compiling is not None:
+      return (compiling.get(message_type) or
+              self.__compile_decoder(message_type, compiling))
+
+    compiling = {}
+    decoder = self.__compile_decoder(message_type, compiling)
+    # Published in a single assignment once complete, so other threads never
+    # use a decoder whose fields are still being compiled.
+    decoders = dict(self.__decoders)
+    decoders.update(compiling)
+    self.__decoders = decoders
+    return decoder
+
+  def __compile_decoder(self, message_type, compiling):
+    """Compile a decoder for a message class.
+
+    The decoder looks fields up in a table of name to (field, convert,
+    store) entries prepared once per class, where convert decodes a single
+    JSON value and store assigns the decoded value.  Values already of the
+    field's type are stored directly in the message's tags, anything else
+    goes through the validating setattr, so errors are the same as when
+    decoding field by field.
+
+    Args:
+      message_type: Message class to compile the decoder for.
+      compiling: Decoders by message class compiled but not published yet.
+
+    Returns:
+      Function decoding a dictionary to an instance of message_type.
+    """
+    plan = {}
+    find_variant = self.__find_variant
+
+    def decode(dictionary):
+      message = message_type()
+      for key, value in dictionary.items():
+        entry = plan.get(key)
+        if value is None:
+          try:
+            message.reset(key)
+          except AttributeError:
+            pass  # This is an unrecognized field, skip it.
+          continue
 
-      # Normalize values in to a list.
-      if isinstance(value, list):
-        if not value:
+        if entry is None:
+          # Save unknown values.
+          variant = find_variant(value)
+          if variant:
+            if isinstance(key, str) and key.isdigit():
+              key = int(key)
+            message.set_unrecognized_field(key, value, variant)
+          else:
+            logging.warning('No variant found for unrecognized field: %s', key)
           continue
+
+        field, convert, store = entry
+        # Normalize values in to a list.
+        if isinstance(value, list):
+          if not value:
+            continue
+        else:
+          value = [value]
+
+        if convert is not None:
+          value = [convert(item) for item in value]
+        store(message, value)
+      return message
+
+    # Registered before compiling the fields, so recursive message types
+    # find it.
+    compiling[message_type] = decode
+
+    custom_decode_field = type(self).decode_field is not ProtoJson.decode_field
+    for field in message_type.all_fields():
+      if custom_decode_field:
+        convert = functools.partial(self.decode_field, field)
       else:
-        value = [value]
+        convert = self.__field_decoder(field, compiling)
+      plan[field.name] = (field, convert, self.__field_store(field))
+    return decode
 
-      valid_value = []
-      for item in value:
-        valid_value.append(self.decode_field(field, item))
+  def __field_decoder(self, field, compiling):
+    """Get the function decoding a single JSON value of field.
 
-      if field.repeated:
-        existing_value = getattr(message, field.name)
-        setattr(message, field.name, valid_value)
+    Does the same as decode_field, without deciding what to do for every
+    value.
+
+    Args:
+      field: A ProtoRPC field instance.
+      compiling: Decoders by message class compiled but not published yet.
+
+    Returns:
+      Function decoding a value, or None if values are used as they are.
+    """
+    if isinstance(field, messages.EnumField):
+      enum_type = field.type
+
+      def decode_enum(value):
+        try:
+          return enum_type(value)
+        except TypeError:
+          raise messages.DecodeError('Invalid enum value "%s"' % (value or ''))
+      return decode_enum
+
+    elif isinstance(field, messages.BytesField):
+      def decode_bytes(value):
+        try:
+          return base64.b64decode(value)
+        except TypeError as err:
+          raise messages.DecodeError('Base64 decoding error: %s' % err)
+      return decode_bytes
+
+    elif isinstance(field, message_types.DateTimeField):
+      def decode_datetime(value):
+        try:
+          return util.decode_datetime(value)
+        except ValueError as err:
+          raise messages.DecodeError(err)
+      return decode_datetime
+
+    elif (isinstance(field, messages.MessageField) and
+          issubclass(field.type, messages.Message)):
+      return self.__get_decoder(field.type, compiling)
+
+    elif isinstance(field, messages.FloatField):
+      def decode_float(value):
+        if isinstance(value, (int, str)):
+          try:
+            return float(value)
+          except (ValueError, OverflowError):
+            pass
+        return value
+      return decode_float
+
+    elif isinstance(field, messages.IntegerField):
+      def decode_integer(value):
+        if isinstance(value, str):
+          try:
+            return int(value)
+          except ValueError:
+            pass
+        return value
+      return decode_integer
+
+    return None
+
+  def __field_store(self, field):
+    """Get the function assigning decoded values to field.
+
+    Args:
+      field: A ProtoRPC field instance.
+
+    Returns:
+      Function taking a message and the list of decoded values.
+    """
+    name = field.name
+    number = field.number
+
+    if field.repeated:
+      def store_repeated(message, values):
+        # FieldList validates every item, like assigning the list would.
+        message._Message__tags[number] = messages.FieldList(field, values)
+      return store_repeated
+
+    field_type = field.type
+    if not isinstance(field_type, type):
+      field_type = None
+
+    def store(message, values):
+      value = values[-1]
+      if type(value) is field_type:
+        message._Message__tags[number] = value
       else:
-        setattr(message, field.name, valid_value[-1])
-    return message
+        setattr(message, name, value)
+    return store
 
   def decode_field(self, field, value):
     """Decode a JSON value to a python value.
@@ -113,8 +113,10 @@ from wsgiref import headers as wsgi_headers
 
 from . import message_types
 from . import messages
+from . import protobuf
 from . import protobytes
 from . import protojson
+from . import protomsgpack
 from . import util
 
 
@@ -1211,6 +1213,8 @@ class Protocols(object):
     """
     protocols = cls()
     protocols.add_protocol(protobytes, 'protobytes')
+    protocols.add_protocol(protobuf, 'protobuf')
+    protocols.add_protocol(protomsgpack.ProtoMsgpack(), 'protomsgpack')
     protocols.add_protocol(protojson.ProtoJson.get_default(), 'protojson')
     return protocols
 
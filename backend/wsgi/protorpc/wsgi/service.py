@@ -136,7 +136,8 @@ def service_mapping(service_factory, service_path=r'.*', protocols=None):
       error_handler = wsgi_util.error(
         status_code,
         content_type=protocol.default_content_type,
-        content=encoded_status)
+        content=encoded_status,
+        pad=False)
       return error_handler(environ, start_response)
 
     method = remote_methods.get(method_name)
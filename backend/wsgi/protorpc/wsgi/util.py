@@ -46,7 +46,8 @@ def static_page(content='',
   It will always serve the same status, content and headers.
 
   Args:
-    content: Content to serve in response to HTTP request.
+    content: Content to serve in response to HTTP request, str is encoded
+      as UTF-8.
     status: Status to serve in response to HTTP request.  If string, status
       is served as is without any error checking.  If integer, will look up
       status message.  Otherwise, parameter is tuple (status, description):
@@ -69,6 +70,10 @@ def static_page(content='',
   if isinstance(headers, dict):
     headers = iter(headers.items())
 
+  # Encoded once here, so every response serves the same bytes.
+  if isinstance(content, str):
+    content = content.encode('utf-8')
+
   headers = [('content-length', str(len(content))),
              ('content-type', content_type),
             ] + list(headers or [])
@@ -92,7 +97,7 @@ def static_page(content='',
 @util.positional(2)
 def error(status_code, status_message=None,
           content_type='text/plain; charset=utf-8',
-          headers=None, content=None):
+          headers=None, content=None, pad=True):
   """Create WSGI gunicorn that statically serves an error page.
 
   Creates a static error page specifically for non-200 HTTP responses.
@@ -107,6 +112,8 @@ def error(status_code, status_message=None,
   Args:
     status_code: Integer status code of error.
     status_message: Status message.
+    pad: Whether to pad the content, False for content read by programs,
+      which binary content could not be padded for.
 
   Returns:
     Static WSGI gunicorn that sends static error response.
@@ -117,7 +124,8 @@ def error(status_code, status_message=None,
   if content is None:
     content = status_message
 
-  content = util.pad_string(content)
+  if pad:
+    content = util.pad_string(content)
 
   return static_page(content,
                      status=(status_code, status_message),
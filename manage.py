@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+import argparse
+import itertools
+import json
+import logging
+import sys
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("%s is not a positive number" % value)
+    return number
+
+
+def ndb_client(stub):
+    if stub:
+        # run against the local in memory stubs instead of the datastore
+        import backend.stub.logging  # noqa F401
+        import backend.stub.ndb  # noqa F401
+        #
+
+    from google.cloud import ndb
+
+    return ndb.Client()
+
+
+def migrate_movie_keys(args):
+    from backend import movie
+
+    migrated, removed = movie.Movie.migrate_keys(batch_size=args.batch_size)
+    print("Migrated %s movies, removed %s duplicates" % (migrated, removed))
+
+
+def migrate_user_keys(args):
+    from backend import user
+
+    migrated, removed = user.UserCredentials.migrate_keys(batch_size=args.batch_size)
+    print("Migrated %s credentials, removed %s duplicates" % (migrated, removed))
+
+
+def reindex_movies(args):
+    from backend import movie
+
+    print("Reindexed %s movies" % movie.Movie.reindex(batch_size=args.batch_size))
+
+
+def reindex_users(args):
+    from backend import user
+
+    print("Reindexed %s users" % user.User.reindex(batch_size=args.batch_size))
+
+
+def reindex_emails(args):
+    from backend import user
+
+    print("Reindexed %s credentials" % user.UserCredentials.reindex(batch_size=args.batch_size))
+
+
+def reindex_sessions(args):
+    from backend import oauth2
+
+    print("Reindexed %s sessions" % oauth2.Oauth2.reindex(batch_size=args.batch_size))
+
+
+def read_lines(path):
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                yield number, line
+
+
+def validate_import(path):
+    """
+    Returns why the first invalid line of an import file is invalid, None if
+    they are all valid.
+    """
+    from backend import error, movie
+
+    for number, line in read_lines(path):
+        try:
+            movie.Movie.validate_result(json.loads(line))
+        except (KeyError, ValueError, error.Error) as e:
+            return "line %s is invalid: %s: %s" % (number, type(e).__name__, e)
+    return None
+
+
+def import_movies(args):
+    from backend import movie
+
+    # validate the whole file first, so an invalid movie doesn't leave it half imported
+    invalid = validate_import(args.file)
+    if invalid:
+        sys.exit("Nothing imported, %s" % invalid)
+
+    created = 0
+    results = (json.loads(line) for _, line in read_lines(args.file))
+    try:
+        while True:
+            chunk = list(itertools.islice(results, args.chunk_size))
+            if not chunk:
+                break
+            created += len(movie.Movie.create_many_from_results(chunk, chunk_size=args.chunk_size))
+    except Exception:
+        print("Imported %s movies before failing, run the import again to resume, imported movies are skipped"
+              % created)
+        raise
+    print("Imported %s movies" % created)
+
+
+def seed_snapshot(args):
+    from backend.setup import Seed
+
+    seed = Seed(concurrency=args.concurrency, rate_limit=args.rate_limit)
+    header = seed.snapshot(args.file)
+    print("Wrote snapshot %s with %s movies, %s failed" % (header["id"], header["count"], len(seed.failures)))
+
+
+def seed_load(args):
+    from backend.setup import Seed
+
+    if Seed().load(args.file, chunk_size=args.chunk_size):
+        print("Loaded snapshot %s" % args.file)
+    else:
+        print("Snapshot %s already loaded" % args.file)
+
+
+def sweep_sessions(args):
+    from backend import oauth2
+
+    result = oauth2.Oauth2.sweep(batch_size=args.batch_size, cursor=args.cursor, max_batches=args.max_batches)
+    print("Removed %s sessions and %s revoked tokens in %s batches" % (
+        result["sessions"], result["revoked_tokens"], result["batches"]))
+    if result["cursor"]:
+        print("Resume with --cursor %s" % result["cursor"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stub", dest="stub", action="store_true", default=False,
+                        help="Run against the local in memory datastore stub")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("migrate_movie_keys", help="Re-key movies by imdb id")
+    command.add_argument("-b", "--batch-size", dest="batch_size", type=int, default=100,
+                         help="Number of movies migrated per datastore batch")
+    command.set_defaults(func=migrate_movie_keys)
+
+    command = commands.add_parser("migrate_user_keys", help="Re-key user credentials by a fixed id")
+    command.add_argument("-b", "--batch-size", dest="batch_size", type=int, default=100,
+                         help="Number of credentials migrated per datastore batch")
+    command.set_defaults(func=migrate_user_keys)
+
+    command = commands.add_parser("reindex_movies", help="Rewrite movies to index their typed list properties")
+    command.add_argument("-b", "--batch-size", dest="batch_size", type=int, default=100,
+                         help="Number of movies written per datastore batch")
+    command.set_defaults(func=reindex_movies)
+
+    command = commands.add_parser("reindex_users", help="Rewrite users to index their search prefixes")
+    command.add_argument("-b", "--batch-size", dest="batch_size", type=int, default=100,
+                         help="Number of users written per datastore batch")
+    command.set_defaults(func=reindex_users)
+
+    command = commands.add_parser("reindex_emails", help="Rewrite credentials to index their emails")
+    command.add_argument("-b", "--batch-size", dest="batch_size", type=int, default=100,
+                         help="Number of credentials written per datastore batch")
+    command.set_defaults(func=reindex_emails)
+
+    command = commands.add_parser("reindex_sessions", help="Rewrite sessions to index when they expire")
+    command.add_argument("-b", "--batch-size", dest="batch_size", type=int, default=100,
+                         help="Number of sessions written per datastore batch")
+    command.set_defaults(func=reindex_sessions)
+
+    command = commands.add_parser("import", help="Import movies from a JSON lines file of OMDB results")
+    command.add_argument("file", help="File with one OMDB movie result per line")
+    command.add_argument("-c", "--chunk-size", dest="chunk_size", type=int, default=500,
+                         help="Number of movies written per datastore batch")
+    command.set_defaults(func=import_movies)
+
+    command = commands.add_parser("seed_snapshot", help="Fetch the seed movies from OMDB into a snapshot file")
+    command.add_argument("file", help="Snapshot file to write")
+    command.add_argument("--concurrency", dest="concurrency", type=int, default=10,
+                         help="Number of concurrent OMDB requests")
+    command.add_argument("--rate-limit", dest="rate_limit", type=float, default=None,
+                         help="Maximum number of OMDB requests per second")
+    command.set_defaults(func=seed_snapshot)
+
+    command = commands.add_parser("seed_load", help="Load a seed snapshot file, once per snapshot")
+    command.add_argument("file", help="Snapshot file to load")
+    command.add_argument("-c", "--chunk-size", dest="chunk_size", type=int, default=500,
+                         help="Number of movies written per datastore batch")
+    command.set_defaults(func=seed_load)
+
+    command = commands.add_parser("sweep_sessions", help="Delete sessions that can no longer be renewed")
+    command.add_argument("-b", "--batch-size", dest="batch_size", type=int, default=500,
+                         help="Number of sessions deleted per datastore batch")
+    command.add_argument("--max-batches", dest="max_batches", type=positive_int, default=None,
+                         help="Stop after this many batches, printing a cursor to resume from")
+    command.add_argument("--cursor", dest="cursor", default=None,
+                         help="Resume an earlier sweep from its cursor")
+    command.set_defaults(func=sweep_sessions)
+
+    args = parser.parse_args()
+
+    with ndb_client(args.stub).context():
+        args.func(args)